@@ -0,0 +1,160 @@
+"""Database settings benchmark: the request mix of server-log.txt under each engine configuration.
+
+    python benchmarks/db_settings.py --requests 2000 --threads 8 [--database-url postgresql://...]
+
+For every setting a fresh database is seeded with borrowers holding approvals, then requests are
+drawn in the same proportions as the endpoints in the access log and sent by --threads threads.
+Decisions are asked for the sample application of constants.py and scored by the risk model.
+The bank is stubbed, admission control is off, so the numbers are about the database.
+"""
+import argparse
+import base64
+import json
+import os
+import random
+import re
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from wk_client import create_app, db, risk_model  # noqa: E402
+from wk_client.auth_utils import create_users  # noqa: E402
+from wk_client.config import Config  # noqa: E402
+from wk_client.constants import SAMPLE_APPLICATION  # noqa: E402
+from wk_client.logic import approve_user  # noqa: E402
+from wk_client.models import User  # noqa: E402
+
+LOG_LINE = re.compile(r'"(?P<method>[A-Z]+) (?P<path>/[^ ?"]*)')
+ENDPOINTS = {('GET', '/get_info'), ('POST', '/get_decision'), ('POST', '/register'), ('POST', '/request_funding')}
+NOW = datetime(2019, 2, 23, 16, 40)
+DECISION_DATA = dict(SAMPLE_APPLICATION, basic_questions=dict(SAMPLE_APPLICATION['basic_questions'],
+                                                             amount_requested=5000))
+
+SQLITE_SETTINGS = {
+    'sqlite default': {'SQLITE_PRAGMAS': {}},
+    'sqlite tuned': {'SQLITE_PRAGMAS': Config.SQLITE_PRAGMAS},
+}
+
+
+def request_mix(filename):
+    counts = Counter()
+    with open(filename) as f:
+        for line in f:
+            match = LOG_LINE.search(line)
+            if match and (match.group('method'), match.group('path')) in ENDPOINTS:
+                counts[match.group('method'), match.group('path')] += 1
+    return counts
+
+
+def seed(app, n_users):
+    with app.app_context():
+        db.create_all()
+        create_users(('user{}'.format(i), 'pass', 'acc{}'.format(i)) for i in range(n_users))
+        for user in User.query:
+            approve_user(user, NOW - timedelta(minutes=5), amount=25000, interest_rate=0.0005)
+        return {user.username: decision_id for user, decision_id in
+                ((u, u.decisions[0].id) for u in User.query)}
+
+
+def send_cash(amount, account_to):
+    return {'amount': amount, 'timestamp': NOW, 'bank_ref': str(uuid.uuid4())}
+
+
+def make_request(client, method, path, username, approvals):
+    credentials = base64.b64encode('{}:pass'.format(username).encode()).decode()
+    headers = {'Authorization': 'Basic ' + credentials, 'Timestamp': NOW.isoformat()}
+    if path == '/get_info':
+        return client.get(path)
+    if path == '/register':
+        # Most registrations in the log are duplicates.
+        name = username if random.random() < 0.9 else uuid.uuid4().hex
+        data = {'username': name, 'password': 'pass', 'bank_account': name}
+    elif path == '/get_decision':
+        data = DECISION_DATA
+    else:
+        data = {'amount': 1000, 'approval_reference': approvals[username]}
+    return client.open(path, method=method, data=json.dumps(data), content_type='application/json', headers=headers)
+
+
+def run(name, config, mix, args):
+    app = create_app(type('BenchmarkConfig', (Config,), dict(
+        config, LOG_FILENAME=None, USER_RATE=0, ADMISSION_LIMITS={}, PROFILE_TOKEN=None, PROFILE_SAMPLE_RATE=0)))
+    approvals = seed(app, args.users)
+    usernames = list(approvals)
+    endpoints = list(mix)
+    weights = [mix[e] for e in endpoints]
+    rng = random.Random(0)
+    requests = [(rng.choices(endpoints, weights)[0], rng.choice(usernames)) for _ in range(args.requests)]
+
+    local = threading.local()
+    latencies = {}
+    errors = Counter()
+
+    def send(request):
+        (method, path), username = request
+        if not hasattr(local, 'client'):
+            local.client = app.test_client()
+        start = time.perf_counter()
+        response = make_request(local.client, method, path, username, approvals)
+        latencies.setdefault(path, []).append(time.perf_counter() - start)
+        if response.status_code >= 500:
+            errors[path] += 1
+
+    with mock.patch('wk_client.bank.send_cash', send_cash):
+        risk_model.get_classifier()  # Trained before the timings, as the production server does.
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.threads) as executor:
+            list(executor.map(send, requests))
+        duration = time.perf_counter() - start
+
+    with app.app_context():
+        db.session.remove()
+        db.get_engine(app).dispose()
+
+    all_latencies = sorted(l for values in latencies.values() for l in values)
+    print('{:<20} {:>8.1f} {:>9.1f} {:>9.1f} {:>7}'.format(
+        name, len(requests) / duration, 1000 * statistics.median(all_latencies),
+        1000 * all_latencies[int(0.99 * (len(all_latencies) - 1))], sum(errors.values())))
+    for path, values in sorted(latencies.items()):
+        values.sort()
+        print('    {:<16} {:>6} {:>9.1f} {:>9.1f}'.format(
+            path, len(values), 1000 * statistics.median(values), 1000 * values[int(0.99 * (len(values) - 1))]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare database settings on the access log request mix.')
+    parser.add_argument('--log', default=os.path.join(ROOT, 'server-log.txt'))
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--database-url', help='Also run against this (empty, e.g. Postgres) database.')
+    args = parser.parse_args()
+
+    mix = request_mix(args.log)
+    print('mix: ' + ', '.join('{} {} {:.1%}'.format(m, p, n / sum(mix.values())) for (m, p), n in mix.items()))
+    print('{:<20} {:>8} {:>9} {:>9} {:>7}'.format('setting', 'req/s', 'p50 ms', 'p99 ms', '5xx'))
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for name, config in SQLITE_SETTINGS.items():
+            uri = 'sqlite:///' + os.path.join(tmp_dir, name.replace(' ', '_') + '.db')
+            run(name, dict(config, SQLALCHEMY_DATABASE_URI=uri), mix, args)
+    finally:
+        shutil.rmtree(tmp_dir)
+    if args.database_url:
+        run('database url', {'SQLALCHEMY_DATABASE_URI': args.database_url}, mix, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,313 @@
+"""End-to-end funnel benchmark: every stage of a borrower's life, with a mock bank.
+
+    python benchmarks/funnel.py --borrowers 200 --concurrency 8 --output funnel.json
+    python benchmarks/funnel.py --compare funnel-before.json funnel.json
+
+The stages run one after the other, each for all borrowers from --concurrency threads:
+register, get_decision, request_funding, get_schedule (--polls times per borrower), and
+repayment_sync, where the mock bank receives the next instalment of every borrower and the
+app fetches the statement (--rounds times, a batch job, so from one thread).
+
+For every stage the JSON file has throughput, latency percentiles, errors (non-2xx), the number
+of database queries and the peak RSS of the process at the end of the stage. Decisions are asked
+for the sample application of constants.py and go through the risk model (trained before the
+timings); the get_decision stage reports how many were approved and declined. Declined borrowers
+are then approved directly, outside the timings, so the later stages see all borrowers.
+Admission control and rate limits are off, so the numbers are about the work of each stage.
+"""
+import argparse
+import base64
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from unittest import mock
+
+from sqlalchemy import event
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from wk_client import bank, create_app, db, risk_model  # noqa: E402
+from wk_client.config import Config  # noqa: E402
+from wk_client.constants import SAMPLE_APPLICATION  # noqa: E402
+from wk_client.logic import approve_user  # noqa: E402
+from wk_client.models import User  # noqa: E402
+from wk_client.utils import parse_datetime  # noqa: E402
+
+NOW = datetime(2019, 2, 23, 16, 40)
+PASSWORD = 'pass'
+FUNDING_AMOUNT = 5000
+DECISION_DATA = dict(SAMPLE_APPLICATION, basic_questions=dict(SAMPLE_APPLICATION['basic_questions'],
+                                                             amount_requested=FUNDING_AMOUNT))
+
+
+class MockBank(object):
+    """Keeps the statement of our account in memory: fundings out, repayments in."""
+    def __init__(self):
+        self.statement = []
+        self._lock = threading.Lock()
+
+    def _record(self, amount_in, amount_out, dt, account):
+        reference = str(uuid.uuid4())
+        with self._lock:
+            self.statement.append({'in': amount_in, 'out': amount_out, 'datetime': dt, 'reference': reference,
+                                   'account': account})
+        return reference
+
+    def send_cash(self, amount, account_to):
+        return {'amount': amount, 'timestamp': NOW, 'bank_ref': self._record(0, amount, NOW, account_to)}
+
+    def pay(self, account, amount, dt):
+        self._record(amount, 0, dt, account)
+
+    def retrieve_cashflows(self):
+        with self._lock:
+            return list(self.statement)
+
+
+class QueryCounter(object):
+    def __init__(self, engine):
+        self.count = 0
+        self._lock = threading.Lock()
+        event.listen(engine, 'before_cursor_execute', self._executed)
+
+    def _executed(self, *args):
+        with self._lock:
+            self.count += 1
+
+
+class Borrower(object):
+    def __init__(self, i):
+        self.username = 'funnel{}'.format(i)
+        self.account = 'funnel-acc{}'.format(i)
+        self.approval = None
+        self.declined = False
+        self.repayments = []  # (date, amount) of the schedule, in order.
+
+    @property
+    def headers(self):
+        credentials = base64.b64encode('{}:{}'.format(self.username, PASSWORD).encode()).decode()
+        return {'Authorization': 'Basic ' + credentials, 'Timestamp': NOW.isoformat()}
+
+
+class Funnel(object):
+    def __init__(self, app, n_borrowers, concurrency, polls, rounds):
+        self.app = app
+        self.borrowers = [Borrower(i) for i in range(n_borrowers)]
+        self.concurrency = concurrency
+        self.polls = polls
+        self.rounds = rounds
+        self.bank = MockBank()
+        with app.app_context():
+            self.queries = QueryCounter(db.get_engine(app))
+        self._local = threading.local()
+
+    def _client(self):
+        if not hasattr(self._local, 'client'):
+            self._local.client = self.app.test_client()
+        return self._local.client
+
+    def _post(self, path, data, headers=None):
+        return self._client().post(path, data=json.dumps(data), content_type='application/json', headers=headers)
+
+    def register(self, borrower):
+        return self._post('/register', {'username': borrower.username, 'password': PASSWORD,
+                                        'bank_account': borrower.account})
+
+    def get_decision(self, borrower):
+        response = self._post('/get_decision', DECISION_DATA, borrower.headers)
+        if response.status_code == 200:
+            decision = json.loads(response.get_data(as_text=True)).get('decision')
+            if decision and decision['status'] == 'Approved':
+                borrower.approval = int(decision['reference'])
+            elif decision:
+                borrower.declined = True
+        return response
+
+    def request_funding(self, borrower):
+        response = self._post('/request_funding', {'amount': FUNDING_AMOUNT, 'approval_reference': borrower.approval},
+                              borrower.headers)
+        if response.status_code == 200:
+            schedule = json.loads(response.get_data(as_text=True))['repayment_schedule']
+            borrower.repayments = sorted((parse_datetime(k), v) for k, v in schedule.items())
+        return response
+
+    def get_schedule(self, borrower):
+        return self._client().get('/get_schedule', headers=borrower.headers)
+
+    def repayment_sync(self, round_number):
+        for borrower in self.borrowers:
+            if round_number < len(borrower.repayments):
+                dt, amount = borrower.repayments[round_number]
+                self.bank.pay(borrower.account, amount, dt)
+        with self.app.app_context():
+            bank.fetch_cashflows()
+            db.session.remove()
+
+    def approve_declined(self):
+        declined = {b.username: b for b in self.borrowers if b.approval is None}
+        with self.app.app_context():
+            for user in User.query.filter(User.username.in_(declined)):
+                declined[user.username].approval = approve_user(user, NOW, amount=25000, interest_rate=0.0005).id
+            db.session.remove()
+        return len(declined)
+
+    def run_stage(self, call, items, threads):
+        latencies = []
+        errors = 0
+        queries = self.queries.count
+
+        def timed(item):
+            start = time.perf_counter()
+            response = call(item)
+            return time.perf_counter() - start, response
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(threads) as executor:
+            for latency, response in executor.map(timed, items):
+                latencies.append(latency)
+                if response is not None and not 200 <= response.status_code < 300:
+                    errors += 1
+        duration = time.perf_counter() - start
+        return _stage_result(latencies, errors, duration, self.queries.count - queries)
+
+    def run(self):
+        with mock.patch.multiple('wk_client.bank', send_cash=self.bank.send_cash,
+                                 _retrieve_all_cashflows=self.bank.retrieve_cashflows):
+            risk_model.get_classifier()  # Trained before the timings, as the production server does.
+            stages = {}
+            stages['register'] = self.run_stage(self.register, self.borrowers, self.concurrency)
+            stages['get_decision'] = self.run_stage(self.get_decision, self.borrowers, self.concurrency)
+            stages['get_decision'].update(
+                approved=sum(1 for b in self.borrowers if b.approval is not None),
+                declined=sum(1 for b in self.borrowers if b.declined))
+            stages['get_decision']['approved_outside_timing'] = self.approve_declined()
+            stages['request_funding'] = self.run_stage(self.request_funding, self.borrowers, self.concurrency)
+            stages['get_schedule'] = self.run_stage(self.get_schedule, self.borrowers * self.polls, self.concurrency)
+            stages['repayment_sync'] = self.run_stage(self.repayment_sync, range(self.rounds), 1)
+        return stages
+
+
+def _stage_result(latencies, errors, duration, queries):
+    latencies = sorted(l * 1000 for l in latencies)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'seconds': duration,
+        'throughput': len(latencies) / duration if duration else None,
+        'p50_ms': statistics.median(latencies) if latencies else None,
+        'p95_ms': _percentile(latencies, 0.95),
+        'p99_ms': _percentile(latencies, 0.99),
+        'queries': queries,
+        'queries_per_request': queries / len(latencies) if latencies else None,
+        'peak_rss_mb': _peak_rss_mb(),
+    }
+
+
+def _percentile(values, q):
+    return values[int(q * (len(values) - 1))] if values else None
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in KB on Linux, bytes on macOS.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def _commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_stages(stages):
+    print('{:<16} {:>7} {:>7} {:>9} {:>9} {:>9} {:>9} {:>9} {:>8}'.format(
+        'stage', 'count', 'errors', 'per s', 'p50 ms', 'p95 ms', 'p99 ms', 'queries', 'RSS MB'))
+    for name, stage in stages.items():
+        print('{:<16} {:>7} {:>7} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f} {:>8.1f}'.format(
+            name, stage['requests'], stage['errors'], stage['throughput'], stage['p50_ms'], stage['p95_ms'],
+            stage['p99_ms'], stage['queries_per_request'], stage['peak_rss_mb']))
+    decisions = stages['get_decision']
+    print('get_decision: {} approved, {} declined by the model, {} approved outside the timings'.format(
+        decisions['approved'], decisions['declined'], decisions['approved_outside_timing']))
+
+
+def compare(before_file, after_file):
+    with open(before_file) as f:
+        before = json.load(f)
+    with open(after_file) as f:
+        after = json.load(f)
+    print('{} -> {}'.format(before.get('commit'), after.get('commit')))
+    print('{:<16} {:>10} {:>10} {:>10} {:>10}'.format('stage', 'per s', 'p50', 'p99', 'queries'))
+    for name, stage in after['stages'].items():
+        old = before['stages'].get(name)
+        if not old:
+            continue
+        print('{:<16} {:>10} {:>10} {:>10} {:>10}'.format(name, *(
+            _change(old[key], stage[key]) for key in ('throughput', 'p50_ms', 'p99_ms', 'queries_per_request'))))
+
+
+def _change(old, new):
+    if not old or new is None:
+        return '-'
+    return '{:+.1%}'.format(new / old - 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the borrower funnel with a mock bank.')
+    parser.add_argument('--borrowers', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--polls', type=int, default=5, help='get_schedule requests per borrower.')
+    parser.add_argument('--rounds', type=int, default=3, help='Repayment syncs, one instalment per borrower each.')
+    parser.add_argument('--database-url', help='An empty database to use instead of a fresh SQLite file.')
+    parser.add_argument('--output', default='funnel.json')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='Compare two result files.')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    tmp_dir = tempfile.mkdtemp()
+    uri = args.database_url or 'sqlite:///' + os.path.join(tmp_dir, 'funnel.db')
+    try:
+        app = create_app(type('FunnelConfig', (Config,), dict(
+            SQLALCHEMY_DATABASE_URI=uri, LOG_FILENAME=None, USER_RATE=0, ADMISSION_LIMITS={},
+            PROFILE_TOKEN=None, PROFILE_SAMPLE_RATE=0)))
+        with app.app_context():
+            db.create_all()
+        stages = Funnel(app, args.borrowers, args.concurrency, args.polls, args.rounds).run()
+        with app.app_context():
+            db.session.remove()
+            db.get_engine(app).dispose()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    print_stages(stages)
+    with open(args.output, 'w') as f:
+        json.dump({
+            'commit': _commit(),
+            'python': platform.python_version(),
+            'database': app.config['SQLALCHEMY_DATABASE_URI'].split(':', 1)[0],
+            'borrowers': args.borrowers,
+            'concurrency': args.concurrency,
+            'polls': args.polls,
+            'rounds': args.rounds,
+            'stages': stages,
+        }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
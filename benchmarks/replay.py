@@ -0,0 +1,313 @@
+"""Access log replay: sends the requests of server-log.txt again, with the same mix and timing.
+
+    python benchmarks/replay.py --speed 60 --limit 5000
+    python benchmarks/replay.py --url https://localhost:5000 --insecure --prepare --speed 60
+
+Every line of the combined log format becomes the same request from the same user, sent at the
+same offset from the first line divided by --speed. The log has a resolution of one second, the
+requests of one second are spread evenly over it. Requests are sent from --threads threads, so a
+slow server shows up as latency (and, once the threads are all busy, as lag behind the schedule)
+instead of slowing the replay down.
+
+Without --url the requests go through the Flask test client to an app on a fresh SQLite database,
+with the log's users registered and approved and the bank stubbed. With --url they go over HTTP,
+the users must exist there with --password (--prepare registers them first).
+
+Registrations that failed in the log are sent again for an existing username, the others for a new
+one. Decisions are asked for the sample application of constants.py, so they go through the risk
+model; declines are counted separately. Fundings use the latest approval of the user, from the
+replayed decisions or the seed.
+"""
+import argparse
+import base64
+import itertools
+import json
+import os
+import re
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from wk_client import create_app, db, risk_model  # noqa: E402
+from wk_client.auth_utils import create_users  # noqa: E402
+from wk_client.config import Config  # noqa: E402
+from wk_client.constants import SAMPLE_APPLICATION  # noqa: E402
+from wk_client.logic import approve_user  # noqa: E402
+from wk_client.models import User  # noqa: E402
+
+LOG_LINE = re.compile(
+    r'(?P<host>\S+) \S+ (?P<user>\S+) \[(?P<time>[^\]]+)\] "(?P<method>[A-Z]+) (?P<path>\S+)[^"]*" '
+    r'(?P<status>\d{3}) (?P<size>\d+|-)')
+LOG_TIME_FORMAT = '%d/%b/%Y:%H:%M:%S %z'
+DECISION_DATA = dict(SAMPLE_APPLICATION, basic_questions=dict(SAMPLE_APPLICATION['basic_questions'],
+                                                             amount_requested=5000))
+FUNDING_AMOUNT = 1000
+
+Entry = namedtuple('Entry', 'offset time method path username status size')
+Result = namedtuple('Result', 'endpoint status latency lag decision')
+
+
+def parse_log(filename, limit=None):
+    """Returns the entries of the log, with their offset in seconds from the first one."""
+    lines = []
+    with open(filename) as f:
+        for line in f:
+            match = LOG_LINE.match(line)
+            if match:
+                lines.append(match)
+            if limit and len(lines) >= limit:
+                break
+
+    entries = []
+    first = None
+    # The requests logged in the same second are spread evenly over it.
+    for logged, same_second in itertools.groupby(lines, key=lambda m: m.group('time')):
+        same_second = list(same_second)
+        dt = datetime.strptime(logged, LOG_TIME_FORMAT)
+        first = first or dt
+        for j, match in enumerate(same_second):
+            user = match.group('user')
+            entries.append(Entry(
+                offset=(dt - first).total_seconds() + j / len(same_second),
+                time=dt.replace(tzinfo=None),
+                method=match.group('method'),
+                path=match.group('path'),
+                username=None if user == '-' else user,
+                status=int(match.group('status')),
+                size=0 if match.group('size') == '-' else int(match.group('size')),
+            ))
+    return entries
+
+
+class InProcessTarget(object):
+    """An app on a fresh SQLite database, called through the test client (one per thread)."""
+    def __init__(self, usernames, password, now):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.app = create_app(type('ReplayConfig', (Config,), dict(
+            SQLALCHEMY_DATABASE_URI='sqlite:///' + os.path.join(self.tmp_dir, 'replay.db'), LOG_FILENAME=None)))
+        self.approvals = self._seed(usernames, password, now)
+        risk_model.get_classifier()  # Trained before the replay, as the production server does.
+        self._local = threading.local()
+        self._bank = mock.patch('wk_client.bank.send_cash', _send_cash(now))
+        self._bank.start()
+
+    def _seed(self, usernames, password, now):
+        with self.app.app_context():
+            db.create_all()
+            create_users((username, password, username) for username in usernames)
+            for user in User.query:
+                approve_user(user, now - timedelta(minutes=5), amount=25000, interest_rate=0.0005)
+            return {user.username: user.decisions[0].id for user in User.query}
+
+    def send(self, method, path, headers, body):
+        if not hasattr(self._local, 'client'):
+            self._local.client = self.app.test_client()
+        response = self._local.client.open(path, method=method, headers=headers, data=body)
+        return response.status_code, response.get_data()
+
+    def close(self):
+        self._bank.stop()
+        with self.app.app_context():
+            db.session.remove()
+            db.get_engine(self.app).dispose()
+        shutil.rmtree(self.tmp_dir)
+
+
+class HttpTarget(object):
+    """A running server, e.g. python -m wk_client.serve, with a connection pool per thread."""
+    def __init__(self, url, verify=True):
+        import requests
+        self.requests = requests
+        self.url = url.rstrip('/')
+        self.verify = verify
+        self.approvals = {}
+        self._local = threading.local()
+
+    def send(self, method, path, headers, body):
+        if not hasattr(self._local, 'session'):
+            self._local.session = self.requests.Session()
+        response = self._local.session.request(method, self.url + path, headers=headers, data=body,
+                                               verify=self.verify)
+        return response.status_code, response.content
+
+    def prepare(self, usernames, password, batch_size=1000):
+        """Registers the users, the ones that already exist are left as they are."""
+        usernames = list(usernames)
+        for i in range(0, len(usernames), batch_size):
+            rows = [{'username': u, 'password': password, 'bank_account': u} for u in usernames[i:i + batch_size]]
+            self.send('POST', '/register_batch', {'Content-Type': 'application/json'}, json.dumps(rows))
+
+    def close(self):
+        pass
+
+
+def _send_cash(now):
+    def send_cash(amount, account_to):
+        return {'amount': amount, 'timestamp': now, 'bank_ref': str(uuid.uuid4())}
+    return send_cash
+
+
+class Replayer(object):
+    def __init__(self, target, password, existing_username):
+        self.target = target
+        self.password = password
+        self.existing_username = existing_username
+
+    def request(self, entry):
+        """Returns the method, path, headers and body to send for a log entry."""
+        path = entry.path
+        headers = {'Timestamp': entry.time.isoformat()}
+        if entry.username:
+            credentials = '{}:{}'.format(entry.username, self.password).encode()
+            headers['Authorization'] = 'Basic ' + base64.b64encode(credentials).decode()
+        if entry.method != 'POST':
+            return entry.method, path, headers, None
+
+        if path == '/register':
+            username = self.existing_username if entry.status >= 400 else 'replay-' + uuid.uuid4().hex
+            data = {'username': username, 'password': self.password, 'bank_account': username}
+        elif path == '/get_decision':
+            data = DECISION_DATA
+        elif path == '/request_funding':
+            data = {'amount': FUNDING_AMOUNT, 'approval_reference': self.target.approvals.get(entry.username)}
+        else:
+            data = {}
+        headers['Content-Type'] = 'application/json'
+        return entry.method, path, headers, json.dumps(data)
+
+    def send(self, entry, due):
+        method, path, headers, body = self.request(entry)
+        start = time.perf_counter()
+        try:
+            status, content = self.target.send(method, path, headers, body)
+        except Exception:
+            status, content = None, None
+        latency = time.perf_counter() - start
+        decision = None
+        if status == 200 and path == '/get_decision':
+            decision = self._record_decision(entry.username, content)
+        return Result(_endpoint(method, path), status, latency, start - due, decision)
+
+    def _record_decision(self, username, content):
+        decision = json.loads(content.decode()).get('decision')
+        if decision is None:
+            return None
+        if decision['status'] == 'Approved':
+            self.target.approvals[username] = int(decision['reference'])
+        return decision['status']
+
+    def replay(self, entries, speed=1., threads=32):
+        """Sends every entry at its offset divided by speed. Returns a Result per entry."""
+        start = time.perf_counter()
+        with ThreadPoolExecutor(threads) as executor:
+            futures = []
+            for entry in entries:
+                due = start + entry.offset / speed
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                futures.append(executor.submit(self.send, entry, due))
+            return [future.result() for future in futures]
+
+
+def _endpoint(method, path):
+    return '{} {}'.format(method, path.split('?', 1)[0])
+
+
+def _percentile(values, q):
+    return values[int(q * (len(values) - 1))]
+
+
+def summarize(results, duration):
+    """Count, latency percentiles (ms) and error rate (5xx or no response) per endpoint, and in total."""
+    by_endpoint = {}
+    for result in results:
+        by_endpoint.setdefault(result.endpoint, []).append(result)
+    by_endpoint['total'] = results
+
+    summary = {}
+    for endpoint, endpoint_results in by_endpoint.items():
+        latencies = sorted(r.latency * 1000 for r in endpoint_results)
+        errors = sum(1 for r in endpoint_results if r.status is None or r.status >= 500)
+        summary[endpoint] = {
+            'count': len(endpoint_results),
+            'p50_ms': statistics.median(latencies),
+            'p95_ms': _percentile(latencies, 0.95),
+            'p99_ms': _percentile(latencies, 0.99),
+            'error_rate': errors / len(endpoint_results),
+            'client_errors': sum(1 for r in endpoint_results if r.status and 400 <= r.status < 500),
+        }
+        decisions = [r.decision for r in endpoint_results if r.decision]
+        if decisions and endpoint != 'total':
+            summary[endpoint].update(approved=decisions.count('Approved'), declined=decisions.count('Declined'))
+    lags = sorted(r.lag * 1000 for r in results)
+    summary['total'].update(requests_per_second=len(results) / duration, lag_p99_ms=_percentile(lags, 0.99))
+    return summary
+
+
+def print_summary(summary):
+    print('{:<28} {:>7} {:>9} {:>9} {:>9} {:>7} {:>7}'.format(
+        'endpoint', 'count', 'p50 ms', 'p95 ms', 'p99 ms', '4xx', 'errors'))
+    for endpoint in sorted(summary, key=lambda e: (e == 'total', -summary[e]['count'])):
+        row = summary[endpoint]
+        print('{:<28} {:>7} {:>9.1f} {:>9.1f} {:>9.1f} {:>7} {:>6.1%}'.format(
+            endpoint, row['count'], row['p50_ms'], row['p95_ms'], row['p99_ms'], row['client_errors'],
+            row['error_rate']))
+    for endpoint, row in sorted(summary.items()):
+        if 'declined' in row:
+            print('{}: {} approved, {} declined'.format(endpoint, row['approved'], row['declined']))
+    total = summary['total']
+    print('{:.1f} req/s, p99 lag behind schedule {:.1f} ms'.format(total['requests_per_second'], total['lag_p99_ms']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay the access log against the app.')
+    parser.add_argument('--log', default=os.path.join(ROOT, 'server-log.txt'))
+    parser.add_argument('--limit', type=int, help='Replay only the first LIMIT requests.')
+    parser.add_argument('--speed', type=float, default=1., help='Speed-up factor, 60 replays an hour in a minute.')
+    parser.add_argument('--threads', type=int, default=32, help='Requests in flight at most.')
+    parser.add_argument('--url', help='Send over HTTP to this server instead of in process.')
+    parser.add_argument('--insecure', action='store_true', help='Accept a self-signed certificate.')
+    parser.add_argument('--prepare', action='store_true', help='Register the users of the log at --url first.')
+    parser.add_argument('--password', default='pass')
+    parser.add_argument('--json', help='Also write the summary to this file.')
+    args = parser.parse_args()
+
+    entries = parse_log(args.log, args.limit)
+    usernames = sorted({e.username for e in entries if e.username})
+    print('{} requests over {:.0f} s from {} users, replayed in about {:.0f} s'.format(
+        len(entries), entries[-1].offset, len(usernames), entries[-1].offset / args.speed))
+
+    if args.url:
+        target = HttpTarget(args.url, verify=not args.insecure)
+        if args.prepare:
+            target.prepare(usernames, args.password)
+    else:
+        target = InProcessTarget(usernames, args.password, entries[0].time)
+    try:
+        replayer = Replayer(target, args.password, usernames[0] if usernames else 'replay')
+        start = time.perf_counter()
+        results = replayer.replay(entries, args.speed, args.threads)
+        summary = summarize(results, time.perf_counter() - start)
+    finally:
+        target.close()
+
+    print_summary(summary)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Startup benchmark: time until ready and peak RSS of each kind of process we start.
+
+    python benchmarks/startup.py --repeat 5 --importtime
+
+Every target runs in a fresh interpreter from the repository root, so nothing is already imported.
+--importtime also lists the slowest top-level imports of each target (python -X importtime).
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TARGETS = [
+    ('web worker', [sys.executable, '-c', 'from wk_client import create_app; create_app()']),
+    ('migration runner', [sys.executable, '-m', 'flask', 'db', 'heads']),
+    ('transaction generator', [sys.executable, '-c', 'import generate_transactions']),
+    ('test collection', [sys.executable, '-m', 'pytest', '--collect-only', '-q', '-p', 'no:cacheprovider']),
+    ('risk model (first decision)', [sys.executable, '-c', 'import wk_client.risk_model']),
+]
+
+
+def run(command, importtime=False):
+    """Runs command, returns (exit status, seconds, peak RSS in MB, -X importtime output)."""
+    env = dict(os.environ, FLASK_APP='wk_client', LOG_FILENAME=os.devnull)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)  # Deployed code has its .pyc files, don't compile every run.
+    if importtime:
+        env['PYTHONPROFILEIMPORTTIME'] = '1'
+    with tempfile.TemporaryFile() as stderr:
+        start = time.perf_counter()
+        process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=stderr)
+        _, status, usage = os.wait4(process.pid, 0)
+        duration = time.perf_counter() - start
+        process.returncode = status  # Already reaped.
+        stderr.seek(0)
+        output = stderr.read().decode('utf-8', 'replace')
+    # ru_maxrss is in KB on Linux, bytes on macOS.
+    rss = usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+    return status, duration, rss, output
+
+
+def slowest_imports(output, n):
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not name.startswith('  '):  # Only top-level imports, nested ones are in their cumulative time.
+            imports.append((int(cumulative), name.strip()))
+    return sorted(imports, reverse=True)[:n]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure process startup time and memory.')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--importtime', action='store_true', help='Also show the slowest imports.')
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    print('{:<30} {:>10} {:>10}'.format('target', 'median s', 'RSS MB'))
+    for name, command in TARGETS:
+        results = [run(command) for _ in range(args.repeat)]
+        if any(status for status, _, _, _ in results):
+            print('{:<30} {:>10}'.format(name, 'failed'))
+            continue
+        print('{:<30} {:>10.3f} {:>10.1f}'.format(
+            name, statistics.median(d for _, d, _, _ in results), max(r for _, _, r, _ in results)))
+        if args.importtime:
+            for us, module in slowest_imports(run(command, importtime=True)[3], args.top):
+                print('    {:>8.1f} ms  {}'.format(us / 1000, module))
+
+
+if __name__ == '__main__':
+    main()
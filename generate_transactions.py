@@ -1,13 +1,17 @@
 """A Script to generate random transactions for simulating a bank in testing.
 """
+import argparse
+import collections
+import contextlib
 import csv
 import datetime
+import fcntl
 import json
+import threading
 
 import numpy
 import os.path
 import random
-import sys
 import uuid
 
 TEST_ACCOUNTS = [
@@ -19,35 +23,119 @@ TEST_ACCOUNTS = [
 OUR_ACCOUNT = "782cab3857fd4f34be101d63358fd6"
 
 TRANSACTION_FILENAME = "transactions.csv"
+CLOCK_FILENAME = "clock.dat"
+CLOCK_LEASE_SIZE = 64  # Ticks a clock takes from the clock file at a time.
 
 SHAPE = 2
 SCALE = 1000
 REF_TIME = datetime.datetime(2019, 1, 5)
 
+MEAN_INTERVAL_SECONDS = 2700  # Same mean as the uniform offsets.
+
+FIELDNAMES = [
+    "reference",
+    "datetime",
+    "account_from",
+    "account_to",
+    "amount",
+]
+BLOCK_SIZE = 100000
+WRITE_BUFFER_SIZE = 1 << 22
+
 
 def generate_random_amount():
     amount = numpy.random.gamma(SHAPE, SCALE)
     return round(amount, 2)
 
 
-def time_now():
-    """Accelerated time
+class SimulatedClock(object):
+    """Accelerated time, shared through the clock file by every process that uses it.
+
+    The clock file holds the latest time handed out. Under an exclusive lock on a separate lock
+    file, a clock reads it and writes a later time back through a rename, so the app workers and
+    the command line scripts advance one clock and a crash can't leave a half written file.
+    tick leases lease_size ticks at a time and hands them out from memory, tick_many takes a
+    whole block of ticks under a single lock.
     """
-    with open("clock.dat", "r") as r:
-        prev_time = datetime.datetime.fromisoformat(
-            r.read()
+    def __init__(self, filename=CLOCK_FILENAME, exponential=False, mean_interval=MEAN_INTERVAL_SECONDS,
+                 lease_size=CLOCK_LEASE_SIZE):
+        self.filename = filename
+        self.exponential = exponential
+        self.mean_interval = mean_interval
+        self.lease_size = lease_size
+
+        self._lock = threading.Lock()
+        self._leased = collections.deque()
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """Holds an exclusive lock on the clock, for this process' threads and for other processes."""
+        with self._lock, open(self.filename + ".lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read(self):
+        with open(self.filename) as f:
+            return datetime.datetime.fromisoformat(f.read().strip())
+
+    def _write(self, now):
+        tmp_filename = self.filename + ".tmp"
+        with open(tmp_filename, "w") as f:
+            f.write(now.isoformat())
+        os.replace(tmp_filename, self.filename)
+
+    def _offset(self):
+        if self.exponential:
+            return datetime.timedelta(seconds=round(random.expovariate(1 / self.mean_interval)))
+        return datetime.timedelta(
+            minutes=random.randint(0, 30),
+            seconds=random.randint(0, 3600),
         )
 
-    # TODO: Replace with exponential distr.?
-    offset = datetime.timedelta(
-        minutes=random.randint(0, 30),
-        seconds=random.randint(0, 3600),
-    )
-    new_time = prev_time + offset
+    def tick(self):
+        """Advances the clock by one inter-arrival time and returns the new time."""
+        with self._lock:
+            if self._leased:
+                return self._leased.popleft()
+        with self._locked():
+            if not self._leased:
+                now = self._read()
+                for _ in range(self.lease_size):
+                    now += self._offset()
+                    self._leased.append(now)
+                self._write(now)
+            return self._leased.popleft()
+
+    def tick_many(self, n):
+        """Advances the clock by n inter-arrival times.
 
-    with open("clock.dat", "w") as w:
-        w.write(new_time.isoformat())
-    return new_time
+        Ticks leased before are dropped, so this process' later ticks come after the block.
+
+        Returns:
+            numpy.ndarray: datetime64[s] times of the n ticks.
+        """
+        if self.exponential:
+            offsets = numpy.rint(numpy.random.exponential(self.mean_interval, n))
+        else:
+            offsets = 60 * numpy.random.randint(0, 31, n) + numpy.random.randint(0, 3601, n)
+        with self._locked():
+            self._leased.clear()
+            times = numpy.datetime64(self._read(), "s") + numpy.cumsum(offsets).astype("timedelta64[s]")
+            if n:
+                self._write(times[-1].astype(datetime.datetime))
+            return times
+
+
+clock = SimulatedClock()
+
+
+def time_now():
+    """Accelerated time
+    """
+    return clock.tick()
 
 
 def generate_outbound_transaction(data, write=True
@@ -83,31 +171,122 @@ def write_transactions(transactions):
     file_exists = os.path.isfile(filename)
 
     with open(filename, "a") as f:
-        fieldnames = [
-            "reference",
-            "datetime",
-            "account_from",
-            "account_to",
-            "amount",
-        ]
-        writer = csv.DictWriter(f, fieldnames)
+        writer = csv.DictWriter(f, FIELDNAMES)
         if not file_exists:
             writer.writeheader()
 
-        for transaction in transactions:
-            print(
-                transaction["datetime"],
-                transaction["account_from"][:6],
-                transaction["amount"],
-            )
-            writer.writerow(transaction)
+        writer.writerows(transactions)
 
 
-if __name__ == "__main__":
-    n_records = int(sys.argv[1])
-    print("Generating {} cashflows".format(n_records))
-    transactions = [
-        generate_inbound_transaction()
-        for _ in range(n_records)
+def generate_inbound_transaction_blocks(n_records, block_size=BLOCK_SIZE):
+    """Generates inbound transactions in blocks of columns, drawing each column as one array.
+
+    Yields:
+        dict: Column name to numpy.ndarray, at most block_size rows. Strings are ASCII bytes.
+    """
+    accounts = numpy.array(TEST_ACCOUNTS, dtype="S")
+    for start in range(0, n_records, block_size):
+        n = min(block_size, n_records - start)
+        yield {
+            "reference": numpy.frombuffer(os.urandom(16 * n).hex().encode(), dtype="S32"),
+            "datetime": clock.tick_many(n),
+            "account_from": accounts[numpy.random.randint(0, len(accounts), n)],
+            "account_to": numpy.full(n, OUR_ACCOUNT.encode()),
+            "amount": numpy.round(numpy.random.gamma(SHAPE, SCALE, n), 2),
+        }
+
+
+def _byte_matrix(column):
+    """(n, width) byte matrix of a column of strings, shorter strings padded with NUL."""
+    column = numpy.asarray(column)
+    if column.dtype.kind != "S":
+        column = column.astype("S")
+    return column.view(numpy.uint8).reshape(len(column), column.itemsize)
+
+
+def _digit_matrix(values, width, zero_pad=True):
+    """(n, width) matrix of the ASCII digits of non-negative integers.
+
+    Without zero_pad, leading zeros are NUL.
+    """
+    powers = 10 ** numpy.arange(width - 1, -1, -1, dtype=numpy.int64)
+    digits = (values[:, None] // powers % 10 + ord("0")).astype(numpy.uint8)
+    if not zero_pad:
+        digits[(values[:, None] < powers) & (powers > 1)] = 0
+    return digits
+
+
+def _separator(n, char):
+    return numpy.full((n, 1), ord(char), dtype=numpy.uint8)
+
+
+def _csv_bytes(block):
+    """Formats a block of transactions as CSV rows without a Python loop over the rows.
+
+    Each row is assembled in a byte matrix, padding is NUL and dropped at the end.
+    Datetimes are in isoformat to the second, amounts have two decimal places.
+    """
+    n = len(block["amount"])
+
+    times = block["datetime"]
+    days = times.astype("datetime64[D]")
+    unique_days, day_index = numpy.unique(days, return_inverse=True)
+    seconds = (times - days).astype(numpy.int64)
+
+    cents = numpy.rint(block["amount"] * 100).astype(numpy.int64)
+    whole = cents // 100
+    whole_width = len(str(whole.max())) if n else 1
+
+    pieces = [
+        _byte_matrix(block["reference"]), _separator(n, ","),
+        _byte_matrix(numpy.datetime_as_string(unique_days))[day_index], _separator(n, "T"),
+        _digit_matrix(seconds // 3600, 2), _separator(n, ":"),
+        _digit_matrix(seconds // 60 % 60, 2), _separator(n, ":"),
+        _digit_matrix(seconds % 60, 2), _separator(n, ","),
+        _byte_matrix(block["account_from"]), _separator(n, ","),
+        _byte_matrix(block["account_to"]), _separator(n, ","),
+        _digit_matrix(whole, whole_width, zero_pad=False), _separator(n, "."),
+        _digit_matrix(cents % 100, 2), _separator(n, "\n"),
     ]
-    write_transactions(transactions)
+    rows = numpy.hstack(pieces)
+    return rows[rows != 0].tobytes()
+
+
+def write_transaction_blocks(blocks, filename=TRANSACTION_FILENAME):
+    """Appends blocks of transactions to a CSV file through a large write buffer."""
+    file_exists = os.path.isfile(filename)
+    n_records = 0
+    with open(filename, "ab", buffering=WRITE_BUFFER_SIZE) as f:
+        if not file_exists:
+            f.write((",".join(FIELDNAMES) + "\n").encode())
+        for block in blocks:
+            f.write(_csv_bytes(block))
+            n_records += len(block["reference"])
+    return n_records
+
+
+def write_transaction_blocks_columnar(blocks, filename):
+    """Writes each block of transactions to its own .npz file: <filename>.00000.npz, <filename>.00001.npz, ..."""
+    n_records = 0
+    for i, block in enumerate(blocks):
+        numpy.savez("{}.{:05d}.npz".format(filename, i), **block)
+        n_records += len(block["reference"])
+    return n_records
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("n_records", type=int)
+    parser.add_argument("--output", default=TRANSACTION_FILENAME)
+    parser.add_argument("--columnar", action="store_true", help="Write .npz column blocks instead of CSV.")
+    parser.add_argument("--exponential", action="store_true", help="Exponential inter-arrival times.")
+    parser.add_argument("--block-size", type=int, default=BLOCK_SIZE)
+    args = parser.parse_args()
+
+    clock.exponential = args.exponential
+    print("Generating {} cashflows".format(args.n_records))
+    blocks = generate_inbound_transaction_blocks(args.n_records, block_size=args.block_size)
+    if args.columnar:
+        write_transaction_blocks_columnar(blocks, args.output)
+    else:
+        write_transaction_blocks(blocks, args.output)
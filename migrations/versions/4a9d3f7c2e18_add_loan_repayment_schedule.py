@@ -0,0 +1,25 @@
+"""Add loan.repayment_schedule
+
+Revision ID: 4a9d3f7c2e18
+Revises: e2c4a6f8b913
+Create Date: 2026-10-19 22:18:37.942051
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4a9d3f7c2e18'
+down_revision = 'e2c4a6f8b913'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('loan', sa.Column('repayment_schedule', sa.Text(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('loan') as batch_op:
+        batch_op.drop_column('repayment_schedule')
@@ -0,0 +1,26 @@
+"""Add idempotency_key.side_effects
+
+Revision ID: 5f7a2c9d3e41
+Revises: 8d2b6f4c1e05
+Create Date: 2026-10-19 16:48:03.274815
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5f7a2c9d3e41'
+down_revision = '8d2b6f4c1e05'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('idempotency_key',
+                  sa.Column('side_effects', sa.Boolean(), nullable=False, server_default=sa.false()))
+
+
+def downgrade():
+    with op.batch_alter_table('idempotency_key') as batch_op:
+        batch_op.drop_column('side_effects')
@@ -0,0 +1,35 @@
+"""Add borrower summary
+
+Revision ID: 8d2b6f4c1e05
+Revises: 3c5e1f0a9b27
+Create Date: 2026-10-19 14:37:02.904113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d2b6f4c1e05'
+down_revision = '3c5e1f0a9b27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('borrower_summary',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('as_of', sa.Date(), nullable=False),
+    sa.Column('balance', sa.Float(), nullable=False),
+    sa.Column('active_loan_id', sa.Integer(), nullable=True),
+    sa.Column('next_due_date', sa.Date(), nullable=True),
+    sa.Column('next_due_amount', sa.Float(), nullable=True),
+    sa.Column('arrears', sa.Float(), nullable=False),
+    sa.ForeignKeyConstraint(['active_loan_id'], ['loan.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+
+
+def downgrade():
+    op.drop_table('borrower_summary')
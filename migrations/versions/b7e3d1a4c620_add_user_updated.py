@@ -0,0 +1,27 @@
+"""Add user.updated
+
+Revision ID: b7e3d1a4c620
+Revises: 5f7a2c9d3e41
+Create Date: 2026-10-19 17:12:45.118307
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e3d1a4c620'
+down_revision = '5f7a2c9d3e41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('user', sa.Column('updated', sa.DateTime(), nullable=True))
+    op.create_index(op.f('ix_user_updated'), 'user', ['updated'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_user_updated'), table_name='user')
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.drop_column('updated')
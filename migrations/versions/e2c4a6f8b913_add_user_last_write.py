@@ -0,0 +1,25 @@
+"""Add user.last_write
+
+Revision ID: e2c4a6f8b913
+Revises: b7e3d1a4c620
+Create Date: 2026-10-19 21:40:12.503821
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2c4a6f8b913'
+down_revision = 'b7e3d1a4c620'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('user', sa.Column('last_write', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.drop_column('last_write')
@@ -1,31 +1,68 @@
+import click
 from flask import Flask
 from flask_httpauth import HTTPBasicAuth
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
+from sqlalchemy import orm
 
 from wk_client.config import Config
+from wk_client.sessions import RoutingSession
 
-db = SQLAlchemy()
-migrate = Migrate()
+
+class _SQLAlchemy(SQLAlchemy):
+    def apply_driver_hacks(self, app, sa_url, options):
+        if not sa_url.drivername.startswith('sqlite'):
+            options.update(app.config.get('DB_POOL_OPTIONS') or {})
+        return super(_SQLAlchemy, self).apply_driver_hacks(app, sa_url, options)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+db = _SQLAlchemy()
 auth = HTTPBasicAuth()
 
 def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
 
+    from wk_client.log_utils import configure_logging
+    configure_logging(app.config, app.name)
+
     db.init_app(app)
-    migrate.init_app(app, db)
+    if click.get_current_context(silent=True) is not None:
+        # Only the flask CLI runs migrations (flask db), alembic is too slow to import in every worker.
+        from flask_migrate import Migrate
+        Migrate(app, db)
+    from wk_client import sessions
+    from wk_client.db_utils import set_sqlite_pragmas
+    set_sqlite_pragmas(db.get_engine(app), app.config.get('SQLITE_PRAGMAS'))
+    sessions.init_app(app)
 
     from wk_client.routes import bp
     app.register_blueprint(bp)
 
-    return app
+    from wk_client.endpoints import ProductInfo, get_product_data
+    app.extensions['product_info'] = ProductInfo(get_product_data(app.config))
 
+    from wk_client import admission, profiling
+    admission.init_app(app)
+    profiling.init_app(app)
 
-from wk_client import models
+    from wk_client.commands import export_ledger_command, rebuild_borrower_summary_command, \
+        refresh_borrower_summary_command, seed_portfolio_command
+    app.cli.add_command(seed_portfolio_command)
+    app.cli.add_command(rebuild_borrower_summary_command)
+    app.cli.add_command(refresh_borrower_summary_command)
+    app.cli.add_command(export_ledger_command)
+
+    app.shell_context_processor(make_shell_context)
+
+    return app
 
-app = create_app()
 
-@app.shell_context_processor
 def make_shell_context():
-    return {'db': db, 'User': models.User, 'CashFlow': models.CashFlow, 'Loan': models.Loan, 'Decision': models.Decision}
\ No newline at end of file
+    return {'db': db, 'User': models.User, 'CashFlow': models.CashFlow, 'Loan': models.Loan, 'Decision': models.Decision}
+
+
+# No app is built on import: the flask CLI finds create_app (FLASK_APP=wk_client), servers call it.
+from wk_client import models
@@ -0,0 +1,142 @@
+"""Admission control for the expensive routes.
+
+Each route class (e.g. scoring, funding) has a concurrency limit with a bounded wait queue. When
+the queue is full, or a request waited too long, it is rejected straight away with 503 and
+Retry-After. Every user also has a token bucket over all limited routes, exceeding it gives 429.
+Routes without the decorator (e.g. /get_info) are never held up by saturated scoring.
+
+The limits and buckets live in the process. Under gunicorn each worker applies them on its own,
+so the server as a whole admits workers times the configured concurrency and user rate, and
+single-threaded (sync) workers never queue anything. Set them per worker, see serve.py.
+"""
+import functools
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, g
+from werkzeug.exceptions import ServiceUnavailable, TooManyRequests
+
+MAX_TRACKED_USERS = 100000
+
+
+class _RetryAfterMixin(object):
+    def __init__(self, retry_after, description=None):
+        super(_RetryAfterMixin, self).__init__(description)
+        self.retry_after = int(math.ceil(retry_after))
+
+    def get_headers(self, *args, **kwargs):
+        headers = super(_RetryAfterMixin, self).get_headers(*args, **kwargs)
+        # Newer Werkzeug versions already add it from self.retry_after.
+        if not any(name == 'Retry-After' for name, _ in headers):
+            headers.append(('Retry-After', str(self.retry_after)))
+        return headers
+
+
+class Overloaded(_RetryAfterMixin, ServiceUnavailable):
+    pass
+
+
+class RateLimited(_RetryAfterMixin, TooManyRequests):
+    pass
+
+
+class ConcurrencyLimiter(object):
+    """At most limit requests run at once, at most queue_size wait up to timeout seconds for a slot."""
+    def __init__(self, limit, queue_size, timeout):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.active = 0
+        self.waiting = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            if self.active < self.limit:
+                self.active += 1
+                return True
+            if self.waiting >= self.queue_size:
+                return False
+            self.waiting += 1
+            try:
+                deadline = time.monotonic() + self.timeout
+                while self.active >= self.limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self._condition.wait(remaining)
+                self.active += 1
+                return True
+            finally:
+                self.waiting -= 1
+
+    def release(self):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
+
+class TokenBuckets(object):
+    """A token bucket per key, refilled at rate tokens per second up to burst. Least recently
+    used keys are forgotten past max_keys (they start again with a full bucket)."""
+    def __init__(self, rate, burst, max_keys=MAX_TRACKED_USERS):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key):
+        """Takes a token. Returns 0 if there was one, otherwise seconds until there will be."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            wait = 0 if tokens >= 1 else (1 - tokens) / self.rate
+            if not wait:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+class Admission(object):
+    def __init__(self, config):
+        self.retry_after = config.get('ADMISSION_RETRY_AFTER', 1)
+        self.limiters = {
+            name: ConcurrencyLimiter(*params) for name, params in (config.get('ADMISSION_LIMITS') or {}).items()
+        }
+        self.user_buckets = TokenBuckets(config['USER_RATE'], config['USER_BURST']) \
+            if config.get('USER_RATE') else None
+
+
+def init_app(app):
+    app.extensions['admission'] = Admission(app.config)
+
+
+def limited(route_class):
+    """Applies the route class's concurrency limit and the per-user rate limit to a view.
+    Goes below auth.login_required, so the user is known."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            admission = current_app.extensions['admission']
+            if admission.user_buckets is not None and 'user_id' in g:
+                wait = admission.user_buckets.take(g.user_id)
+                if wait:
+                    raise RateLimited(wait, 'Too many requests for this user.')
+
+            limiter = admission.limiters.get(route_class)
+            if limiter is None:
+                return view(*args, **kwargs)
+            if not limiter.acquire():
+                raise Overloaded(admission.retry_after, 'Server busy, retry later.')
+            try:
+                return view(*args, **kwargs)
+            finally:
+                limiter.release()
+        return wrapper
+    return decorator
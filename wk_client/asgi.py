@@ -0,0 +1,184 @@
+"""ASGI entry point, for clients that keep many requests in flight at once.
+
+    uvicorn --factory wk_client.asgi:create_asgi_app --workers 4
+
+Connections, request bodies and responses are handled on the event loop, so a waiting or slow client
+doesn't hold a thread. /get_info is answered on the loop from the body serialized at startup, and
+recorded in the metrics under the same endpoint as the Flask view.
+The other routes run the same Flask views on a thread pool, which keeps the JSON contract identical
+to the WSGI app. At most ASGI_MAX_QUEUE requests wait for one of the ASGI_MAX_WORKERS threads,
+beyond that they are answered 503 straight away instead of piling up on the loop.
+
+This is not an async implementation of the routes. Their database and bank calls stay blocking:
+SQLAlchemy 1.3 and Flask-SQLAlchemy 2 have no asyncio support and the bank client is requests,
+and an async copy of the views would have to duplicate auth, admission control, idempotency and
+the funding flow outside Flask. So a request holds its thread for as long as its view runs, bank
+calls included, and ASGI_MAX_WORKERS is the limit on concurrent work per process.
+"""
+import asyncio
+import io
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from wk_client import create_app, metrics
+from wk_client.config import Config
+
+ASGI_MAX_WORKERS = int(os.environ.get('ASGI_MAX_WORKERS') or 32)
+ASGI_MAX_QUEUE = int(os.environ.get('ASGI_MAX_QUEUE') or 4 * ASGI_MAX_WORKERS)
+RETRY_AFTER = 1
+GET_INFO_ENDPOINT = 'routes.get_info'  # The Flask endpoint, so both paths share the metrics.
+
+
+class AsgiApp(object):
+    def __init__(self, flask_app, max_workers=ASGI_MAX_WORKERS, max_queue=ASGI_MAX_QUEUE):
+        self.flask_app = flask_app
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='wk-asgi')
+        self.max_pending = max_workers + max_queue
+        self.pending = 0  # Requests running on or waiting for a thread. Only changed on the loop.
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            if scope['path'] == '/get_info' and scope['method'] in ('GET', 'HEAD'):
+                await self._get_info(scope, send)
+            else:
+                await self._call_flask(scope, receive, send)
+        else:
+            raise ValueError('Unsupported scope type {}'.format(scope['type']))
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                # Let in-flight views finish, without blocking the loop while they do.
+                await asyncio.get_running_loop().run_in_executor(None, self.executor.shutdown)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _get_info(self, scope, send):
+        start = metrics.request_started(GET_INFO_ENDPOINT)
+        status = 500
+        try:
+            status = await self._send_product_info(scope, send)
+        finally:
+            metrics.request_finished(GET_INFO_ENDPOINT, status, start)
+
+    async def _send_product_info(self, scope, send):
+        product_info = self.flask_app.extensions['product_info']
+        etag = '"{}"'.format(product_info.etag)
+        headers = [
+            (b'etag', etag.encode('latin-1')),
+            (b'cache-control', 'public, max-age={}'.format(self.flask_app.config['PRODUCT_INFO_MAX_AGE']).encode()),
+        ]
+        if_none_match = _header(scope, b'if-none-match')
+        if if_none_match and (if_none_match.strip() == '*' or etag in [t.strip() for t in if_none_match.split(',')]):
+            await send({'type': 'http.response.start', 'status': 304, 'headers': headers})
+            await send({'type': 'http.response.body', 'body': b''})
+            return 304
+        headers += [
+            (b'content-type', b'text/html; charset=utf-8'),
+            (b'content-length', str(len(product_info.body)).encode()),
+        ]
+        await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': b'' if scope['method'] == 'HEAD' else product_info.body})
+        return 200
+
+    async def _call_flask(self, scope, receive, send):
+        body = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body.append(message.get('body', b''))
+            more_body = message.get('more_body', False)
+
+        if self.pending >= self.max_pending:
+            await _send_overloaded(send)
+            return
+        environ = _wsgi_environ(scope, b''.join(body))
+        self.pending += 1
+        try:
+            status, headers, chunks = await asyncio.get_running_loop().run_in_executor(
+                self.executor, self._run_wsgi, environ)
+        finally:
+            self.pending -= 1
+
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers],
+        })
+        await send({'type': 'http.response.body', 'body': b''.join(chunks)})
+
+    def _run_wsgi(self, environ):
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = headers
+
+        result = self.flask_app.wsgi_app(environ, start_response)
+        try:
+            chunks = list(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return response['status'], response['headers'], chunks
+
+
+async def _send_overloaded(send):
+    body = b'Server busy, retry later.'
+    await send({'type': 'http.response.start', 'status': 503, 'headers': [
+        (b'content-type', b'text/plain; charset=utf-8'),
+        (b'content-length', str(len(body)).encode()),
+        (b'retry-after', str(RETRY_AFTER).encode()),
+    ]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def create_asgi_app(config_class=Config):
+    """Builds the app, for uvicorn --factory. Nothing is built when the module is imported."""
+    return AsgiApp(create_app(config_class))
+
+
+def _header(scope, name):
+    values = [v.decode('latin-1') for k, v in scope['headers'] if k.lower() == name]
+    return ','.join(values) if values else None
+
+
+def _wsgi_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/{}'.format(scope.get('http_version', '1.1')),
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE' or name == 'CONTENT_LENGTH':
+            environ[name] = value
+            continue
+        key = 'HTTP_' + name
+        environ[key] = environ[key] + ',' + value if key in environ else value
+    if 'CONTENT_LENGTH' not in environ:
+        environ['CONTENT_LENGTH'] = str(len(body))
+    return environ
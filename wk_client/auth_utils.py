@@ -1,32 +1,172 @@
+import datetime
 from hashlib import sha256
 
-from werkzeug.exceptions import BadRequest
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+from sqlalchemy.exc import IntegrityError
+from werkzeug.exceptions import BadRequest, NotFound
 
-from wk_client import auth, db
+from wk_client import auth, bank, db, metrics, sessions
 from wk_client.models import User
+from wk_client.utils import TTLCache
 from flask import g
 
+CREDENTIAL_CACHE_SIZE = 10000
+CREDENTIAL_CACHE_TTL = 300
+UNKNOWN_USER_CACHE_TTL = 10
+IN_CLAUSE_SIZE = 500  # Below SQLite's limit of 999 bound parameters.
+CHANGED_USERNAMES = 'changed_usernames'
+
+# username -> (user id, hashed password), or None for unknown users.
+# Users changed in this process are invalidated when the change commits, changes made by other
+# workers are picked up when the entry expires.
+credential_cache = TTLCache(CREDENTIAL_CACHE_SIZE, CREDENTIAL_CACHE_TTL)
+_MISSING = object()
+
 
 def hash_pw(password, username):
     # Don't use sha256 if you actually care about security. But here we need speed.
     return sha256(password.encode('utf-8') + username.encode('utf-8')).hexdigest()
 
 
+def valid_credentials(username, password, account):
+    """Whether the fields of a registration are strings that fit in the user table."""
+    return (isinstance(username, str) and isinstance(password, str) and isinstance(account, str)
+            and len(username) <= User.username.type.length and len(account) <= User.account.type.length)
+
+
 def create_user(username, password, account):
+    if not valid_credentials(username, password, account):
+        raise BadRequest()
     hashed_pw = hash_pw(password, username)
     if User.query.filter_by(username=username).scalar():
         raise BadRequest()
-    user = User(username=username, hashed_password=hashed_pw, account=account)
+    user = User(username=username, hashed_password=hashed_pw, account=account, last_write=datetime.datetime.utcnow())
     db.session.add(user)
     db.session.commit()
+    bank.user_map.add(user.account, user.id)
+    sessions.mark_written(user.id)
     return user
 
 
+def create_users(users):
+    """
+    Creates many users in one transaction, with a few statements per batch instead of a query and
+    a commit per user. users is an iterable of (username, password, account).
+    Returns the new user's id for each row, in order, or None where the username or account is taken
+    (or repeated within the batch) or the row isn't valid_credentials.
+    """
+    users = list(users)
+    valid = [valid_credentials(*user) for user in users]
+    taken_usernames = _existing(User.username, {username for (username, _, _), ok in zip(users, valid) if ok})
+    taken_accounts = _existing(User.account, {account for (_, _, account), ok in zip(users, valid) if ok})
+
+    rows = {}  # Index in users -> row to insert.
+    now = datetime.datetime.utcnow()
+    for i, (username, password, account) in enumerate(users):
+        if not valid[i] or username in taken_usernames or account in taken_accounts:
+            continue
+        taken_usernames.add(username)
+        taken_accounts.add(account)
+        rows[i] = {'username': username, 'hashed_password': hash_pw(password, username), 'account': account,
+                   'last_write': now}
+
+    try:
+        if rows:
+            db.session.execute(User.__table__.insert(), list(rows.values()))
+        db.session.commit()
+    except IntegrityError:
+        # Someone registered one of them in the meantime, let the unique constraints sort it out per row.
+        db.session.rollback()
+        rows = {i: row for i, row in rows.items() if _insert_if_free(row)}
+        db.session.commit()
+
+    ids = {}
+    for chunk in _chunks([row['username'] for row in rows.values()]):
+        ids.update(User.query.with_entities(User.username, User.id).filter(User.username.in_(chunk)))
+    results = [None] * len(users)
+    for i, row in rows.items():
+        results[i] = ids[row['username']]
+        # Bulk inserts bypass the ORM events, update the caches here.
+        credential_cache.pop(row['username'])
+        bank.user_map.add(row['account'], results[i])
+        sessions.mark_written(results[i])
+    return results
+
+
+def _existing(column, values):
+    existing = set()
+    for chunk in _chunks(list(values)):
+        existing.update(value for value, in db.session.query(column).filter(column.in_(chunk)))
+    return existing
+
+
+def _insert_if_free(row):
+    try:
+        with db.session.begin_nested():
+            db.session.execute(User.__table__.insert(), row)
+        return True
+    except IntegrityError:
+        return False
+
+
+def _chunks(values, size=IN_CLAUSE_SIZE):
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _mark_changed(mapper, connection, user):
+    # This runs at flush: until the commit, a cache miss would still read and cache the old row.
+    changed = object_session(user).info.setdefault(CHANGED_USERNAMES, set())
+    changed.add(user.username)
+    changed.update(inspect(user).attrs.username.history.deleted)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_credentials(session):
+    for username in session.info.pop(CHANGED_USERNAMES, ()):
+        credential_cache.pop(username)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_changed(session):
+    session.info.pop(CHANGED_USERNAMES, None)
+
+
+def _get_credentials(username):
+    credentials = credential_cache.get(username, _MISSING)
+    if credentials is _MISSING:
+        # Not from a lagging replica: a just registered user would be cached as unknown.
+        with sessions.primary():
+            credentials = User.query.with_entities(User.id, User.hashed_password).filter_by(username=username).first()
+        if credentials is None:
+            credential_cache.set(username, None, ttl=UNKNOWN_USER_CACHE_TTL)
+        else:
+            credentials = tuple(credentials)
+            credential_cache.set(username, credentials)
+    return credentials
+
+
 @auth.verify_password
+@metrics.timed('auth')
 def verify_password(username, password):
     # TODO: Don't verify if the request is coming from untrusted authority.
-    user = User.query.filter_by(username=username).first_or_404()
-    if hash_pw(password, username) == user.hashed_password:
-        g.user = user
+    credentials = _get_credentials(username)
+    if credentials is None:
+        raise NotFound()
+    user_id, hashed_password = credentials
+    if hash_pw(password, username) == hashed_password:
+        g.user_id = user_id
+        g.pop('user', None)
         return True
     return False
+
+
+def current_user():
+    """The authenticated User, loaded on first use in the request."""
+    if 'user' not in g:
+        g.user = User.query.get(g.user_id)
+    return g.user
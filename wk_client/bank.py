@@ -1,20 +1,24 @@
 import csv
 import json
+import threading
+from collections import OrderedDict
+from datetime import timedelta
 from json import JSONDecodeError
 from flask import current_app as app
 
-import dateutil.parser
-import requests
-import logging
+from sqlalchemy import func
 
-from wk_client import db
+from wk_client import db, metrics, summary
 from wk_client.constants import REPAYMENT_TYPE
 from wk_client.models import User, CashFlow
 from wk_client.settings import BANK_HOST, BANK_PASSWORD, BANK_PORT, BANK_USERNAME, BANK_ACCOUNT
+from wk_client.utils import parse_datetime
 
-from generate_transactions import OUR_ACCOUNT, TRANSACTION_FILENAME
+USER_MAP_MAXSIZE = 100000
+USER_MAP_UPDATED_OVERLAP = timedelta(minutes=5)
 
 
+@metrics.timed('bank')
 def send_cash(amount, account_to):
     # TODO: write tests.
     """
@@ -32,7 +36,7 @@ def send_cash(amount, account_to):
         raise ValueError('Couldn\'t send transaction')  # TODO: Use a better.
     return {
         'amount': float(trans['amount']),
-        'timestamp': dateutil.parser.parse(trans['datetime']),
+        'timestamp': parse_datetime(trans['datetime']),
         'bank_ref': trans['reference']
     }
 
@@ -52,6 +56,7 @@ def _send_fake_transaction_request(data):
 
 
 def _send_real_transaction_request(data):
+    import requests
     url = '{}:{}/transaction'.format(BANK_HOST, BANK_PORT)
     return requests.post(url, data=data, auth=(BANK_USERNAME, BANK_PASSWORD), verify=False)
 
@@ -65,65 +70,159 @@ def _send_transaction_request(data):
 def _send_transaction(amount, account_to):
     data = {'account': BANK_ACCOUNT, 'account_to': account_to, 'amount': amount}
     response = _send_transaction_request(data)
-    logging.warning('transaction: request {}, response {}'.format(data, response))
+    app.logger.info('Transaction response: %s', response.status_code, extra={'payload': data})
     if response.status_code == 200:
         return json.loads(response.content)
     else:
         app.logger.error('Error sending transaction: %s, %s. \n %s', amount, account_to, response.content.decode())
 
 
-class UserMap(dict):
-    """Map bank accounts to users"""
-    def __init__(self):
-        all_users = User.query.with_entities(User.account, User.id).all()
-        self.update(all_users)
+class UserMap(object):
+    """Map bank accounts to users.
 
-def _retrieve_fake_cashflows():
-    """Retrieve cashflows from local bank
+    Kept for the life of the process. Users are loaded once and then topped up with those registered
+    since (ids above the watermark), so a sync doesn't scan the users table. Users whose account
+    changed since the last refresh are found by User.updated and their old account is dropped.
+    create_user adds new users straight away; other workers pick them up on refresh. The map holds
+    at most maxsize accounts, least recently used are evicted. Accounts not in the map are looked up
+    individually.
+    """
+    def __init__(self, maxsize=USER_MAP_MAXSIZE):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._engine = None
+        self._accounts = OrderedDict()
+        self._user_accounts = {}
+        self._max_id = 0
+        self._count = 0
+        self._updated = None
+
+    def clear(self):
+        with self._lock:
+            self._start_over(None)
+
+    def _start_over(self, engine):
+        self._engine = engine
+        self._accounts.clear()
+        self._user_accounts.clear()
+        self._max_id = 0
+        self._count = 0
+        self._updated = None
+
+    def refresh(self):
+        """Loads users registered or changed since the last refresh.
+
+        The map starts over if it was built against another database, or if fewer users are left
+        than were loaded (users were deleted).
+        """
+        count, max_id, updated = db.session.query(
+            func.count(User.id), func.max(User.id), func.max(User.updated)).one()
+        max_id = max_id or 0
+        with self._lock:
+            if self._engine is not db.engine or max_id < self._max_id:
+                self._start_over(db.engine)
+            new_users = _accounts(User.id > self._max_id, User.id <= max_id) if max_id > self._max_id else []
+            if count < self._count + len(new_users):
+                self._start_over(db.engine)
+                new_users = _accounts(User.id <= max_id)
+            elif self._updated is not None:
+                # User.updated is set when the change is flushed, not committed: look back a little.
+                since = self._updated - USER_MAP_UPDATED_OVERLAP
+                for account, uid in _accounts(User.updated >= since, User.id <= self._max_id):
+                    self._put(account, uid)
+            for account, uid in new_users:
+                self._put(account, uid)
+            self._max_id = max_id
+            self._count = count
+            self._updated = updated
+
+    def add(self, account, user_id):
+        with self._lock:
+            self._put(account, user_id)
+
+    def _put(self, account, user_id):
+        # Drop the user's previous account, and forget the previous owner of this one.
+        old_account = self._user_accounts.get(user_id)
+        if old_account != account and self._accounts.get(old_account) == user_id:
+            del self._accounts[old_account]
+        old_user_id = self._accounts.get(account)
+        if old_user_id is not None and old_user_id != user_id:
+            self._user_accounts.pop(old_user_id, None)
+        self._accounts[account] = user_id
+        self._user_accounts[user_id] = account
+        self._accounts.move_to_end(account)
+        if len(self._accounts) > self.maxsize:
+            _, evicted = self._accounts.popitem(last=False)
+            self._user_accounts.pop(evicted, None)
+
+    def __getitem__(self, account):
+        with self._lock:
+            if self._engine is db.engine and account in self._accounts:
+                self._accounts.move_to_end(account)
+                return self._accounts[account]
+        uid = User.query.with_entities(User.id).filter_by(account=account).scalar()
+        if uid is None:
+            raise KeyError(account)
+        self.add(account, uid)
+        return uid
+
+
+def _accounts(*criteria):
+    return User.query.with_entities(User.account, User.id).filter(*criteria).all()
+
+
+user_map = UserMap()
+
+
+def _statement_record(tr, our_account):
+    """Flattens a row of the local bank's transaction file into a statement record."""
+    inbound = tr['account_to'] == our_account
+    amount = float(tr['amount'])
+    return {
+        'in': amount if inbound else 0,
+        'out': 0 if inbound else amount,
+        'datetime': parse_datetime(tr['datetime']),
+        'reference': tr['reference'],
+        'account': tr['account_from'] if inbound else tr['account_to'],
+    }
+
+
+def read_statement(filename=None):
+    """Lazily reads the local bank's transaction file.
 
+    Rows are yielded one at a time, so the file is never held in memory in full.
+
+    Yields:
+        dict: 'in', 'out', 'datetime', 'reference' and 'account' of a transaction.
     """
-    #TODO: Testing.
-    with open(TRANSACTION_FILENAME,'r') as f:
-        reader = csv.DictReader(f)
-
-        def inbound_transaction(tr):
-            return [{
-                'in': float(tr['amount']),
-                'out': 0,
-                'datetime':  dateutil.parser.parse(tr['timestamp']),
-                'reference': tr['bank_ref'],
-                'account': tr['account_from'],
-            }]
-        def outbound_transaction(tr):
-            return [{
-                'in': 0,
-                'out': float(tr['amount']),
-                'datetime': dateutil.parser.parse(tr['timestamp']),
-                'reference': tr['bank_ref'],
-                'account': tr['account_to'],
-            }]
-
-        transactions = [inbound_transaction(tr)
-                        if tr['account_to'] == OUR_ACCOUNT
-                        else outbound_transaction(tr)
-                        for tr in reader]
+    from generate_transactions import OUR_ACCOUNT, TRANSACTION_FILENAME
+    with open(filename or TRANSACTION_FILENAME, 'r', newline='') as f:
+        for tr in csv.DictReader(f):
+            yield _statement_record(tr, OUR_ACCOUNT)
 
-    return transactions
+
+def _retrieve_fake_cashflows():
+    """Retrieve cashflows from local bank"""
+    return read_statement()
 
 
 def _retrieve_real_cashflows():
     """Retrieve cashflows from bank server"""
     #TODO: Testing
+    import requests
     try:
         response = requests.get(
             '{}:{}/statement'.format(BANK_HOST, BANK_PORT),
             auth=(BANK_USERNAME, BANK_PASSWORD),
             data={'account': BANK_ACCOUNT},
             verify=False)
-        return json.loads(response.content)
+        transactions = json.loads(response.content)
     except (requests.exceptions.ConnectionError, JSONDecodeError)as e:
         app.logger.error('Could not download transactions from bank. Exception: {}'.format(e))
         return []
+    for tr in transactions:
+        tr['datetime'] = parse_datetime(tr['datetime'])
+    return transactions
 
 
 def _retrieve_all_cashflows():
@@ -144,8 +243,8 @@ def load_new_inbound_cashflows():
     """
 
     cashflows = _retrieve_all_cashflows()
-    existing_cashflows = [cf[0] for cf in CashFlow.query.with_entities(CashFlow.bank_ref).all()]
-    user_map = UserMap()
+    existing_cashflows = {cf[0] for cf in CashFlow.query.with_entities(CashFlow.bank_ref)}
+    user_map.refresh()
     missing_cashflows = []
     for cashflow in cashflows:
         if cashflow['reference'] not in existing_cashflows and cashflow['in'] > 0:
@@ -156,13 +255,14 @@ def load_new_inbound_cashflows():
             else:
                 missing_cashflows.append({
                     'amount': float(cashflow['in']),
-                    'timestamp': dateutil.parser.parse(cashflow['datetime']),
+                    'timestamp': cashflow['datetime'],
                     'bank_ref': cashflow['reference'],
                     'user_id': uid
                     })
     return missing_cashflows
 
 
+@metrics.timed('bank')
 def fetch_cashflows():
     """Stores to database cashflows that weren't stored previously.
     """
@@ -176,6 +276,7 @@ def fetch_cashflows():
             bank_ref = cashflow['bank_ref']
         )
         db.session.add(cf)
+        summary.mark_dirty(cashflow['user_id'], cashflow['timestamp'])
     app.logger.info('Retrieved {} new cashflows'.format(len(new_cashflows)))
     db.session.commit()
 
@@ -183,6 +284,7 @@ def fetch_cashflows():
 def get_time_from_bank():
     """Requests current bank from the bank server. This is not the way to handle time of requests,
     but could be useful for e.g. tracking the game progress."""
+    import requests
     response = requests.get(
         '{}:{}/time_now'.format(BANK_HOST, BANK_PORT),
         auth=(BANK_USERNAME, BANK_PASSWORD),
@@ -0,0 +1,52 @@
+import datetime
+
+import click
+from flask.cli import with_appcontext
+
+from wk_client.utils import parse_datetime
+
+
+@click.command('seed-portfolio')
+@click.argument('n_users', type=int)
+@click.option('--seed', default=0, help='Random seed, the same seed gives the same portfolio.')
+@click.option('--as-of', default=None, help='End of the generated histories (isoformat).')
+@with_appcontext
+def seed_portfolio_command(n_users, seed, as_of):
+    """Seed the database with N_USERS synthetic borrowers."""
+    from wk_client.seed import seed_portfolio, SEED_AS_OF
+    counts = seed_portfolio(n_users, seed=seed, as_of=parse_datetime(as_of) if as_of else SEED_AS_OF)
+    click.echo(', '.join('{}: {}'.format(table, count) for table, count in counts.items()))
+
+
+@click.command('rebuild-borrower-summary')
+@click.option('--as-of', default=None, help='Date to compute the summaries for (isoformat), default today.')
+@with_appcontext
+def rebuild_borrower_summary_command(as_of):
+    """Recompute the borrower_summary table from the ledger, e.g. after bulk loads."""
+    from wk_client import summary
+    as_of = parse_datetime(as_of).date() if as_of else datetime.date.today()
+    click.echo('{} summaries as of {}'.format(summary.rebuild(as_of), as_of.isoformat()))
+
+
+@click.command('refresh-borrower-summary')
+@click.option('--as-of', default=None, help='Date to bring the summaries up to (isoformat), default today.')
+@with_appcontext
+def refresh_borrower_summary_command(as_of):
+    """Bring the summaries of borrowers who still owe something up to date, run daily."""
+    from wk_client import summary
+    as_of = parse_datetime(as_of).date() if as_of else datetime.date.today()
+    click.echo('{} summaries refreshed as of {}'.format(summary.refresh(as_of), as_of.isoformat()))
+
+
+@click.command('export-ledger')
+@click.argument('directory')
+@click.option('--format', 'fmt', type=click.Choice(['auto', 'npz', 'parquet']), default='auto',
+              help='auto: parquet if pyarrow is installed, otherwise npz.')
+@click.option('--table', 'tables', multiple=True, help='Table to export (repeatable), default all ledger tables.')
+@click.option('--batch-size', default=50000, help='Rows fetched and written at a time.')
+@with_appcontext
+def export_ledger_command(directory, fmt, tables, batch_size):
+    """Export cash_flow, loan and decision to DIRECTORY as month partitioned columnar files."""
+    from wk_client.export import DATE_COLUMNS, export_ledger
+    counts = export_ledger(directory, tables=tables or tuple(DATE_COLUMNS), fmt=fmt, batch_size=batch_size)
+    click.echo(', '.join('{}: {}'.format(table, count) for table, count in counts.items()))
@@ -1,5 +1,7 @@
 import os
 
+from wk_client.constants import MIN_LOAN_AMOUNT, MAX_LOAN_AMOUNT, INTEREST_TYPES, REPAYMENT_TYPES
+
 basedir = os.path.abspath(os.path.dirname(__file__))
 
 
@@ -8,9 +10,79 @@ class Config(object):
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Set on every connection to a SQLite database file.
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',  # Readers and the writer don't block each other.
+        'synchronous': 'NORMAL',  # With WAL, fsync at checkpoints instead of every commit.
+        'busy_timeout': 5000,  # Milliseconds to wait for the write lock before failing.
+        'mmap_size': 256 * 1024 * 1024,
+    }
+    # Reads of these endpoints go to SQLALCHEMY_READ_DATABASE_URI (e.g. a replica), when it is set.
+    SQLALCHEMY_READ_DATABASE_URI = os.environ.get('READ_DATABASE_URL')
+    DB_READ_ENDPOINTS = ('routes.get_schedule',)
+    READ_YOUR_WRITES_SECONDS = 10  # A user who wrote reads from the primary for this long.
+    # Engine options for other databases (e.g. Postgres), per process.
+    DB_POOL_OPTIONS = {
+        'pool_size': 10,
+        'max_overflow': 10,
+        'pool_timeout': 10,
+        'pool_recycle': 1800,
+        'pool_pre_ping': True,  # Replace connections the server closed instead of failing the request.
+    }
+
+    PRODUCTS = {'standard': {
+        'amount_min': MIN_LOAN_AMOUNT,
+        'amount_max': MAX_LOAN_AMOUNT,
+        'amount_representative': 3000,
+        'duration_min': 360,
+        'duration_max': 365,
+        'duration_representative': 360,
+        'interest_type': INTEREST_TYPES['compound'],
+        'interest_min': 0.02,
+        'interest_max': 0.2,
+        'interest_representative': 0.05,
+        'fee_flat': 0,
+        'fee_rate_min': 0.,
+        'fee_rate_max': 0.,
+        'apr': 0.20,
+        'repayment_type': REPAYMENT_TYPES[1],
+        'repayment_frequency': '30d'  # Can repayments fall on weekends?
+    }}
+    PRODUCT_INFO_MAX_AGE = 3600
+
+    LOG_FILENAME = os.environ.get('LOG_FILENAME') or 'app.log'
+    LOG_CONSOLE_LEVEL = 'WARNING'  # As Flask's own handler, which the queue handler replaces.
+    LOG_LEVEL = 'INFO'
+    LOG_LEVELS = {'sqlalchemy': 'WARNING', 'urllib3': 'WARNING'}
+    LOG_PAYLOAD_SAMPLE_RATE = 0.1
+    LOG_PAYLOAD_MAX_LENGTH = 1000
+
+    PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')  # Requests with this in PROFILE_HEADER are profiled.
+    PROFILE_HEADER = 'X-Profile'
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE') or 0)
+    PROFILE_DIR = os.environ.get('PROFILE_DIR') or 'profiles'
+    PROFILE_KEEP = 100
+    PROFILE_TOP = 30
+
+    # Route class: (max concurrent requests, max waiting requests, max wait in seconds).
+    ADMISSION_LIMITS = {
+        'scoring': (8, 32, 2.),
+        'funding': (4, 16, 5.),
+    }
+    ADMISSION_RETRY_AFTER = 1
+    USER_RATE = 5.  # Requests per second per user to the limited routes.
+    USER_BURST = 10
+
+    REGISTER_BATCH_MAX = 1000  # Users per /register_batch request.
+
+    IDEMPOTENCY_KEY_TTL = 24 * 3600  # Seconds a recorded response is replayed for.
+    IDEMPOTENCY_WAIT = 10  # Seconds a duplicate waits for the in-flight request with its key.
+    IDEMPOTENCY_IN_FLIGHT_TIMEOUT = 120  # Seconds after which an unfinished request is presumed dead.
 
 
 class TestConfig(Config):
     TESTING = True
     DEBUG = True
     SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    LOG_FILENAME = None
+    LOG_CONSOLE_LEVEL = None
@@ -1,15 +1,121 @@
-from wk_client import models, db
+import threading
+from contextlib import contextmanager
 
+from sqlalchemy import event
 
-def nuke_database():
-    """ Delete all objects"""
-    for cf in models.CashFlow.query.all():
-        db.session.delete(cf)
-    for l in models.Loan.query.all():
-        db.session.delete(l)
-    for dec in models.Decision.query.all():
-        db.session.delete(dec)
-    for u in models.User.query.all():
-        db.session.delete(u)
+from wk_client import bank, models, db
 
+UNIT_OF_WORK = 'unit_of_work'
+USER_LOCK_STRIPES = 64
+
+_user_locks = [threading.Lock() for _ in range(USER_LOCK_STRIPES)]
+
+
+def set_sqlite_pragmas(engine, pragmas):
+    """Applies the pragmas to every new connection of the engine, if its database is a SQLite file."""
+    if engine.dialect.name != 'sqlite' or engine.url.database in (None, '', ':memory:') or not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute('PRAGMA {}={}'.format(name, value))
+        cursor.close()
+
+
+@contextmanager
+def unit_of_work(session=None):
+    """
+    Commits everything done in the block once at the end, or nothing if it raises. Logic functions
+    called inside only flush. Nested blocks join the outermost one.
+    """
+    session = session or db.session
+    if session.info.get(UNIT_OF_WORK):
+        yield session
+        return
+    session.info[UNIT_OF_WORK] = True
+    try:
+        yield session
+        session.commit()
+    except BaseException:
+        session.rollback()
+        raise
+    finally:
+        session.info.pop(UNIT_OF_WORK, None)
+
+
+@contextmanager
+def user_lock(user_id, session=None):
+    """
+    Serializes read-check-write sections per user, e.g. checking the balance before funding.
+    Opens a unit_of_work holding a lock on the user row until it commits: SELECT ... FOR UPDATE,
+    or on SQLite (no row locks) a no-op update taking the database write lock. Threads of this
+    process also wait on a striped in-process lock first, so they don't all queue on the database.
+    Read the user's data inside the block, not before.
+
+    Keep the block to database work: on SQLite every write of every user waits while it is held.
+    Calls to the bank go between two blocks, with a pending row holding the result of the check.
+    """
+    session = session or db.session
+    with _user_locks[hash(user_id) % USER_LOCK_STRIPES]:
+        with unit_of_work(session):
+            users = models.User.__table__
+            if session.get_bind().dialect.name == 'sqlite':
+                # Setting updated too keeps its onupdate from marking the user as changed.
+                session.execute(users.update().where(users.c.id == user_id).values(id=users.c.id, updated=users.c.updated))
+            else:
+                session.execute(users.select().where(users.c.id == user_id).with_for_update())
+            yield session
+
+
+def commit_or_flush(session=None):
+    """Commits, unless inside a unit_of_work, then only flushes (so e.g. ids are assigned)."""
+    session = session or db.session
+    if session.info.get(UNIT_OF_WORK):
+        session.flush()
+    else:
+        session.commit()
+
+
+def nuke_database(preserve=(), recreate=False):
+    """
+    Deletes all rows, with one statement per table (TRUNCATE on Postgres) in foreign key order,
+    without loading anything. Safe between benchmark iterations: uncommitted changes in the session
+    are discarded and the in-process caches of users are cleared.
+    Args:
+        preserve: Names of tables to keep, together with the tables they reference.
+        recreate: Drop and create the cleared tables from the models, e.g. after schema changes.
+
+    Returns:
+        list: Names of the cleared tables.
+    """
+    from wk_client import auth_utils, sessions
+
+    tables = [t for t in reversed(db.metadata.sorted_tables) if t.name not in preserve]  # Referencing first.
+    cleared = {t.name for t in tables}
+    for table in db.metadata.sorted_tables:
+        if table.name in preserve:
+            referenced = {fk.column.table.name for fk in table.foreign_keys} & cleared
+            if referenced:
+                raise ValueError('Table {} references {}, preserve them as well.'.format(
+                    table.name, ', '.join(sorted(referenced))))
+
+    db.session.rollback()  # Also drops pending borrower summary updates.
+    engine = db.get_engine()
+    if recreate:
+        db.session.close()
+        db.metadata.drop_all(bind=engine, tables=tables)
+        db.metadata.create_all(bind=engine, tables=tables)
+    elif tables and engine.dialect.name == 'postgresql':
+        db.session.execute('TRUNCATE {} RESTART IDENTITY'.format(', '.join('"{}"'.format(t.name) for t in tables)))
+    else:
+        for table in tables:
+            db.session.execute(table.delete())
     db.session.commit()
+    db.session.expunge_all()
+
+    bank.user_map.clear()
+    auth_utils.credential_cache.clear()
+    sessions.recent_writers.clear()
+    return [t.name for t in tables]
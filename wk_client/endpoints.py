@@ -1,35 +1,27 @@
+import json
+from collections import namedtuple
+from hashlib import sha256
+
 from flask import current_app
-import logging
 
-from wk_client import logic
-from wk_client.constants import FEE_TYPE, INTEREST_TYPES, REPAYMENT_TYPES, DECLINED_STATE_NAME
-from wk_client.constants import MIN_LOAN_AMOUNT, MAX_LOAN_AMOUNT
-from wk_client.logic import approve_user, decline_user
+from wk_client import logic, metrics
+from wk_client.constants import FEE_TYPE, DECLINED_STATE_NAME
+from wk_client.constants import MIN_LOAN_AMOUNT
+from wk_client.db_utils import user_lock
+from wk_client.logic import UserAccount, approve_user, decline_user
 from wk_client.request_utils import time_now
 from wk_client.utils import get_date
 
-logging.basicConfig(level=logging.DEBUG, filename='app.log', filemode='w', format='%(name)s - %(levelname)s - %(message)s')
-
-def get_product_data():
-    # TODO: The product details of this endpoint should be tied in to the config, somehow, so that the actual product would also follow it.
-    return {'standard': {
-        'amount_min': MIN_LOAN_AMOUNT,
-        'amount_max': MAX_LOAN_AMOUNT,
-        'amount_representative': 3000,
-        'duration_min': 360,
-        'duration_max': 365,
-        'duration_representative': 360,
-        'interest_type': INTEREST_TYPES['compound'],
-        'interest_min': 0.02,
-        'interest_max': 0.2,
-        'interest_representative': 0.05,
-        'fee_flat': 0,
-        'fee_rate_min': 0.,
-        'fee_rate_max': 0.,
-        'apr': 0.20,
-        'repayment_type': REPAYMENT_TYPES[1],
-        'repayment_frequency': '30d'  # Can repayments fall on weekends?
-    }}
+
+def get_product_data(config):
+    return config['PRODUCTS']
+
+
+class ProductInfo(object):
+    """The /get_info response body, serialized once per app, with its strong ETag."""
+    def __init__(self, product_data):
+        self.body = json.dumps(product_data).encode('utf-8')
+        self.etag = sha256(self.body).hexdigest()
 
 
 def get_decision(user, data):
@@ -39,14 +31,13 @@ def get_decision(user, data):
     else:
         data['time_now'] = time_now()
         try:
-            raw_decision = logic.evaluate_decision(data)
+            with metrics.timed('scoring'):
+                raw_decision = logic.evaluate_decision(data)
         except Exception as e:
-            current_app.logger.error('Unexpected Error evaluating decision. Rejected. %s, %s', e, data)
+            current_app.logger.error('Unexpected Error evaluating decision. Rejected. %s', e, extra={'payload': data})
             decision = decline_user(user, time_now())
         else:
-            logging.warning("decision made :")
-            logging.warning(raw_decision.approved)
-            logging.warning(raw_decision.params)
+            current_app.logger.info('Decision made: %s', raw_decision.approved, extra={'payload': raw_decision.params})
             if raw_decision.approved:
                 decision = approve_user(user, time_now(), **raw_decision.params)
             else:
@@ -54,7 +45,16 @@ def get_decision(user, data):
         return {'decision': decision.to_dict(), 'requirements': requirements}
 
 
-def request_funding(user_account, approval_id, amount, dt):
+Reservation = namedtuple('Reservation', ['pending', 'decision', 'balance'])
+
+
+def reserve_funding(user_account, approval_id, amount, dt):
+    """
+    Checks the approval and amount, and holds the amount with a pending funding cashflow, so a
+    concurrent request can't draw it too while the bank is called. Call inside user_lock.
+
+    Returns: (Reservation, None), or (None, error message).
+    """
     active_decision = user_account.get_active_decision(dt)
     if (active_decision is None
             or approval_id != active_decision.id
@@ -62,28 +62,61 @@ def request_funding(user_account, approval_id, amount, dt):
         return None, 'Invalid Decision'
 
     cur_balance = user_account.balance(get_date(dt))
-    if MIN_LOAN_AMOUNT <= cur_balance + amount <= active_decision.amount:
-        try:
-            funding = user_account.add_funding(amount)
-        except ValueError:
-            return None, 'Funding Error'
-
-        fee = active_decision.fee_rate * amount + active_decision.fee_amount
-        if fee:
-            user_account.add_cashflow(
-                -1*fee,
-                funding.datetime,
-                cashflow_type=FEE_TYPE,
-                ref='Internal'
-            )
-
-        loan = user_account.create_loan(
+    if not MIN_LOAN_AMOUNT <= cur_balance + amount <= active_decision.amount:
+        return None, 'Invalid Amount'
+
+    pending = user_account.reserve_funding(amount, dt)
+    return Reservation(pending, active_decision, cur_balance), None
+
+
+def send_funding(user_account, reservation):
+    """
+    Sends the reserved funding, outside any user lock. If the bank refuses, the reservation is removed.
+
+    Returns: (the bank's confirmation, None), or (None, error message).
+    """
+    try:
+        return user_account.send_funding(reservation.pending), None
+    except ValueError:
+        return None, 'Funding Error'
+
+
+def book_funding(user_account, reservation, sent):
+    """
+    Records a sent funding: the bank's confirmation, the fee, the loan and its repayment schedule.
+    Call inside user_lock, they are committed together when it exits.
+
+    Returns: (loan, repayment schedule keyed by ISO date)
+    """
+    funding = user_account.record_funding(reservation.pending, sent)
+    decision = reservation.decision
+    amount = -1 * funding.amount
+    fee = decision.fee_rate * amount + decision.fee_amount
+    if fee:
+        user_account.add_cashflow(
+            -1*fee,
             funding.datetime,
-            cur_balance + amount + fee,
-            duration_days=active_decision.duration_days,
-            interest_daily=active_decision.interest_daily,
-            repayment_frequency_days=active_decision.repayment_frequency_days
+            cashflow_type=FEE_TYPE,
+            ref='Internal'
         )
-        return loan, None
-    else:
-        return None, 'Invalid Amount'
+
+    loan = user_account.create_loan(
+        funding.datetime,
+        reservation.balance + amount + fee,
+        duration_days=decision.duration_days,
+        interest_daily=decision.interest_daily,
+        repayment_frequency_days=decision.repayment_frequency_days
+    )
+    schedule = {k.isoformat(): v for k, v in user_account.repayment_schedule_for_loan(loan).items()}
+    loan.repayment_schedule = json.dumps(schedule)
+    return loan, schedule
+
+
+def record_sent_funding(user_id, reservation, sent):
+    """
+    Commits the bank's confirmation of a sent funding on its own, after book_funding failed, so
+    the cash sent is in the ledger. The loan needs adding by hand.
+    """
+    current_app.logger.exception('Funding %s sent to user %s but no loan recorded', sent['bank_ref'], user_id)
+    with user_lock(user_id):
+        UserAccount(user_id).record_funding(reservation.pending, sent)
@@ -0,0 +1,131 @@
+"""Columnar export of the ledger, for analytics and model retraining.
+
+Rows of cash_flow, loan and decision are streamed in date order with server-side cursors
+(Query.yield_per) and written in chunks of at most batch_size rows, so memory stays constant
+however large the tables are. Files are partitioned by month:
+
+    <directory>/<table>/month=2019-02/part-00000.npz  (or .parquet)
+
+npz parts hold one array per column. NULLs become NaN in numeric columns, NaT in datetimes and ''
+in strings; nullable integer columns are stored as floats. Parquet (needs pyarrow) keeps NULLs.
+A table is written to a temporary directory first and swapped in when complete.
+"""
+import glob
+import os
+import shutil
+
+import numpy
+from sqlalchemy import DateTime, Float, Integer
+
+from wk_client import db, models  # noqa: F401, registers the tables.
+
+EXPORT_BATCH_SIZE = 50000
+DATE_COLUMNS = {
+    'cash_flow': 'datetime',
+    'loan': 'start_datetime',
+    'decision': 'datetime',
+}
+FORMATS = ('auto', 'npz', 'parquet')
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        return None
+    return pyarrow
+
+
+def export_ledger(directory, tables=tuple(DATE_COLUMNS), fmt='auto', batch_size=EXPORT_BATCH_SIZE):
+    """
+    Exports the tables to month partitioned columnar files under directory.
+    Args:
+        fmt: 'npz', 'parquet', or 'auto' for parquet if pyarrow is installed, otherwise npz.
+
+    Returns:
+        dict: Number of rows exported per table.
+    """
+    if fmt == 'auto':
+        fmt = 'parquet' if _pyarrow() else 'npz'
+    if fmt == 'parquet' and not _pyarrow():
+        raise RuntimeError('Parquet export needs pyarrow, install it or use npz.')
+    if fmt not in FORMATS:
+        raise ValueError('Unknown format {}'.format(fmt))
+    return {table: _export_table(db.metadata.tables[table], directory, fmt, batch_size) for table in tables}
+
+
+def _export_table(table, directory, fmt, batch_size):
+    target = os.path.join(directory, table.name)
+    tmp = os.path.join(directory, '.{}.tmp'.format(table.name))
+    shutil.rmtree(tmp, ignore_errors=True)
+
+    date_column = table.c[DATE_COLUMNS[table.name]]
+    query = db.session.query(*table.c).order_by(date_column, *table.primary_key.columns).yield_per(batch_size)
+    date_index = list(table.c).index(date_column)
+
+    n_rows = 0
+    month, rows, part = None, [], 0
+    for row in query:
+        row_month = row[date_index].strftime('%Y-%m')
+        if row_month != month or len(rows) >= batch_size:
+            if rows:
+                _write_part(table, rows, os.path.join(tmp, 'month=' + month), part, fmt)
+            part = part + 1 if row_month == month else 0
+            month, rows = row_month, []
+        rows.append(row)
+        n_rows += 1
+    if rows:
+        _write_part(table, rows, os.path.join(tmp, 'month=' + month), part, fmt)
+
+    os.makedirs(tmp, exist_ok=True)
+    shutil.rmtree(target, ignore_errors=True)
+    os.rename(tmp, target)
+    return n_rows
+
+
+def _write_part(table, rows, directory, part, fmt):
+    os.makedirs(directory, exist_ok=True)
+    values = list(zip(*rows))
+    filename = os.path.join(directory, 'part-{:05d}.{}'.format(part, fmt))
+    if fmt == 'parquet':
+        pyarrow = _pyarrow()
+        pyarrow.parquet.write_table(
+            pyarrow.table({column.name: list(column_values) for column, column_values in zip(table.c, values)}),
+            filename)
+    else:
+        numpy.savez(filename, **{column.name: _column_array(column, column_values)
+                                 for column, column_values in zip(table.c, values)})
+
+
+def _column_array(column, values):
+    if isinstance(column.type, DateTime):
+        return numpy.array([numpy.datetime64('NaT') if v is None else v for v in values], dtype='datetime64[us]')
+    if isinstance(column.type, Float) or (isinstance(column.type, Integer) and column.nullable):
+        return numpy.array([numpy.nan if v is None else v for v in values], dtype=numpy.float64)
+    if isinstance(column.type, Integer):
+        return numpy.array(values, dtype=numpy.int64)
+    return numpy.array(['' if v is None else str(v) for v in values])
+
+
+def read_npz(directory, table, months=None):
+    """
+    Reads an npz export back into one array per column.
+    Args:
+        months: Only these months ('YYYY-MM'), default all.
+
+    Returns:
+        dict: column name -> numpy array, rows in date order.
+    """
+    parts = sorted(glob.glob(os.path.join(directory, table, 'month=*', 'part-*.npz')))
+    if months is not None:
+        months = set(months)
+        parts = [p for p in parts if os.path.basename(os.path.dirname(p))[len('month='):] in months]
+    columns = {}
+    for path in parts:
+        with numpy.load(path) as part:
+            for name in part.files:
+                columns.setdefault(name, []).append(part[name])
+    if not columns:
+        return {column.name: numpy.array([]) for column in db.metadata.tables[table].c}
+    return {name: numpy.concatenate(arrays) for name, arrays in columns.items()}
@@ -0,0 +1,146 @@
+"""Idempotency-Key support for routes with side effects.
+
+The first request with a key claims it by inserting a row, runs, and records its response on the
+row. A retry with the same key gets the recorded response without running the view again, so no
+repeated balance/schedule computation and no second bank transfer. A duplicate arriving while the
+first is still running waits for it (up to IDEMPOTENCY_WAIT, then 409).
+
+Only successful responses are recorded: on an error the key is released and a retry runs afresh,
+unless the view had started side effects (side_effects_started), e.g. the bank may have sent cash.
+Then the key stays, and retries get 409 until the request is checked by hand. A view can record its
+response in the same transaction as its writes (save_response), so a crash can't separate them.
+A request that didn't finish within IDEMPOTENCY_IN_FLIGHT_TIMEOUT is presumed dead.
+Keys are per user, and reusing one with a different request body is rejected with 422.
+"""
+import datetime
+import functools
+import time
+from hashlib import sha256
+
+from flask import Response, current_app, g, request
+from sqlalchemy.exc import IntegrityError
+from werkzeug.exceptions import BadRequest, Conflict, UnprocessableEntity
+
+from wk_client import db
+from wk_client.models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 80
+POLL_INTERVAL = 0.05
+
+
+def idempotent(view):
+    """Makes a view idempotent per Idempotency-Key. Goes below auth.login_required."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None:
+            return view(*args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            raise BadRequest('Invalid {} header.'.format(HEADER))
+
+        request_hash = sha256(request.get_data()).hexdigest()
+        record = _claim(g.user_id, key, request_hash)
+        if record.request_hash != request_hash:
+            raise UnprocessableEntity('{} was used for a different request.'.format(HEADER))
+        if record.status_code is not None:
+            return _replay(record)
+
+        g.idempotency_record = record
+        try:
+            response = current_app.make_response(view(*args, **kwargs))
+        except Exception:
+            _release_unless_side_effects(record)
+            raise
+        if g.get('idempotency_saved'):
+            return response
+        if response.status_code >= 300:
+            _release_unless_side_effects(record)
+            return response
+        record.status_code = response.status_code
+        record.response = response.get_data(as_text=True)
+        db.session.add(record)
+        db.session.commit()
+        return response
+    return wrapper
+
+
+def side_effects_started():
+    """
+    Marks the key of the current request as having side effects, in the caller's transaction
+    (commit it before starting them). From then on the key isn't released if the request fails.
+    """
+    record = g.get('idempotency_record')
+    if record is not None:
+        record.side_effects = True
+        db.session.add(record)
+        g.idempotency_side_effects = True
+
+
+def side_effects_undone():
+    """The side effects didn't happen after all, e.g. the bank refused the transfer."""
+    g.idempotency_side_effects = False
+
+
+def save_response(body, status_code=200):
+    """Records the response of the current request in the caller's transaction."""
+    record = g.get('idempotency_record')
+    if record is not None:
+        record.status_code = status_code
+        record.response = body
+        db.session.add(record)
+        g.idempotency_saved = True
+
+
+def _claim(user_id, key, request_hash):
+    """Returns our new in-flight record for the key, or the existing one once it has a response."""
+    ttl = datetime.timedelta(seconds=current_app.config['IDEMPOTENCY_KEY_TTL'])
+    in_flight_timeout = datetime.timedelta(seconds=current_app.config['IDEMPOTENCY_IN_FLIGHT_TIMEOUT'])
+    deadline = time.monotonic() + current_app.config['IDEMPOTENCY_WAIT']
+    while True:
+        now = datetime.datetime.utcnow()
+        record = IdempotencyKey(user_id=user_id, key=key, request_hash=request_hash, created=now)
+        db.session.add(record)
+        try:
+            db.session.commit()
+            return record
+        except IntegrityError:
+            db.session.rollback()
+
+        existing = IdempotencyKey.query.filter_by(user_id=user_id, key=key).first()
+        if existing is None:
+            continue  # Released in the meantime, claim it again.
+        if existing.status_code is not None:
+            if existing.created < now - ttl:
+                _delete(existing)
+                continue
+            return existing
+        if existing.request_hash != request_hash:
+            return existing
+        if existing.created < now - in_flight_timeout:
+            if existing.side_effects:
+                raise Conflict('A request with this {} failed part way and needs checking.'.format(HEADER))
+            _delete(existing)  # Its worker died before doing anything.
+            continue
+        if time.monotonic() >= deadline:
+            raise Conflict('A request with this {} is still in progress.'.format(HEADER))
+        # End the transaction, so the next read sees the in-flight request's commit.
+        db.session.rollback()
+        time.sleep(POLL_INTERVAL)
+
+
+def _release_unless_side_effects(record):
+    db.session.rollback()
+    if not g.get('idempotency_side_effects'):
+        _delete(record)
+
+
+def _delete(record):
+    IdempotencyKey.query.filter_by(id=record.id).delete()
+    db.session.commit()
+
+
+def _replay(record):
+    response = Response(record.response, status=record.status_code)
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
@@ -0,0 +1,141 @@
+"""Logging setup: request threads put records on a queue, a listener thread writes them as JSON lines.
+
+Only the app's logger (and its children) go through the queue. Other libraries, e.g. werkzeug's
+request log, keep their own handlers.
+
+Payloads (request bodies, model inputs...) are passed as ``extra={'payload': ...}``. They are sampled
+and truncated before they are queued, so big application bodies don't flood the log.
+"""
+import atexit
+import copy
+import datetime
+import json
+import logging
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_QUEUE_SIZE = 10000
+
+CONSOLE_FORMAT = '[%(asctime)s] %(levelname)s in %(module)s: %(message)s'
+
+_listener = None
+_queue_handler = None
+_logger = None
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats records as one JSON object per line."""
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.utcfromtimestamp(record.created).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        payload = getattr(record, 'payload', None)
+        if payload is not None:
+            entry['payload'] = payload
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class PayloadQueueHandler(QueueHandler):
+    """Queues records without blocking, dropping them when the queue is full.
+
+    Formatting is left to the listener thread. Only the message, the exception and the (sampled,
+    truncated) payload are resolved here, as they may not be safe to read later.
+    """
+    def __init__(self, log_queue, payload_sample_rate=1., payload_max_length=1000):
+        super(PayloadQueueHandler, self).__init__(log_queue)
+        self.payload_sample_rate = payload_sample_rate
+        self.payload_max_length = payload_max_length
+        self.dropped = 0
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+
+        payload = getattr(record, 'payload', None)
+        if payload is not None:
+            if random.random() < self.payload_sample_rate:
+                payload = payload if isinstance(payload, str) else json.dumps(payload, default=str)
+                if len(payload) > self.payload_max_length:
+                    payload = payload[:self.payload_max_length] + '...'
+                record.payload = payload
+            else:
+                record.payload = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def configure_logging(config, logger_name):
+    """Sets up the queue based logging pipeline of a logger from the app config. Safe to call more
+    than once, the previous pipeline is flushed and replaced.
+
+    Config:
+        LOG_FILENAME: File to append JSON lines to. None disables the file.
+        LOG_CONSOLE_LEVEL: Records of this level and above are also written to stderr. None disables it.
+        LOG_LEVEL: Level of the logger.
+        LOG_LEVELS: Levels of individual loggers, e.g. {'sqlalchemy.engine': 'WARNING'}.
+        LOG_PAYLOAD_SAMPLE_RATE: Fraction of records that keep their payload.
+        LOG_PAYLOAD_MAX_LENGTH: Payloads are truncated to this many characters.
+    """
+    global _listener, _queue_handler, _logger
+    stop_logging()
+
+    handlers = []
+    if config.get('LOG_FILENAME'):
+        file_handler = logging.FileHandler(config['LOG_FILENAME'], mode='a', delay=True)
+        file_handler.setFormatter(JSONFormatter())
+        handlers.append(file_handler)
+    if config.get('LOG_CONSOLE_LEVEL'):
+        console_handler = logging.StreamHandler()
+        console_handler.setLevel(config['LOG_CONSOLE_LEVEL'])
+        console_handler.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+        handlers.append(console_handler)
+
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    _queue_handler = PayloadQueueHandler(
+        log_queue,
+        payload_sample_rate=config.get('LOG_PAYLOAD_SAMPLE_RATE', 1.),
+        payload_max_length=config.get('LOG_PAYLOAD_MAX_LENGTH', 1000),
+    )
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+
+    _logger = logging.getLogger(logger_name)
+    _logger.addHandler(_queue_handler)
+    _logger.setLevel(config.get('LOG_LEVEL', logging.INFO))
+    for name, level in config.get('LOG_LEVELS', {}).items():
+        logging.getLogger(name).setLevel(level)
+
+    _listener.start()
+
+
+def stop_logging():
+    """Flushes queued records and removes the pipeline."""
+    global _listener, _queue_handler, _logger
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+    if _queue_handler is not None:
+        _logger.removeHandler(_queue_handler)
+        _queue_handler = None
+        _logger = None
+
+
+atexit.register(stop_logging)
@@ -1,20 +1,21 @@
 import bisect
 import datetime
 import json
-import logging
+import uuid
 from collections import namedtuple
-from wk_client.risk_model import XGB_classifier
 
 import dateutil
+from flask import current_app
 
-from wk_client import models, bank
+from wk_client import models, bank, metrics, summary
 from wk_client.constants import APPROVED_STATE_NAME, DECLINED_STATE_NAME, FUNDING_TYPE, DECISION_VALID_FOR_DAYS, \
     EXAMPLE_DOC_REQUIREMENTS
+from wk_client.db_utils import commit_or_flush
 from wk_client.models import CashFlow, Loan
 from wk_client.utils import get_repayment_amount, get_date
 
 Rate = namedtuple('rate', ['date', 'rate'])
-logging.basicConfig(level=logging.DEBUG, filename='app.log', filemode='w', format='%(name)s - %(levelname)s - %(message)s')
+PENDING_REF_PREFIX = 'pending-'  # bank_ref of a funding not confirmed by the bank yet.
 
 class UserAccount(object):
     def __init__(self, user_id=None):
@@ -28,9 +29,31 @@ class UserAccount(object):
             if dt - datetime.timedelta(days=DECISION_VALID_FOR_DAYS) < d.datetime <= dt:
                 return d
 
-    def add_funding(self, amount):
-        cashflow = bank.send_cash(amount=amount, account_to=self.user.account)
-        return self.add_cashflow(-1 * cashflow['amount'], cashflow['timestamp'], FUNDING_TYPE, ref=cashflow['bank_ref'])
+    def reserve_funding(self, amount, dt):
+        """Adds a pending funding cashflow. It counts towards the balance until send_funding replaces it."""
+        return self.add_cashflow(-1 * amount, dt, FUNDING_TYPE, ref=PENDING_REF_PREFIX + uuid.uuid4().hex)
+
+    def send_funding(self, pending):
+        """
+        Sends a pending funding through the bank and returns the bank's confirmation, for record_funding.
+        Raises ValueError if the bank didn't send the cash, the pending cashflow is removed then.
+        """
+        try:
+            return bank.send_cash(amount=-1 * pending.amount, account_to=self.user.account)
+        except ValueError:
+            models.db.session.delete(pending)
+            self.cashflows = [c for c in self.cashflows if c is not pending]
+            commit_or_flush()
+            raise
+
+    def record_funding(self, pending, sent):
+        """Records the bank's confirmation of a sent funding (from send_funding) on its pending cashflow."""
+        pending.amount = -1 * sent['amount']
+        pending.datetime = sent['timestamp']
+        pending.bank_ref = sent['bank_ref']
+        summary.mark_dirty(self.user.id, pending.datetime, account=self)
+        commit_or_flush()
+        return pending
 
     def add_cashflow(self, amount, dt, cashflow_type, ref=None):
         """
@@ -48,9 +71,10 @@ class UserAccount(object):
             ref = 'Internal'
         cf = models.CashFlow(user=self.user, amount=amount, datetime=dt, type=cashflow_type, bank_ref=ref)
         models.db.session.add(cf)
-        models.db.session.commit()
-
+        # Before committing: the summary is computed from this account on commit.
         self.cashflows = sorted(self.cashflows + [cf], key=lambda x: x.datetime)
+        summary.mark_dirty(self.user.id, dt, account=self)
+        commit_or_flush()
         return cf
 
     def create_loan(self, start_datetime, opening_balance,
@@ -74,10 +98,10 @@ class UserAccount(object):
                     repayment_frequency_days=repayment_frequency_days, repayment_amount=round(rep_am + 0.005, 2))
 
         models.db.session.add(loan)
-        models.db.session.commit()
-
         # TODO: Bisect for insertion in sorted list.
         self.loans = sorted(self.loans + [loan], key=lambda x: x.start_datetime)
+        summary.mark_dirty(self.user.id, start_datetime, account=self)
+        commit_or_flush()
         return loan
 
     @staticmethod
@@ -104,6 +128,7 @@ class UserAccount(object):
             start_balance *= (1 + prev_rate.rate)**dur
         return start_balance
 
+    @metrics.timed('balance')
     def balance(self, as_of):
         rates = self.interest_rates_from_loans(self.loans)
         return UserAccount.balance_from_cashflows(self.cashflows, rates, as_of)
@@ -144,12 +169,14 @@ class UserAccount(object):
 
         return current_balance
 
+    @metrics.timed('schedule')
     def repayment_schedule_for_loan(self, loan):
         fake_cashflows = [CashFlow(datetime=loan.start_datetime, amount=-1 * loan.opening_balance, type=0)]
         rates = [Rate(loan.start_datetime.date(), loan.interest_daily)]
         as_of = loan.start_datetime.date()
         return self.repayment_schedule2(loan, fake_cashflows, rates, as_of)
 
+    @metrics.timed('schedule')
     def repayment_schedule_for_date(self, as_of):
         real_cashflows = [c for c in self.cashflows if get_date(c.datetime) <= as_of]
         loans = [l for l in self.loans if l.start_datetime.date() <= as_of]
@@ -214,6 +241,34 @@ class UserAccount(object):
         dates = [dt for dt in [get_date(c.datetime) for c in schedule] if dt >= as_of]
         return {date: sum(c.amount for c in schedule if get_date(c.datetime) == date) for date in dates}
 
+    def summary(self, as_of):
+        """
+        What the borrower owes on as_of, the values of their borrower_summary row.
+        Arrears are the minimum repayments that fell due before as_of and weren't paid.
+        """
+        balance = self.balance(as_of)
+        loans = [l for l in self.loans if get_date(l.start_datetime) <= as_of]
+        result = {'as_of': as_of, 'balance': balance, 'active_loan_id': None,
+                  'next_due_date': None, 'next_due_amount': None, 'arrears': 0}
+        if not loans or balance <= 0.01:
+            return result
+
+        loan = loans[-1]
+        cashflows = [c for c in self.cashflows if get_date(c.datetime) <= as_of]
+        # The schedule includes repayments already made on as_of, they aren't due any more.
+        paid_today = sum(c.amount for c in cashflows if get_date(c.datetime) == as_of and c.amount > 0)
+        schedule = self.repayment_schedule_for_date(as_of)
+        due = [(date, round(amount - (paid_today if date == as_of else 0), 2))
+               for date, amount in sorted(schedule.items())]
+        due = [(date, amount) for date, amount in due if amount > 0]
+        result.update(
+            active_loan_id=loan.id,
+            arrears=min(balance, self.payment_due(loan, cashflows, as_of - datetime.timedelta(1))),
+        )
+        if due:
+            result.update(next_due_date=due[0][0], next_due_amount=due[0][1])
+        return result
+
     def payment_due(self, loan, cashflows, as_of):
         """
         Returns payment due, considering min repayment and any cashflows. Doesn't consider balance.
@@ -261,14 +316,14 @@ def approve_user(user, dt, amount, interest_rate, fee_rate=0, fee_amount=0):
     )
 
     models.db.session.add(decision)
-    models.db.session.commit()
+    commit_or_flush()
     return decision
 
 
 def decline_user(user, dt):
     decision = models.Decision(user=user, decision=DECLINED_STATE_NAME, datetime=dt)
     models.db.session.add(decision)
-    models.db.session.commit()
+    commit_or_flush()
     return decision
 
 
@@ -292,8 +347,6 @@ def check_requirements(data, requirements):
 
 
 def evaluate_decision(data):
-    model_data = []
-
     company_params = ['liabilities', 'score',
       'turnover', 'number_of_employees', 'assets',
       'year_of_incorporation']
@@ -303,25 +356,24 @@ def evaluate_decision(data):
       'age_of_oldest_account', 'missed_payments_last_12m',
       'year_of_birth']
 
+    # Features named as the columns of retro_data.csv, missing ones are left to the model as None.
+    model_data = {}
     for param in person_params:
-        if(data['credit_report'][param] != None):
-            model_data.append("personal__" + param : data[param])
-        else:
-            model_data.push("" + param : "")
-
+        model_data['personal__' + param] = data['credit_report'].get(param)
     for param in company_params:
-        if(data['company_report'][param] != None):
-            model_data.append("company__" + param : data[param])
-        else:
-            model_data.push("" + param : "")
-
-    model_data.append("loan_amount" : data['basic_questions']['amount_requested'])
-
-    model = XGB_classifier()
+        model_data['company__' + param] = data['company_report'].get(param)
+    model_data['loan_amount'] = data['basic_questions']['amount_requested']
+    # The application has the dates these years come from.
+    if model_data['personal__year_of_birth'] is None and data['basic_questions'].get('date_of_birth'):
+        model_data['personal__year_of_birth'] = int(data['basic_questions']['date_of_birth'][:4])
+    if model_data['company__year_of_incorporation'] is None and data['company_report'].get('incorporation_date'):
+        model_data['company__year_of_incorporation'] = int(data['company_report']['incorporation_date'][:4])
+
+    from wk_client.risk_model import get_classifier  # pandas and xgboost, only load them when scoring.
+    model = get_classifier()
     condition = model._predict(model_data)
 
-    logging.warning("data passed to model : ")
-    logging.warning(model_data)
+    current_app.logger.info('Data passed to model', extra={'payload': model_data})
 
     if condition:
         params = {'amount': data['basic_questions']['amount_requested'], 'interest_rate': 0.0005, 'fee_amount': 0, 'fee_rate': 0}
@@ -0,0 +1,188 @@
+"""Request and phase metrics, exposed on /metrics in the Prometheus text format.
+
+Every thread records into its own store, so recording takes no lock. Stores are summed when the
+metrics are rendered. Stores of finished threads are folded into one retired store, so a server
+that starts a thread per request doesn't accumulate them.
+
+The registry is per process. Behind a server with several worker processes (gunicorn --workers,
+uvicorn --workers) /metrics shows the worker that happened to answer, and its counters restart
+with the worker. Scrape each worker on its own port, or run one worker per instance, for numbers
+that add up.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10.)
+MAX_LIVE_STORES = 256
+
+REQUEST_DURATION = 'wk_http_request_duration_seconds'
+RESPONSES = 'wk_http_responses_total'
+IN_FLIGHT = 'wk_http_requests_in_flight'
+PHASE_DURATION = 'wk_phase_duration_seconds'
+
+METRIC_TYPES = {
+    REQUEST_DURATION: ('histogram', 'Request latency by endpoint.'),
+    RESPONSES: ('counter', 'Responses by endpoint and status code.'),
+    IN_FLIGHT: ('gauge', 'Requests being handled by endpoint.'),
+    PHASE_DURATION: ('histogram', 'Time in internal phases: auth, scoring, balance, schedule, bank, db_commit.'),
+}
+
+
+class _Store(object):
+    def __init__(self):
+        self.values = {}  # (name, labels) -> float, for counters and gauges.
+        self.histograms = {}  # (name, labels) -> [count per bucket..., +Inf bucket, sum]
+
+    def merge(self, other, buckets):
+        for key, value in list(other.values.items()):
+            self.values[key] = self.values.get(key, 0) + value
+        for key, counts in list(other.histograms.items()):
+            mine = self.histograms.setdefault(key, [0] * (len(buckets) + 2))
+            for i, count in enumerate(counts):
+                mine[i] += count
+
+
+class MetricsRegistry(object):
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stores = []  # (thread, store)
+        self._retired = _Store()
+
+    def _store(self):
+        try:
+            return self._local.store
+        except AttributeError:
+            store = self._local.store = _Store()
+            with self._lock:
+                self._stores.append((threading.current_thread(), store))
+                if len(self._stores) > MAX_LIVE_STORES:
+                    self._retire()
+            return store
+
+    def _retire(self):
+        live = []
+        for thread, store in self._stores:
+            if thread.is_alive():
+                live.append((thread, store))
+            else:
+                self._retired.merge(store, self.buckets)
+        self._stores = live
+
+    def inc(self, name, labels=(), amount=1):
+        values = self._store().values
+        key = (name, labels)
+        values[key] = values.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        histograms = self._store().histograms
+        key = (name, labels)
+        counts = histograms.get(key)
+        if counts is None:
+            counts = histograms[key] = [0] * (len(self.buckets) + 2)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def snapshot(self):
+        total = _Store()
+        with self._lock:
+            self._retire()
+            total.merge(self._retired, self.buckets)
+            for _, store in self._stores:
+                total.merge(store, self.buckets)
+        return total
+
+    def reset(self):
+        with self._lock:
+            self._stores = []
+            self._retired = _Store()
+            self._local = threading.local()
+
+    def render(self):
+        """Renders all metrics in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        by_name = {}
+        for (name, labels), value in snapshot.values.items():
+            by_name.setdefault(name, []).append((labels, value))
+        for (name, labels), counts in snapshot.histograms.items():
+            by_name.setdefault(name, []).append((labels, counts))
+
+        lines = []
+        for name in sorted(by_name):
+            metric_type, description = METRIC_TYPES.get(name, ('untyped', name))
+            lines.append('# HELP {} {}'.format(name, description))
+            lines.append('# TYPE {} {}'.format(name, metric_type))
+            for labels, value in sorted(by_name[name]):
+                if metric_type == 'histogram':
+                    lines.extend(self._render_histogram(name, labels, value))
+                else:
+                    lines.append('{}{} {}'.format(name, _format_labels(labels), _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+    def _render_histogram(self, name, labels, counts):
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            yield '{}_bucket{} {}'.format(name, _format_labels(labels + (('le', le),)), cumulative)
+        yield '{}_sum{} {}'.format(name, _format_labels(labels), _format_value(counts[-1]))
+        yield '{}_count{} {}'.format(name, _format_labels(labels), cumulative)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                          for k, v in labels) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+registry = MetricsRegistry()
+
+
+@contextmanager
+def timed(phase):
+    """Times a block, or a function when used as a decorator, as an internal phase."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe(PHASE_DURATION, (('phase', phase),), time.perf_counter() - start)
+
+
+def request_started(endpoint):
+    registry.inc(IN_FLIGHT, (('endpoint', endpoint),))
+    return time.perf_counter()
+
+
+def request_finished(endpoint, status, start):
+    labels = (('endpoint', endpoint),)
+    registry.inc(IN_FLIGHT, labels, -1)
+    registry.inc(RESPONSES, labels + (('status', str(status)),))
+    registry.observe(REQUEST_DURATION, labels, time.perf_counter() - start)
+
+
+@event.listens_for(Session, 'before_commit')
+def _commit_started(session):
+    session.info['metrics_commit_start'] = time.perf_counter()
+
+
+@event.listens_for(Session, 'after_commit')
+def _commit_finished(session):
+    start = session.info.pop('metrics_commit_start', None)
+    if start is not None:
+        registry.observe(PHASE_DURATION, (('phase', 'db_commit'),), time.perf_counter() - start)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _commit_failed(session):
+    session.info.pop('metrics_commit_start', None)
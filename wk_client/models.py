@@ -11,6 +11,10 @@ class User(db.Model):
     username = db.Column(db.String(80), unique=True, nullable=False)
     hashed_password = db.Column(db.String(80))
     account = db.Column(db.String(80), unique=True, nullable=False)
+    # Set on every ORM or Core write, bank.UserMap picks up changed accounts by it.
+    updated = db.Column(db.DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow, index=True)
+    # When the user last wrote, with a read engine set. Their reads use the primary for READ_YOUR_WRITES_SECONDS.
+    last_write = db.Column(db.DateTime)
 
     decisions = db.relationship('Decision', backref='user', lazy=True)
     loans = db.relationship('Loan', backref='user', lazy=True)
@@ -72,6 +76,8 @@ class Loan(db.Model):
 
     repayment_frequency_days = db.Column(db.Integer, nullable=False)
     repayment_amount = db.Column(db.Integer, nullable=False)
+    # The repayment schedule given to the borrower at funding, as JSON keyed by ISO date.
+    repayment_schedule = db.Column(db.Text)
 
     def __repr__(self):
         return '<Loan {}-{}: {}>'.format(self.user_id, self.id, self.opening_balance)
@@ -87,3 +93,40 @@ class CashFlow(db.Model):
 
     def __repr__(self):
         return 'CashFlow {}-{}: ({}, {}, {})'.format(self.user_id, self.id, self.datetime, self.amount, self.type)
+
+
+class IdempotencyKey(db.Model):
+    """
+    Response recorded for an Idempotency-Key, status_code is null while the request is in flight.
+    """
+    __table_args__ = (db.UniqueConstraint('user_id', 'key'),)
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey(User.id), nullable=False)
+    key = db.Column(db.String(80), nullable=False)
+    request_hash = db.Column(db.String(64), nullable=False)
+    created = db.Column(db.DateTime, nullable=False)
+
+    status_code = db.Column(db.Integer)
+    response = db.Column(db.Text)
+    side_effects = db.Column(db.Boolean, nullable=False, default=False)  # The request may have changed things.
+
+    def __repr__(self):
+        return '<IdempotencyKey {}-{}: {}>'.format(self.user_id, self.key, self.status_code)
+
+
+class BorrowerSummary(db.Model):
+    """
+    What a borrower owes, one row per user, kept up to date by the writes to their ledger.
+    Values are as of the as_of date, the date of the latest write.
+    """
+    user_id = db.Column(db.Integer, db.ForeignKey(User.id), primary_key=True)
+    as_of = db.Column(db.Date, nullable=False)
+
+    balance = db.Column(db.Float, nullable=False)
+    active_loan_id = db.Column(db.Integer, db.ForeignKey(Loan.id))
+    next_due_date = db.Column(db.Date)
+    next_due_amount = db.Column(db.Float)
+    arrears = db.Column(db.Float, nullable=False)
+
+    def __repr__(self):
+        return '<BorrowerSummary {}: {} as of {}>'.format(self.user_id, self.balance, self.as_of)
@@ -0,0 +1,87 @@
+"""Opt-in request profiling.
+
+A request is profiled with cProfile when it carries the admin header with PROFILE_TOKEN, or when it
+is picked by PROFILE_SAMPLE_RATE. The top of the profile is written to PROFILE_DIR together with
+the route, user and timing, and only the latest PROFILE_KEEP profiles are kept.
+
+When neither is configured no hooks are registered, so there is no overhead at all.
+"""
+import cProfile
+import datetime
+import io
+import os
+import pstats
+import random
+import time
+
+from flask import current_app, g, request
+
+from wk_client import auth
+
+
+def init_app(app):
+    if not (app.config.get('PROFILE_TOKEN') or app.config.get('PROFILE_SAMPLE_RATE')):
+        return
+    app.before_request(start_profile)
+    app.after_request(finish_profile)
+    app.teardown_request(abandon_profile)
+
+
+def _wants_profile():
+    token = current_app.config.get('PROFILE_TOKEN')
+    if token and request.headers.get(current_app.config['PROFILE_HEADER']) == token:
+        return True
+    return random.random() < current_app.config.get('PROFILE_SAMPLE_RATE', 0)
+
+
+def start_profile():
+    if _wants_profile():
+        g.profile_start = time.perf_counter()
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+
+def finish_profile(response):
+    if 'profiler' in g:
+        _dump_profile(g.pop('profiler'), g.pop('profile_start'), response.status_code)
+    return response
+
+
+def abandon_profile(exc):
+    # after_request is skipped when the view raised an unhandled exception.
+    if 'profiler' in g:
+        _dump_profile(g.pop('profiler'), g.pop('profile_start'), 500)
+
+
+def _dump_profile(profiler, start, status):
+    profiler.disable()
+    duration = time.perf_counter() - start
+    config = current_app.config
+
+    directory = config['PROFILE_DIR']
+    os.makedirs(directory, exist_ok=True)
+    name = '{}-{}'.format(datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%S%f'), request.endpoint)
+
+    out = io.StringIO()
+    out.write('route: {} {} ({})\n'.format(request.method, request.path, request.endpoint))
+    out.write('user: {}\n'.format(auth.username() or '-'))
+    out.write('status: {}\n'.format(status))
+    out.write('duration_ms: {:.3f}\n\n'.format(duration * 1000))
+    stats = pstats.Stats(profiler, stream=out)
+    stats.sort_stats('cumulative').print_stats(config['PROFILE_TOP'])
+    stats.print_callers(config['PROFILE_TOP'])
+
+    with open(os.path.join(directory, name + '.txt'), 'w') as f:
+        f.write(out.getvalue())
+    profiler.dump_stats(os.path.join(directory, name + '.prof'))
+    _rotate(directory, config['PROFILE_KEEP'])
+
+
+def _rotate(directory, keep):
+    names = sorted({os.path.splitext(f)[0] for f in os.listdir(directory) if f.endswith(('.txt', '.prof'))})
+    for name in names[:-keep]:
+        for ext in ('.txt', '.prof'):
+            try:
+                os.remove(os.path.join(directory, name + ext))
+            except FileNotFoundError:
+                pass
@@ -1,12 +1,15 @@
 import pandas as pd
 from xgboost import XGBClassifier
+from functools import lru_cache
 import os
 
+RETRO_DATA_FILENAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'retro_data.csv')
+
 
 class XGB_classifier:
     
     def __init__(self):
-        retro_data = pd.read_csv(os.path.abspath('wk_client/retro_data.csv'))
+        retro_data = pd.read_csv(RETRO_DATA_FILENAME)
 
         y = retro_data['outcome']
 
@@ -17,7 +20,15 @@ class XGB_classifier:
                                 objective='binary:logistic', nthread=4, scale_pos_weight=1)
 
         self.xgboost.fit(X, y)
+        self.columns = list(X.columns)
 
     def _predict(self, customer_data):
-        return self.xgboost.predict(customer_data)
-    
\ No newline at end of file
+        """Predicts the outcome of one application, given as a dict of the training columns."""
+        features = pd.DataFrame([customer_data], columns=self.columns, dtype=float)
+        return bool(self.xgboost.predict(features)[0])
+
+
+@lru_cache(maxsize=None)
+def get_classifier():
+    """The trained classifier, trained once per process (or once in the master, see serve.py)."""
+    return XGB_classifier()
@@ -1,11 +1,11 @@
 import json
-import logging
 
-from flask import Blueprint, request, g
+from flask import Blueprint, Response, current_app, request, g
 from werkzeug.exceptions import BadRequest
 
-from wk_client import auth, endpoints
-from wk_client.auth_utils import create_user
+from wk_client import admission, auth, endpoints, idempotency, metrics
+from wk_client.auth_utils import create_user, create_users, current_user, valid_credentials
+from wk_client.db_utils import user_lock
 from wk_client.logic import UserAccount
 from wk_client.request_utils import time_now
 from wk_client.settings import BANK_ACCOUNT
@@ -13,7 +13,29 @@ from wk_client.utils import get_date
 
 bp = Blueprint('routes', __name__)
 
-logging.basicConfig(level=logging.DEBUG, filename='app.log', filemode='w', format='%(name)s - %(levelname)s - %(message)s')
+
+@bp.before_request
+def start_request_metrics():
+    g.metrics_start = metrics.request_started(request.endpoint)
+
+
+@bp.after_request
+def record_request_metrics(response):
+    metrics.request_finished(request.endpoint, response.status_code, g.pop('metrics_start'))
+    return response
+
+
+@bp.teardown_request
+def record_failed_request_metrics(exc):
+    # after_request is skipped when the view raised an unhandled exception.
+    if 'metrics_start' in g:
+        metrics.request_finished(request.endpoint, 500, g.pop('metrics_start'))
+
+
+@bp.route('/metrics', methods=('GET',))
+def get_metrics():
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
 
 @bp.route('/')
 @bp.route('/index')
@@ -23,7 +45,13 @@ def index():
 
 @bp.route('/get_info', methods=('GET',))
 def get_info():
-    return json.dumps(endpoints.get_product_data())
+    """Serves the product data serialized at startup. Needs no auth or database."""
+    product_info = current_app.extensions['product_info']
+    response = Response(product_info.body)
+    response.set_etag(product_info.etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config['PRODUCT_INFO_MAX_AGE']
+    return response.make_conditional(request)
 
 
 @bp.route('/register', methods=('POST',))
@@ -40,6 +68,26 @@ def register():
         return json.dumps(user.username)
 
 
+@bp.route('/register_batch', methods=('POST',))
+def register_batch():
+    data = request.get_json()
+    if not isinstance(data, list) or len(data) > current_app.config['REGISTER_BATCH_MAX']:
+        raise BadRequest()
+    valid = [isinstance(row, dict) and all(k in row for k in ('username', 'password', 'bank_account'))
+             and valid_credentials(row['username'], row['password'], row['bank_account'])
+             for row in data]
+    ids = iter(create_users(
+        (row['username'], row['password'], row['bank_account']) for row, ok in zip(data, valid) if ok))
+    results = []
+    for row, ok in zip(data, valid):
+        if not ok:
+            username = row.get('username') if isinstance(row, dict) else None
+            results.append({'username': username if isinstance(username, str) else None, 'status': 'invalid'})
+        else:
+            results.append({'username': row['username'], 'status': 'created' if next(ids) else 'conflict'})
+    return json.dumps(results)
+
+
 @bp.route('/test_login', methods=('GET', 'POST'))
 @auth.login_required
 def test_login():
@@ -48,18 +96,20 @@ def test_login():
 
 @bp.route('/get_decision', methods=('GET', 'POST'))
 @auth.login_required
+@admission.limited('scoring')
 def get_decision():
-    logging.warning("Getting decision for ~ ")
-    logging.warning(request.get_json())
+    current_app.logger.info('Getting decision for %s', auth.username(), extra={'payload': request.get_json(silent=True)})
     if request.method == 'GET':
-        return json.dumps(endpoints.get_decision(g.user, None))
+        return json.dumps(endpoints.get_decision(current_user(), None))
     elif request.method == 'POST':
         data = request.get_json()
-        return json.dumps(endpoints.get_decision(g.user, data))
+        return json.dumps(endpoints.get_decision(current_user(), data))
 
 
 @bp.route('/request_funding', methods=('POST',))
 @auth.login_required
+@idempotency.idempotent
+@admission.limited('funding')
 def request_funding():
     """
     Request funding - Check that approval in question is still the active one. Balance is 0? (flexibiltiy?
@@ -70,31 +120,45 @@ def request_funding():
     amount = data['amount']
     approval_id = data['approval_reference']
     dt = time_now()
-    user_account = UserAccount(g.user.id)
-    funding, error = endpoints.request_funding(
-        user_account,
-        approval_id=approval_id,
-        amount=amount,
-        dt=dt
-    )
+    # The user lock is held for the database work only, not while the bank sends the cash.
+    with user_lock(g.user_id):
+        reservation, error = endpoints.reserve_funding(
+            UserAccount(g.user_id),
+            approval_id=approval_id,
+            amount=amount,
+            dt=dt
+        )
+        if reservation:
+            idempotency.side_effects_started()
+    if error:
+        raise BadRequest(error)
+
+    sent, error = endpoints.send_funding(UserAccount(g.user_id), reservation)
     if error:
+        idempotency.side_effects_undone()
         raise BadRequest(error)
-    else:
-        schedule = {
-            k.isoformat(): v for k, v in user_account.repayment_schedule_for_loan(funding).items()
-        }
 
-        return json.dumps({
-            'funding_reference': funding.id,
-            'repayment_account': BANK_ACCOUNT,
-            'repayment_schedule': schedule
-        })
+    try:
+        # The bank's confirmation, fee, loan, schedule and the recorded response commit together, so
+        # a retry can't miss the response and fund again.
+        with user_lock(g.user_id):
+            loan, schedule = endpoints.book_funding(UserAccount(g.user_id), reservation, sent)
+            response = json.dumps({
+                'funding_reference': loan.id,
+                'repayment_account': BANK_ACCOUNT,
+                'repayment_schedule': schedule
+            })
+            idempotency.save_response(response)
+    except Exception:
+        endpoints.record_sent_funding(g.user_id, reservation, sent)
+        raise
+    return response
 
 
 @bp.route('/get_schedule', methods=('GET',))
 @auth.login_required
 def get_schedule():
-    user_account = UserAccount(g.user.id)
+    user_account = UserAccount(g.user_id)
     as_of = get_date(time_now())
     balance = user_account.balance(as_of)
     schedule = user_account.repayment_schedule_for_date(as_of)
@@ -0,0 +1,152 @@
+"""Seeds the database with a synthetic portfolio, for measuring performance at realistic volumes.
+
+Rows are generated per batch of users and written with bulk Core inserts. The portfolio only
+depends on the seed, so runs against an empty database are reproducible.
+"""
+import datetime
+import random
+from functools import lru_cache
+
+from wk_client import db, models
+from wk_client.auth_utils import hash_pw
+from wk_client.constants import APPROVED_STATE_NAME, DECLINED_STATE_NAME, FUNDING_TYPE, REPAYMENT_TYPE
+from wk_client.utils import get_repayment_amount
+
+SEED_PASSWORD = 'password'
+SEED_AS_OF = datetime.datetime(2019, 2, 23)
+SEED_HISTORY_DAYS = 720
+BATCH_SIZE = 1000
+
+APPROVAL_RATE = 0.7
+TAKE_UP_RATE = 0.8
+ON_TIME_RATE = 0.85
+MISSED_RATE = 0.05
+AMOUNTS = [1000, 2000, 3000, 5000, 10000, 15000, 25000]
+INTEREST_DAILY = 0.0005
+DURATION_DAYS = 360
+REPAYMENT_FREQUENCY_DAYS = 30
+
+
+@lru_cache()
+def _unit_repayment(duration_days, repayment_frequency_days, interest_daily):
+    """Repayment amount per unit of opening balance. The schedule is linear in the balance."""
+    repayment, _ = get_repayment_amount(1., duration_days, repayment_frequency_days, interest_daily)
+    return repayment
+
+
+class PortfolioSeeder(object):
+    """Generates users with decision, loan and cashflow histories.
+
+    Each user gets one to three decisions. An approval is taken up as a loan with its funding
+    cashflow, followed by repayments every repayment period up to as_of. Most repayments are
+    on time, some are partial and some are missed.
+    """
+    def __init__(self, seed=0, as_of=SEED_AS_OF, history_days=SEED_HISTORY_DAYS):
+        self.rng = random.Random(seed)
+        self.as_of = as_of
+        self.history_days = history_days
+        self.next_ids = {}
+        self.rows = {}
+
+    def _ref(self):
+        return '%032x' % self.rng.getrandbits(128)
+
+    def _add(self, model, **values):
+        table = model.__table__
+        row = dict.fromkeys(table.c.keys())  # executemany needs the same keys in every row.
+        row.update(values)
+        row['id'] = self.next_ids[table.name]
+        self.next_ids[table.name] += 1
+        self.rows[table.name].append(row)
+        return row['id']
+
+    def _user(self):
+        username = 'seed_user{}'.format(self.next_ids['user'])
+        uid = self._add(models.User, username=username, hashed_password=hash_pw(SEED_PASSWORD, username),
+                        account=self._ref(), updated=datetime.datetime.utcnow())
+
+        dt = self.as_of - datetime.timedelta(seconds=self.rng.randrange(self.history_days * 86400))
+        for _ in range(self.rng.randint(1, 3)):
+            if self.rng.random() < APPROVAL_RATE:
+                amount = float(self.rng.choice(AMOUNTS))
+                self._add(models.Decision, user_id=uid, decision=APPROVED_STATE_NAME, datetime=dt,
+                          interest_daily=INTEREST_DAILY, amount=amount, duration_days=DURATION_DAYS,
+                          repayment_frequency_days=REPAYMENT_FREQUENCY_DAYS, fee_rate=0, fee_amount=0)
+                if self.rng.random() < TAKE_UP_RATE:
+                    self._loan(uid, dt + datetime.timedelta(minutes=self.rng.randint(1, 600)), amount)
+                    return
+            else:
+                self._add(models.Decision, user_id=uid, decision=DECLINED_STATE_NAME, datetime=dt)
+            dt += datetime.timedelta(days=self.rng.randint(1, 30))
+            if dt > self.as_of:
+                return
+
+    def _loan(self, uid, start, amount):
+        if start > self.as_of:
+            return
+        repayment_amount = round(
+            amount * _unit_repayment(DURATION_DAYS, REPAYMENT_FREQUENCY_DAYS, INTEREST_DAILY) + 0.005, 2)
+        self._add(models.Loan, user_id=uid, start_datetime=start, opening_balance=amount,
+                  duration_days=DURATION_DAYS, interest_daily=INTEREST_DAILY,
+                  repayment_frequency_days=REPAYMENT_FREQUENCY_DAYS, repayment_amount=repayment_amount)
+        self._add(models.CashFlow, user_id=uid, datetime=start, amount=-amount, type=FUNDING_TYPE,
+                  bank_ref=self._ref())
+
+        for period in range(1, DURATION_DAYS // REPAYMENT_FREQUENCY_DAYS + 1):
+            due = start + datetime.timedelta(days=period * REPAYMENT_FREQUENCY_DAYS)
+            paid_at = due + datetime.timedelta(minutes=self.rng.randint(-2880, 720))
+            if paid_at > self.as_of:
+                return
+            behaviour = self.rng.random()
+            if behaviour < MISSED_RATE:
+                continue
+            if behaviour < ON_TIME_RATE + MISSED_RATE:
+                paid = repayment_amount
+            else:
+                paid = round(repayment_amount * self.rng.uniform(0.2, 0.9), 2)
+            self._add(models.CashFlow, user_id=uid, datetime=paid_at, amount=paid, type=REPAYMENT_TYPE,
+                      bank_ref=self._ref())
+
+    def _start_ids(self, tables):
+        for table in tables:
+            max_id = db.session.query(db.func.max(table.c.id)).scalar()
+            self.next_ids[table.name] = (max_id or 0) + 1
+            self.rows[table.name] = []
+
+    def _flush(self, tables):
+        for table in tables:
+            if self.rows[table.name]:
+                db.session.execute(table.insert(), self.rows[table.name])
+            self.rows[table.name] = []
+
+    def _sync_sequences(self, tables):
+        """Explicit ids bypass Postgres sequences, move them past the inserted rows."""
+        if db.engine.dialect.name != 'postgresql':
+            return
+        for table in tables:
+            db.session.execute(
+                "SELECT setval(pg_get_serial_sequence('\"{0}\"', 'id'), (SELECT max(id) FROM \"{0}\"))".format(
+                    table.name))
+
+    def seed(self, n_users, batch_size=BATCH_SIZE):
+        """Inserts n_users users with their histories and commits.
+
+        Returns:
+            dict: Number of rows inserted per table.
+        """
+        tables = [m.__table__ for m in (models.User, models.Decision, models.Loan, models.CashFlow)]
+        self._start_ids(tables)
+        first_ids = dict(self.next_ids)
+
+        for start in range(0, n_users, batch_size):
+            for _ in range(start, min(start + batch_size, n_users)):
+                self._user()
+            self._flush(tables)
+
+        self._sync_sequences(tables)
+        db.session.commit()
+        return {name: self.next_ids[name] - first_ids[name] for name in first_ids}
+
+
+def seed_portfolio(n_users, seed=0, as_of=SEED_AS_OF):
+    return PortfolioSeeder(seed=seed, as_of=as_of).seed(n_users)
@@ -0,0 +1,104 @@
+"""Production server entry point.
+
+Runs gunicorn with the app preloaded in the master process: the app, the product data and the
+trained risk model are built once, then N workers are forked and share those pages copy-on-write.
+Cold start is paid once per deployment, not on the first request of every worker.
+
+    python -m wk_client.serve --workers 4 --threads 8 --bind 0.0.0.0:5000 --certfile cert.pem --keyfile key.pem
+
+Workers are threaded (gthread) by default. The admission limits and per-user rate limits are kept
+in each worker: a single-threaded worker never has a second request to queue, and with N workers
+the limits of the whole server are N times those in the config.
+
+Send HUP to the master for a graceful restart of the workers (they finish in-flight requests first).
+As the app is preloaded, new code needs a new master: USR2 starts one next to the old, then
+QUIT the old master once the new workers are up.
+"""
+import argparse
+import gc
+import multiprocessing
+import os
+
+from gunicorn.app.base import BaseApplication
+
+from wk_client import create_app, db
+from wk_client.log_utils import configure_logging
+
+DEFAULT_THREADS = 8  # Per worker. Admission control only has requests to hold back in threaded workers.
+
+
+def warm_up(app):
+    """Builds everything the workers should inherit instead of building it on their first request."""
+    from wk_client import risk_model
+    with app.app_context():
+        risk_model.get_classifier()
+        # Connections must not be shared with the workers, they open their own after the fork.
+        db.engine.dispose()
+    # Keep the preloaded objects out of the collector, so it doesn't touch (and copy) their pages.
+    if hasattr(gc, 'freeze'):
+        gc.collect()
+        gc.freeze()
+
+
+def post_fork(app):
+    def hook(server, worker):
+        # Threads don't survive the fork, restart the log listener in the worker.
+        configure_logging(app.config, app.name)
+        with app.app_context():
+            db.engine.dispose()
+    return hook
+
+
+class Server(BaseApplication):
+    def __init__(self, app, options):
+        self.application = app
+        self.options = options
+        super(Server, self).__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        return self.application
+
+
+def default_workers():
+    return int(os.environ.get('WEB_CONCURRENCY') or multiprocessing.cpu_count() * 2 + 1)
+
+
+def serve(bind='127.0.0.1:5000', workers=None, threads=DEFAULT_THREADS, timeout=30, graceful_timeout=30,
+          certfile=None, keyfile=None):
+    app = create_app()
+    warm_up(app)
+    options = {
+        'bind': bind,
+        'workers': workers or default_workers(),
+        'threads': threads,
+        'worker_class': 'gthread' if threads > 1 else 'sync',
+        'preload_app': True,
+        'timeout': timeout,
+        'graceful_timeout': graceful_timeout,
+        'post_fork': post_fork(app),
+    }
+    if certfile:
+        options.update(certfile=certfile, keyfile=keyfile)
+    Server(app, options).run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the production server.')
+    parser.add_argument('--bind', default=os.environ.get('BIND', '127.0.0.1:5000'))
+    parser.add_argument('--workers', type=int, default=None, help='Default: WEB_CONCURRENCY or 2 * CPUs + 1.')
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('THREADS', DEFAULT_THREADS)),
+                        help='Threads per worker.')
+    parser.add_argument('--timeout', type=int, default=30)
+    parser.add_argument('--graceful-timeout', type=int, default=30)
+    parser.add_argument('--certfile')
+    parser.add_argument('--keyfile')
+    args = parser.parse_args()
+    serve(args.bind, args.workers, args.threads, args.timeout, args.graceful_timeout, args.certfile, args.keyfile)
+
+
+if __name__ == '__main__':
+    main()
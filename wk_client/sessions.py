@@ -0,0 +1,133 @@
+"""Routes the reads of read-only endpoints to a read engine, e.g. a replica.
+
+With SQLALCHEMY_READ_DATABASE_URI set, plain SELECTs of requests to DB_READ_ENDPOINTS use the read
+engine. Writes, locking reads and everything after a write in the same request use the primary.
+A user who wrote (e.g. funded) reads from the primary for READ_YOUR_WRITES_SECONDS, so replica lag
+doesn't hide their own changes. The time of the write is stored in users.last_write with the
+write itself, so every worker sees it: a read-only request first looks it up on the primary,
+unless this process already knows the user wrote recently.
+"""
+import datetime
+from contextlib import contextmanager
+
+import sqlalchemy
+from flask import current_app, g, has_app_context, request
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import Select
+
+from wk_client.utils import TTLCache
+
+RECENT_WRITERS_SIZE = 100000
+WRITERS = 'read_your_writes_writers'
+
+# user id -> True, for users who wrote in the last READ_YOUR_WRITES_SECONDS, as far as this process knows.
+recent_writers = TTLCache(RECENT_WRITERS_SIZE, 10)
+
+
+class RoutingSession(SignallingSession):
+    def get_bind(self, mapper=None, clause=None):
+        if not has_app_context():
+            return super(RoutingSession, self).get_bind(mapper, clause)
+        if self._flushing or not isinstance(clause, Select) or clause._for_update_arg is not None:
+            if self._flushing or isinstance(clause, sqlalchemy.sql.expression.UpdateBase):
+                _wrote(self)
+            return super(RoutingSession, self).get_bind(mapper, clause)
+        if g.get('db_read_only') and not _wrote_recently(super(RoutingSession, self).get_bind(mapper, clause)):
+            return self.app.extensions['db_read_engine']
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+def _wrote(session):
+    g.pop('db_read_only', None)
+    if 'user_id' in g:
+        mark_written(g.user_id)
+        if 'db_read_engine' in current_app.extensions:
+            session.info.setdefault(WRITERS, set()).add(g.user_id)
+
+
+def _wrote_recently(primary_engine):
+    """Whether the request's user wrote in the last READ_YOUR_WRITES_SECONDS, in any process."""
+    user_id = g.get('user_id')
+    if user_id is None or recent_writers.get(user_id):
+        return user_id is not None
+    if 'db_wrote_recently' not in g:
+        from wk_client.models import User
+        users = User.__table__
+        last_write = primary_engine.execute(
+            sqlalchemy.select([users.c.last_write]).where(users.c.id == user_id)).scalar()
+        remaining = 0
+        if last_write is not None:
+            window = datetime.timedelta(seconds=current_app.config['READ_YOUR_WRITES_SECONDS'])
+            remaining = (last_write + window - datetime.datetime.utcnow()).total_seconds()
+        if remaining > 0:
+            recent_writers.set(user_id, True, ttl=remaining)
+        g.db_wrote_recently = remaining > 0
+    return g.db_wrote_recently
+
+
+@event.listens_for(Session, 'before_commit')
+def _store_last_write(session):
+    if not has_app_context() or 'db_read_engine' not in current_app.extensions:
+        return
+    if not session.info.get(WRITERS) and not (session.new or session.dirty or session.deleted):
+        return
+    # Commit only flushes after this hook, flush first so those writes are counted too.
+    session.flush()
+    writers = session.info.pop(WRITERS, None)
+    if not writers:
+        return
+    from wk_client.models import User
+    users = User.__table__
+    # Keeping updated leaves the user out of bank.UserMap's next refresh.
+    session.execute(users.update().where(users.c.id.in_(writers)).values(
+        last_write=datetime.datetime.utcnow(), updated=users.c.updated))
+    session.info.pop(WRITERS, None)  # The update above counts as a write of theirs too.
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_writers(session):
+    session.info.pop(WRITERS, None)
+
+
+def mark_written(user_id):
+    """The user's next reads in this process go to the primary for READ_YOUR_WRITES_SECONDS.
+
+    Other processes go by users.last_write, written with the user's writes.
+    """
+    recent_writers.set(user_id, True, ttl=current_app.config['READ_YOUR_WRITES_SECONDS'])
+
+
+def init_app(app):
+    uri = app.config.get('SQLALCHEMY_READ_DATABASE_URI')
+    if not uri:
+        return
+    from wk_client.db_utils import set_sqlite_pragmas
+    engine = sqlalchemy.create_engine(uri, **({} if uri.startswith('sqlite') else app.config['DB_POOL_OPTIONS']))
+    # query_only makes accidental writes through the read engine fail.
+    set_sqlite_pragmas(engine, dict(app.config.get('SQLITE_PRAGMAS') or {}, query_only=1))
+    app.extensions['db_read_engine'] = engine
+    app.before_request(_route_reads)
+    app.teardown_request(_end_read_only)
+
+
+def _route_reads():
+    if request.endpoint in current_app.config['DB_READ_ENDPOINTS']:
+        g.db_read_only = True
+
+
+def _end_read_only(exc):
+    g.pop('db_read_only', None)
+    g.pop('db_wrote_recently', None)
+
+
+@contextmanager
+def primary():
+    """Reads in the block use the primary, e.g. where a stale or missing row would be cached."""
+    read_only = g.pop('db_read_only', None) if has_app_context() else None
+    try:
+        yield
+    finally:
+        if read_only:
+            g.db_read_only = read_only
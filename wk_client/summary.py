@@ -0,0 +1,117 @@
+"""Maintains the borrower_summary table.
+
+Writes to a user's ledger mark the user in the session. Just before the session commits, the
+summary of every marked user is recomputed and written in the same transaction, once per
+commit however many cashflows were added. rebuild() recomputes all of them, for backfills.
+
+Arrears and the next due date move with time, not only with writes: refresh() brings the
+summaries of borrowers who still owe something up to date, run it daily (refresh-borrower-summary).
+"""
+from sqlalchemy import and_, bindparam, event
+from sqlalchemy.orm import Session, selectinload
+
+from wk_client import db, models
+from wk_client.utils import get_date
+
+DIRTY = 'borrower_summary_dirty'
+REBUILD_BATCH_SIZE = 1000
+
+
+def mark_dirty(user_id, dt, account=None, session=None):
+    """The user's summary is recomputed as of dt's date on commit. Pass the UserAccount if loaded."""
+    session = session or db.session()
+    dirty = session.info.setdefault(DIRTY, {})
+    as_of = get_date(dt)
+    previous = dirty.get(user_id)
+    if previous is not None:
+        as_of = max(as_of, previous[0])
+        account = account or previous[1]
+    dirty[user_id] = (as_of, account)
+
+
+@event.listens_for(Session, 'before_commit')
+def _update_summaries(session):
+    from wk_client.logic import UserAccount
+    # Writing the summaries can autoflush, take the marks first.
+    dirty = session.info.pop(DIRTY, None)
+    if not dirty:
+        return
+    # Load the missing ledgers and the current rows in batches, merge then finds them in the session.
+    # The session only holds weak references, keep these until the summaries are written.
+    loaded = _load_ledgers(session, [user_id for user_id, (_, account) in dirty.items() if account is None])
+    for batch in _batches(list(dirty)):
+        loaded += session.query(models.BorrowerSummary).filter(models.BorrowerSummary.user_id.in_(batch)).all()
+    for user_id, (as_of, account) in dirty.items():
+        summary = (account or UserAccount(user_id)).summary(as_of)
+        session.merge(models.BorrowerSummary(user_id=user_id, **summary))
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_dirty(session):
+    session.info.pop(DIRTY, None)
+
+
+def rebuild(as_of, batch_size=REBUILD_BATCH_SIZE):
+    """Recomputes every user's summary as of the given date, in one transaction.
+
+    Returns:
+        int: Number of summaries written.
+    """
+    from wk_client.logic import UserAccount
+    session = db.session()
+    session.query(models.BorrowerSummary).delete()
+    ids = [user_id for user_id, in session.query(models.User.id).order_by(models.User.id)]
+    for batch in _batches(ids, batch_size):
+        loaded = _load_ledgers(session, batch)  # noqa: F841, keeps the users in the session.
+        rows = [dict(UserAccount(user_id).summary(as_of), user_id=user_id) for user_id in batch]
+        session.bulk_insert_mappings(models.BorrowerSummary, rows)
+        session.expunge_all()
+    session.commit()
+    return len(ids)
+
+
+def refresh(as_of, batch_size=REBUILD_BATCH_SIZE):
+    """Recomputes as of the given date the summaries that are older and still have a balance.
+
+    Each batch is committed on its own. A summary written by a ledger write in the meantime (as of
+    that date or later) is left alone.
+
+    Returns:
+        int: Number of summaries recomputed.
+    """
+    from wk_client.logic import UserAccount
+    session = db.session()
+    summary = models.BorrowerSummary
+    ids = [user_id for user_id, in session.query(summary.user_id).filter(
+        summary.as_of < as_of, summary.balance > 0.01).order_by(summary.user_id)]
+    table = summary.__table__
+    columns = [c.name for c in table.columns if c.name != 'user_id']
+    update = table.update().where(and_(
+        table.c.user_id == bindparam('_user_id'), table.c.as_of < bindparam('_as_of'),
+    )).values({name: bindparam(name) for name in columns})
+    for batch in _batches(ids, batch_size):
+        loaded = _load_ledgers(session, batch)  # noqa: F841, keeps the users in the session.
+        rows = [dict(UserAccount(user_id).summary(as_of), _user_id=user_id, _as_of=as_of) for user_id in batch]
+        session.execute(update, rows)
+        session.commit()
+        session.expunge_all()
+    return len(ids)
+
+
+def _load_ledgers(session, user_ids):
+    """Loads the users with their ledgers, UserAccount then finds them in the session while they are referenced.
+
+    Returns:
+        list: The users.
+    """
+    users = []
+    for batch in _batches(user_ids):
+        users += session.query(models.User).filter(models.User.id.in_(batch)).options(
+            selectinload(models.User.loans), selectinload(models.User.cashflows), selectinload(models.User.decisions)
+        ).all()
+    return users
+
+
+def _batches(values, size=REBUILD_BATCH_SIZE):
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
@@ -0,0 +1,88 @@
+import threading
+import time
+import unittest
+
+from wk_client import create_app
+from wk_client.admission import ConcurrencyLimiter, TokenBuckets
+from wk_client.auth_utils import create_user
+from wk_client.config import TestConfig
+from wk_client.tests.conftest import AppTestCase, open_with_auth
+
+
+class TestConcurrencyLimiter(unittest.TestCase):
+    def test_limit(self):
+        limiter = ConcurrencyLimiter(2, 0, 0)
+        self.assertTrue(limiter.acquire())
+        self.assertTrue(limiter.acquire())
+        self.assertFalse(limiter.acquire())
+        limiter.release()
+        self.assertTrue(limiter.acquire())
+
+    def test_waits_for_slot(self):
+        limiter = ConcurrencyLimiter(1, 1, 5)
+        limiter.acquire()
+        threading.Timer(0.05, limiter.release).start()
+        self.assertTrue(limiter.acquire())
+
+    def test_wait_times_out(self):
+        limiter = ConcurrencyLimiter(1, 1, 0.05)
+        limiter.acquire()
+        self.assertFalse(limiter.acquire())
+        self.assertEqual(limiter.waiting, 0)
+
+    def test_full_queue_rejects_immediately(self):
+        limiter = ConcurrencyLimiter(1, 0, 5)
+        limiter.acquire()
+        start = time.monotonic()
+        self.assertFalse(limiter.acquire())
+        self.assertLess(time.monotonic() - start, 1)
+
+
+class TestTokenBuckets(unittest.TestCase):
+    def test_burst(self):
+        buckets = TokenBuckets(rate=1, burst=2)
+        self.assertEqual(buckets.take('foo'), 0)
+        self.assertEqual(buckets.take('foo'), 0)
+        self.assertGreater(buckets.take('foo'), 0)
+        self.assertEqual(buckets.take('bar'), 0)
+
+    def test_refill(self):
+        buckets = TokenBuckets(rate=100, burst=1)
+        buckets.take('foo')
+        time.sleep(0.02)
+        self.assertEqual(buckets.take('foo'), 0)
+
+    def test_bounded(self):
+        buckets = TokenBuckets(rate=1, burst=1, max_keys=2)
+        for key in range(3):
+            buckets.take(key)
+        self.assertEqual(len(buckets._buckets), 2)
+
+
+class TestAdmissionRoutes(AppTestCase):
+    def make_client(self, **config):
+        limited_config = type('LimitedConfig', (TestConfig,), config)
+        app = create_app(limited_config)
+        return app.test_client()
+
+    def setUp(self):
+        super(TestAdmissionRoutes, self).setUp()
+        create_user('foo', 'bar', 'baz')
+
+    def test_user_rate_limit(self):
+        client = self.make_client(USER_RATE=0.001, USER_BURST=1)
+        rv = open_with_auth(client, '/get_decision', 'get', b'foo', b'bar')
+        assert rv.status_code != 429
+        rv = open_with_auth(client, '/get_decision', 'get', b'foo', b'bar')
+        assert rv.status_code == 429
+        assert int(rv.headers['Retry-After']) > 0
+
+    def test_overloaded(self):
+        client = self.make_client(ADMISSION_LIMITS={'scoring': (0, 0, 0)}, ADMISSION_RETRY_AFTER=3)
+        rv = open_with_auth(client, '/get_decision', 'get', b'foo', b'bar')
+        assert rv.status_code == 503
+        assert rv.headers['Retry-After'] == '3'
+
+    def test_cheap_routes_not_limited(self):
+        client = self.make_client(ADMISSION_LIMITS={'scoring': (0, 0, 0)}, USER_RATE=0.001, USER_BURST=0)
+        assert client.get('/get_info').status_code == 200
@@ -0,0 +1,122 @@
+import asyncio
+import json
+import threading
+from datetime import datetime
+from unittest import mock
+
+from wk_client import metrics
+from wk_client.asgi import AsgiApp
+from wk_client.auth_utils import create_user
+from wk_client.tests.conftest import AppTestCase, encode_username_password
+
+
+class TestAsgiApp(AppTestCase):
+    def setUp(self):
+        super(TestAsgiApp, self).setUp()
+        self.asgi_app = AsgiApp(self.app, max_workers=2)
+
+    def tearDown(self):
+        self.asgi_app.executor.shutdown()
+        super(TestAsgiApp, self).tearDown()
+
+    def request(self, method, path, body=b'', headers=()):
+        sent = asyncio.run(self.call(method, path, body, headers))
+        return sent[0]['status'], dict(sent[0]['headers']), b''.join(m.get('body', b'') for m in sent[1:])
+
+    async def call(self, method, path, body=b'', headers=()):
+        messages = [{'type': 'http.request', 'body': body[:5], 'more_body': True},
+                    {'type': 'http.request', 'body': body[5:], 'more_body': False}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {
+            'type': 'http', 'method': method, 'path': path, 'query_string': b'', 'root_path': '',
+            'headers': [(k.lower().encode(), v if isinstance(v, bytes) else v.encode()) for k, v in headers],
+            'server': ('localhost', 80), 'client': ('127.0.0.1', 1234), 'scheme': 'http', 'http_version': '1.1',
+        }
+        await self.asgi_app(scope, receive, send)
+        return sent
+
+    def test_get_info_matches_flask(self):
+        status, headers, body = self.request('GET', '/get_info')
+        flask_response = self.client.get('/get_info')
+        assert status == 200
+        assert body == flask_response.data
+        assert headers[b'etag'].decode() == flask_response.headers['ETag']
+
+    def test_get_info_not_modified(self):
+        _, headers, _ = self.request('GET', '/get_info')
+        status, _, body = self.request('GET', '/get_info', headers=[('If-None-Match', headers[b'etag'])])
+        assert status == 304
+        assert body == b''
+
+    def test_get_info_metrics(self):
+        key = (metrics.RESPONSES, (('endpoint', 'routes.get_info'), ('status', '200')))
+        before = metrics.registry.snapshot().values.get(key, 0)
+        self.request('GET', '/get_info')
+        self.client.get('/get_info')
+        assert metrics.registry.snapshot().values[key] == before + 2
+
+    def test_register(self):
+        payload = json.dumps({'username': 'new_user', 'password': 'bar', 'bank_account': 'abcdef'}).encode()
+        status, _, body = self.request('POST', '/register', payload, [('Content-Type', 'application/json')])
+        assert status == 200
+        assert json.loads(body) == 'new_user'
+
+    def test_register_incomplete(self):
+        payload = json.dumps({'username': 'new_user'}).encode()
+        status, _, _ = self.request('POST', '/register', payload, [('Content-Type', 'application/json')])
+        assert status == 400
+
+    def test_get_schedule(self):
+        create_user('foo', 'bar', 'baz')
+        headers = [('Authorization', encode_username_password(b'foo', b'bar')),
+                   ('Timestamp', datetime(2018, 4, 5).isoformat())]
+        status, _, body = self.request('GET', '/get_schedule', headers=headers)
+        assert status == 200
+        assert json.loads(body) == {'balance': 0, 'schedule': {}}
+
+    def test_requires_auth(self):
+        status, _, _ = self.request('GET', '/get_schedule')
+        assert status != 200
+
+    def test_overloaded(self):
+        self.asgi_app.executor.shutdown()
+        self.asgi_app = AsgiApp(self.app, max_workers=1, max_queue=1)
+        release = threading.Event()
+
+        def slow_view(environ):
+            release.wait(5)
+            return 200, [], [b'done']
+
+        async def run():
+            with mock.patch.object(self.asgi_app, '_run_wsgi', slow_view):
+                running = [asyncio.ensure_future(self.call('GET', '/get_schedule')) for _ in range(2)]
+                await asyncio.sleep(0.05)
+                rejected = await self.call('GET', '/get_schedule')
+                release.set()
+                return rejected, await asyncio.gather(*running)
+
+        rejected, finished = asyncio.run(run())
+        assert rejected[0]['status'] == 503
+        assert dict(rejected[0]['headers'])[b'retry-after'] == b'1'
+        assert [sent[0]['status'] for sent in finished] == [200, 200]
+        assert self.asgi_app.pending == 0
+
+    def test_lifespan_shutdown(self):
+        messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message['type'])
+
+        asyncio.run(self.asgi_app({'type': 'lifespan'}, receive, send))
+        assert sent == ['lifespan.startup.complete', 'lifespan.shutdown.complete']
@@ -1,6 +1,12 @@
-from wk_client.auth_utils import create_user, hash_pw
+from unittest import mock
+
+from wk_client import db
+from wk_client import bank
+from wk_client.auth_utils import create_user, create_users, hash_pw, credential_cache, _get_credentials, \
+    CHANGED_USERNAMES
 from wk_client.models import User
 from wk_client.tests.conftest import AppTestCase
+from wk_client.utils import TTLCache
 
 
 class TestAuth(AppTestCase):
@@ -22,3 +28,113 @@ class TestAuth(AppTestCase):
         self.assertEqual(user.hashed_password, hash_pw('bar', 'foo'))
 
 
+class TestCreateUsers(AppTestCase):
+    def test_creates_users(self):
+        ids = create_users([('foo', 'bar', 'acc1'), ('baz', 'qux', 'acc2')])
+        self.assertEqual(len(ids), 2)
+        user = User.query.get(ids[0])
+        self.assertEqual(user.username, 'foo')
+        self.assertEqual(user.account, 'acc1')
+        self.assertEqual(user.hashed_password, hash_pw('bar', 'foo'))
+        self.assertEqual(bank.user_map['acc2'], ids[1])
+
+    def test_conflicts(self):
+        create_user('foo', 'bar', 'acc1')
+        ids = create_users([
+            ('foo', 'x', 'acc2'),  # Username taken.
+            ('new', 'x', 'acc1'),  # Account taken.
+            ('baz', 'x', 'acc3'),
+            ('baz', 'x', 'acc3'),  # Repeated in the batch.
+        ])
+        self.assertIsNone(ids[0])
+        self.assertIsNone(ids[1])
+        self.assertIsNotNone(ids[2])
+        self.assertIsNone(ids[3])
+        self.assertEqual(User.query.count(), 2)
+
+    def test_invalid_rows(self):
+        ids = create_users([('foo', 1, 'acc1'), ({'a': 1}, 'x', 'acc2'), ('baz', 'x', ['acc3']), ('qux', 'x', 'acc4')])
+        self.assertListEqual([i is None for i in ids], [True, True, True, False])
+        self.assertEqual(User.query.count(), 1)
+
+    def test_race_with_other_registration(self):
+        with mock.patch('wk_client.auth_utils._existing', return_value=set()):
+            create_user('foo', 'bar', 'acc1')
+            ids = create_users([('foo', 'x', 'acc2'), ('baz', 'x', 'acc3')])
+        self.assertIsNone(ids[0])
+        self.assertIsNotNone(ids[1])
+        self.assertEqual(User.query.count(), 2)
+
+    def test_invalidates_unknown_user_cache(self):
+        self.assertIsNone(_get_credentials('foo'))
+        create_users([('foo', 'bar', 'acc1')])
+        self.assertIsNotNone(_get_credentials('foo'))
+
+
+class TestCredentialCache(AppTestCase):
+    def setUp(self):
+        super(TestCredentialCache, self).setUp()
+        credential_cache.clear()
+
+    def test_credentials_cached(self):
+        user = create_user('foo', 'bar', 'baz')
+        self.assertEqual(_get_credentials('foo'), (user.id, hash_pw('bar', 'foo')))
+        with mock.patch.object(User, 'query') as query:
+            self.assertEqual(_get_credentials('foo'), (user.id, hash_pw('bar', 'foo')))
+        self.assertFalse(query.called)
+
+    def test_unknown_user_cached(self):
+        self.assertIsNone(_get_credentials('foo'))
+        with mock.patch.object(User, 'query') as query:
+            self.assertIsNone(_get_credentials('foo'))
+        self.assertFalse(query.called)
+
+    def test_create_user_invalidates(self):
+        self.assertIsNone(_get_credentials('foo'))
+        user = create_user('foo', 'bar', 'baz')
+        self.assertEqual(_get_credentials('foo'), (user.id, hash_pw('bar', 'foo')))
+
+    def test_change_invalidates(self):
+        user = create_user('foo', 'bar', 'baz')
+        _get_credentials('foo')
+        user.hashed_password = hash_pw('new', 'foo')
+        db.session.commit()
+        self.assertEqual(_get_credentials('foo'), (user.id, hash_pw('new', 'foo')))
+
+    def test_change_invalidates_on_commit(self):
+        user = create_user('foo', 'bar', 'baz')
+        user.hashed_password = hash_pw('new', 'foo')
+        db.session.flush()
+        # Another request reads the committed row between the flush and the commit.
+        credential_cache.set('foo', (user.id, hash_pw('bar', 'foo')))
+        db.session.commit()
+        self.assertEqual(_get_credentials('foo'), (user.id, hash_pw('new', 'foo')))
+
+    def test_rename_invalidates_old_name(self):
+        user = create_user('foo', 'bar', 'baz')
+        _get_credentials('foo')
+        user.username = 'qux'
+        db.session.commit()
+        self.assertIsNone(_get_credentials('foo'))
+
+    def test_rollback_forgets_changes(self):
+        user = create_user('foo', 'bar', 'baz')
+        user.hashed_password = hash_pw('new', 'foo')
+        db.session.flush()
+        db.session.rollback()
+        self.assertNotIn(CHANGED_USERNAMES, db.session.info)
+        self.assertEqual(_get_credentials('foo'), (user.id, hash_pw('bar', 'foo')))
+
+    def test_entries_expire(self):
+        cache = TTLCache(maxsize=10, ttl=60)
+        cache.set('foo', 1)
+        cache.set('bar', 2, ttl=-1)
+        self.assertEqual(cache.get('foo'), 1)
+        self.assertIsNone(cache.get('bar'))
+
+    def test_cache_is_bounded(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        for i in range(3):
+            cache.set(i, i)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get(0))
@@ -1,8 +1,15 @@
+import os
+import tempfile
+import types
 from datetime import datetime
 from unittest import mock
 
-from wk_client import bank
+from generate_transactions import OUR_ACCOUNT
+from wk_client import bank, db
+from wk_client.auth_utils import create_user
+from wk_client.db_utils import nuke_database
 from wk_client.tests.conftest import AppTestCase
+from wk_client.tests.factories import UserFactory
 
 
 class TestSendCash(AppTestCase):
@@ -16,3 +23,123 @@ class TestSendCash(AppTestCase):
         transaction = bank.send_cash(100, 'foo')
         self.assertDictEqual(transaction, {'amount': 100., 'timestamp': self.frozen_time, 'bank_ref': transaction['bank_ref']})
         self.assertTrue(isinstance(transaction['bank_ref'], str))
+
+
+class TestReadStatement(AppTestCase):
+    def setUp(self):
+        super(TestReadStatement, self).setUp()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmp_dir.name, 'transactions.csv')
+        with open(self.filename, 'w') as f:
+            f.write('reference,datetime,account_from,account_to,amount\n')
+            f.write('ref1,2019-02-23T14:57:13,{},acc1,5000.0\n'.format(OUR_ACCOUNT))
+            f.write('ref2,23 Feb 2019 15:49:38,acc2,{},250.5\n'.format(OUR_ACCOUNT))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+        super(TestReadStatement, self).tearDown()
+
+    def test_read_statement_is_lazy(self):
+        self.assertIsInstance(bank.read_statement(self.filename), types.GeneratorType)
+
+    def test_read_statement(self):
+        records = list(bank.read_statement(self.filename))
+        self.assertListEqual(records, [
+            {'in': 0, 'out': 5000., 'datetime': datetime(2019, 2, 23, 14, 57, 13), 'reference': 'ref1',
+             'account': 'acc1'},
+            {'in': 250.5, 'out': 0, 'datetime': datetime(2019, 2, 23, 15, 49, 38), 'reference': 'ref2',
+             'account': 'acc2'},
+        ])
+
+    def test_load_new_inbound_cashflows(self):
+        user = UserFactory(account='acc2')
+        with mock.patch('generate_transactions.TRANSACTION_FILENAME', self.filename):
+            cashflows = bank.load_new_inbound_cashflows()
+        self.assertListEqual(cashflows, [
+            {'amount': 250.5, 'timestamp': datetime(2019, 2, 23, 15, 49, 38), 'bank_ref': 'ref2', 'user_id': user.id}
+        ])
+
+
+class TestUserMap(AppTestCase):
+    def setUp(self):
+        super(TestUserMap, self).setUp()
+        self.user_map = bank.UserMap(maxsize=2)
+
+    def test_refresh_loads_users(self):
+        user1 = UserFactory(account='acc1')
+        user2 = UserFactory(account='acc2')
+        self.user_map.refresh()
+        self.assertEqual(self.user_map['acc1'], user1.id)
+        self.assertEqual(self.user_map['acc2'], user2.id)
+
+    def test_refresh_loads_only_new_and_recently_changed_users(self):
+        UserFactory(account='acc0', updated=datetime(2019, 1, 1))
+        user1 = UserFactory(account='acc1')
+        self.user_map.refresh()
+        user2 = UserFactory(account='acc2')
+        with mock.patch.object(self.user_map, '_put', wraps=self.user_map._put) as put:
+            self.user_map.refresh()
+        self.assertListEqual(put.call_args_list, [mock.call('acc1', user1.id), mock.call('acc2', user2.id)])
+
+    def test_refresh_drops_changed_account(self):
+        user1 = UserFactory(account='acc1')
+        self.user_map.refresh()
+        user2 = UserFactory(account='acc2')
+        user1.account = 'renamed'
+        db.session.commit()
+        self.user_map.refresh()
+        self.assertNotIn('acc1', self.user_map._accounts)
+        self.assertEqual(self.user_map['renamed'], user1.id)
+        self.assertEqual(self.user_map['acc2'], user2.id)
+        with self.assertRaises(KeyError):
+            _ = self.user_map['acc1']
+
+    def test_refresh_follows_swapped_accounts(self):
+        user1 = UserFactory(account='acc1')
+        user2 = UserFactory(account='acc2')
+        self.user_map.refresh()
+        user1.account = 'tmp'
+        db.session.commit()
+        user2.account = 'acc1'
+        db.session.commit()
+        user1.account = 'acc2'
+        db.session.commit()
+        self.user_map.refresh()
+        self.assertEqual(self.user_map._accounts, {'acc1': user2.id, 'acc2': user1.id})
+
+    def test_refresh_starts_over_after_delete(self):
+        user1 = UserFactory(account='acc1')
+        UserFactory(account='acc2')
+        self.user_map.refresh()
+        db.session.delete(user1)
+        db.session.commit()
+        self.user_map.refresh()
+        self.assertNotIn('acc1', self.user_map._accounts)
+        with self.assertRaises(KeyError):
+            _ = self.user_map['acc1']
+
+    def test_unknown_account(self):
+        self.user_map.refresh()
+        with self.assertRaises(KeyError):
+            _ = self.user_map['missing']
+
+    def test_evicted_account_is_looked_up(self):
+        users = [UserFactory(account='acc{}'.format(i)) for i in range(3)]
+        self.user_map.refresh()
+        self.assertEqual(len(self.user_map._accounts), 2)
+        self.assertEqual(self.user_map['acc0'], users[0].id)
+
+    def test_create_user_updates_map(self):
+        bank.user_map.refresh()
+        user = create_user('foo', 'bar', 'baz')
+        self.assertEqual(bank.user_map._accounts['baz'], user.id)
+
+    def test_deleted_users_reset_map(self):
+        UserFactory(account='acc1')
+        UserFactory(account='acc2')
+        self.user_map.refresh()
+        nuke_database()
+        user = UserFactory(account='acc3')
+        self.user_map.refresh()
+        self.assertNotIn('acc2', self.user_map._accounts)
+        self.assertEqual(self.user_map['acc3'], user.id)
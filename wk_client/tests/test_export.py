@@ -0,0 +1,74 @@
+import glob
+import os
+import tempfile
+import unittest
+
+import numpy
+
+from wk_client import db
+from wk_client.commands import export_ledger_command
+from wk_client.export import _pyarrow, export_ledger, read_npz
+from wk_client.models import CashFlow, Decision, Loan
+from wk_client.seed import seed_portfolio
+from wk_client.tests.conftest import AppTestCase
+
+
+class TestExportLedger(AppTestCase):
+    def setUp(self):
+        super(TestExportLedger, self).setUp()
+        seed_portfolio(20, seed=2)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.directory = self.tmp_dir.name
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+        super(TestExportLedger, self).tearDown()
+
+    def test_export_npz(self):
+        counts = export_ledger(self.directory, fmt='npz')
+        self.assertEqual(counts, {'cash_flow': CashFlow.query.count(), 'loan': Loan.query.count(),
+                                  'decision': Decision.query.count()})
+
+        cashflows = read_npz(self.directory, 'cash_flow')
+        self.assertEqual(len(cashflows['id']), CashFlow.query.count())
+        self.assertAlmostEqual(cashflows['amount'].sum(), db.session.query(db.func.sum(CashFlow.amount)).scalar())
+        self.assertTrue((numpy.diff(cashflows['datetime']) >= numpy.timedelta64(0)).all())
+        self.assertEqual(set(cashflows['bank_ref']), {ref for ref, in db.session.query(CashFlow.bank_ref)})
+
+    def test_partitioned_by_month(self):
+        export_ledger(self.directory, tables=('cash_flow',), fmt='npz', batch_size=5)
+        parts = glob.glob(os.path.join(self.directory, 'cash_flow', 'month=*', 'part-*.npz'))
+        self.assertGreater(len(parts), 1)
+        for path in parts:
+            month = os.path.basename(os.path.dirname(path))[len('month='):]
+            with numpy.load(path) as part:
+                self.assertLessEqual(len(part['id']), 5)
+                self.assertEqual(set(part['datetime'].astype('datetime64[M]').astype(str)), {month})
+
+        month = os.path.basename(os.path.dirname(parts[0]))[len('month='):]
+        selected = read_npz(self.directory, 'cash_flow', months=[month])
+        self.assertEqual(set(selected['datetime'].astype('datetime64[M]').astype(str)), {month})
+
+    def test_nulls(self):
+        export_ledger(self.directory, tables=('decision',), fmt='npz')
+        decisions = read_npz(self.directory, 'decision')
+        declined = Decision.query.filter(Decision.amount.is_(None)).count()
+        self.assertEqual(numpy.isnan(decisions['amount']).sum(), declined)
+
+    def test_export_replaces(self):
+        export_ledger(self.directory, tables=('loan',), fmt='npz')
+        db.session.query(CashFlow).delete()
+        db.session.query(Loan).delete()
+        db.session.commit()
+        self.assertEqual(export_ledger(self.directory, tables=('loan',), fmt='npz'), {'loan': 0})
+        self.assertEqual(len(read_npz(self.directory, 'loan')['id']), 0)
+
+    @unittest.skipIf(_pyarrow(), 'pyarrow is installed')
+    def test_parquet_needs_pyarrow(self):
+        with self.assertRaises(RuntimeError):
+            export_ledger(self.directory, fmt='parquet')
+
+    def test_command(self):
+        result = self.app.test_cli_runner().invoke(
+            export_ledger_command, [self.directory, '--format', 'npz', '--table', 'loan'])
+        self.assertIn('loan: {}'.format(Loan.query.count()), result.output)
@@ -0,0 +1,140 @@
+import csv
+import multiprocessing
+import os
+import tempfile
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from unittest import mock
+
+import numpy
+
+from generate_transactions import SimulatedClock, CLOCK_LEASE_SIZE, OUR_ACCOUNT, \
+    generate_inbound_transaction_blocks, write_transaction_blocks, _csv_bytes
+
+
+def _tick_minute(filename):
+    with mock.patch('random.expovariate', return_value=60):
+        return SimulatedClock(filename, exponential=True).tick()
+
+
+class TestSimulatedClock(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmp_dir.name, 'clock.dat')
+        self.start = datetime(2019, 2, 23, 14, 41)
+        with open(self.filename, 'w') as f:
+            f.write(self.start.isoformat())
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def read_clock_file(self):
+        with open(self.filename) as f:
+            return datetime.fromisoformat(f.read())
+
+    def test_tick_advances(self):
+        clock = SimulatedClock(self.filename)
+        times = [clock.tick() for _ in range(10)]
+        self.assertGreaterEqual(times[0], self.start)
+        self.assertListEqual(times, sorted(times))
+        self.assertLessEqual(times[-1] - self.start, 10 * timedelta(minutes=90))
+
+    def test_tick_writes_the_clock_file(self):
+        clock = SimulatedClock(self.filename, lease_size=1)
+        now = clock.tick()
+        self.assertEqual(self.read_clock_file(), now)
+        self.assertListEqual(sorted(os.listdir(self.tmp_dir.name)), ['clock.dat', 'clock.dat.lock'])
+
+    def test_failed_write_keeps_the_clock_file(self):
+        clock = SimulatedClock(self.filename)
+        with mock.patch('os.replace', side_effect=OSError):
+            with self.assertRaises(OSError):
+                clock.tick()
+        self.assertEqual(self.read_clock_file(), self.start)
+
+    def test_tick_leases(self):
+        clock = SimulatedClock(self.filename, lease_size=10)
+        with mock.patch.object(clock, '_read', wraps=clock._read) as read:
+            times = [clock.tick() for _ in range(11)]
+        self.assertEqual(read.call_count, 2)
+        self.assertListEqual(times, sorted(times))
+        self.assertLess(self.read_clock_file(), times[-1] + 10 * timedelta(minutes=90))
+
+    def test_clocks_share_the_file(self):
+        first, second = SimulatedClock(self.filename, lease_size=1), SimulatedClock(self.filename, lease_size=1)
+        times = [clock.tick() for _ in range(5) for clock in (first, second)]
+        self.assertListEqual(times, sorted(times))
+        self.assertEqual(self.read_clock_file(), times[-1])
+
+    def test_clocks_lease_disjoint_times(self):
+        first, second = SimulatedClock(self.filename), SimulatedClock(self.filename)
+        first_times = [first.tick() for _ in range(5)]
+        second_times = [second.tick() for _ in range(5)]
+        self.assertLess(first_times[-1], second_times[0])
+        self.assertGreaterEqual(self.read_clock_file(), second_times[-1])
+
+    def test_processes_do_not_lose_ticks(self):
+        with ProcessPoolExecutor(4, mp_context=multiprocessing.get_context('fork')) as executor:
+            times = list(executor.map(_tick_minute, [self.filename] * 200))
+        self.assertEqual(len(set(times)), 200)
+        self.assertEqual(self.read_clock_file(), self.start + 200 * CLOCK_LEASE_SIZE * timedelta(minutes=1))
+
+    def test_tick_many(self):
+        clock = SimulatedClock(self.filename)
+        times = clock.tick_many(100)
+        self.assertEqual(len(times), 100)
+        self.assertTrue((numpy.diff(times) >= numpy.timedelta64(0, 's')).all())
+        self.assertEqual(self.read_clock_file(), times[-1].astype(datetime))
+        self.assertGreaterEqual(clock.tick(), times[-1].astype(datetime))
+
+    def test_exponential(self):
+        clock = SimulatedClock(self.filename, exponential=True, mean_interval=60)
+        times = [clock.tick() for _ in range(1000)]
+        mean_interval = (times[-1] - self.start).total_seconds() / len(times)
+        self.assertTrue(30 < mean_interval < 90)
+
+
+class TestBulkTransactions(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmp_dir.name, 'transactions.csv')
+        clock_filename = os.path.join(self.tmp_dir.name, 'clock.dat')
+        with open(clock_filename, 'w') as f:
+            f.write('2019-02-23T14:41:00')
+        patcher = mock.patch('generate_transactions.clock', SimulatedClock(clock_filename))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_csv_bytes(self):
+        block = {
+            'reference': numpy.array(['ref1', 'ref22']),
+            'datetime': numpy.array(['2019-02-23T04:05:06', '2019-12-31T23:59:59'], dtype='datetime64[s]'),
+            'account_from': numpy.array([b'acc1', b'acc1']),
+            'account_to': numpy.array([b'us', b'us']),
+            'amount': numpy.array([5.1, 12345.67]),
+        }
+        self.assertEqual(
+            _csv_bytes(block),
+            b'ref1,2019-02-23T04:05:06,acc1,us,5.10\nref22,2019-12-31T23:59:59,acc1,us,12345.67\n'
+        )
+
+    def test_blocks(self):
+        blocks = list(generate_inbound_transaction_blocks(25, block_size=10))
+        self.assertListEqual([len(b['amount']) for b in blocks], [10, 10, 5])
+        references = numpy.concatenate([b['reference'] for b in blocks])
+        self.assertEqual(len(set(references)), 25)
+
+    def test_write_transaction_blocks(self):
+        n_records = write_transaction_blocks(generate_inbound_transaction_blocks(25, block_size=10), self.filename)
+        self.assertEqual(n_records, 25)
+        with open(self.filename) as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual(len(rows), 25)
+        for row in rows:
+            self.assertEqual(row['account_to'], OUR_ACCOUNT)
+            self.assertGreater(float(row['amount']), 0)
+            self.assertEqual(datetime.fromisoformat(row['datetime']).isoformat(), row['datetime'])
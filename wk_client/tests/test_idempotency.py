@@ -0,0 +1,155 @@
+import json
+from datetime import datetime, timedelta
+from hashlib import sha256
+from unittest import mock
+
+from wk_client import db
+from wk_client.auth_utils import create_user
+from wk_client.models import CashFlow, IdempotencyKey, Loan
+from wk_client.tests.conftest import AppTestCase, encode_username_password
+from wk_client.tests.factories import ApprovalFactory
+
+
+class TestIdempotentFunding(AppTestCase):
+    def setUp(self):
+        super(TestIdempotentFunding, self).setUp()
+        self.test_user = create_user('user4', 'pass4', 'acc4')
+        self.timestamp = datetime(2018, 4, 5, 15, 5, 5)
+        ApprovalFactory(user=self.test_user, datetime=self.timestamp - timedelta(minutes=5), amount=5000, id=9)
+        self.app.config['IDEMPOTENCY_WAIT'] = 0.1
+
+    def post_with_key(self, data, key):
+        return self.client.post('/request_funding', data=json.dumps(data), content_type='application/json', headers={
+            'Authorization': encode_username_password(b'user4', b'pass4'),
+            'Timestamp': self.timestamp.isoformat(),
+            'Idempotency-Key': key,
+        })
+
+    def mock_bank(self, mock_send_cash):
+        mock_send_cash.return_value = {
+            'amount': 3500, 'timestamp': self.timestamp + timedelta(minutes=1), 'bank_ref': 'foo'}
+
+    @mock.patch('wk_client.bank.send_cash')
+    def test_retry_replays_response(self, mock_send_cash):
+        self.mock_bank(mock_send_cash)
+        payload = {'amount': 3500, 'approval_reference': 9}
+        first = self.post_with_key(payload, 'abc')
+        retry = self.post_with_key(payload, 'abc')
+
+        assert first.status_code == 200
+        assert retry.status_code == 200
+        assert retry.data == first.data
+        assert retry.headers['Idempotent-Replayed'] == 'true'
+        assert mock_send_cash.call_count == 1
+        assert Loan.query.filter_by(user_id=self.test_user.id).count() == 1
+
+    @mock.patch('wk_client.bank.send_cash')
+    def test_different_body_rejected(self, mock_send_cash):
+        self.mock_bank(mock_send_cash)
+        self.post_with_key({'amount': 3500, 'approval_reference': 9}, 'abc')
+        response = self.post_with_key({'amount': 1500, 'approval_reference': 9}, 'abc')
+        assert response.status_code == 422
+        assert mock_send_cash.call_count == 1
+
+    @mock.patch('wk_client.bank.send_cash')
+    def test_error_releases_key(self, mock_send_cash):
+        mock_send_cash.side_effect = ValueError
+        payload = {'amount': 3500, 'approval_reference': 9}
+        assert self.post_with_key(payload, 'abc').status_code == 400
+        assert IdempotencyKey.query.count() == 0
+
+        mock_send_cash.side_effect = None
+        self.mock_bank(mock_send_cash)
+        assert self.post_with_key(payload, 'abc').status_code == 200
+        assert CashFlow.query.filter_by(user_id=self.test_user.id, type=0).count() == 1
+
+    @mock.patch('wk_client.bank.send_cash')
+    def test_in_flight_duplicate(self, mock_send_cash):
+        self.mock_bank(mock_send_cash)
+        payload = {'amount': 3500, 'approval_reference': 9}
+        db.session.add(IdempotencyKey(
+            user_id=self.test_user.id, key='abc', request_hash=_hash(payload), created=datetime.utcnow()))
+        db.session.commit()
+
+        response = self.post_with_key(payload, 'abc')
+        assert response.status_code == 409
+        assert not mock_send_cash.called
+
+    @mock.patch('wk_client.bank.send_cash')
+    def test_expired_key_reused(self, mock_send_cash):
+        self.mock_bank(mock_send_cash)
+        payload = {'amount': 3500, 'approval_reference': 9}
+        db.session.add(IdempotencyKey(
+            user_id=self.test_user.id, key='abc', request_hash=_hash(payload),
+            created=datetime.utcnow() - timedelta(days=2), status_code=200, response='old'))
+        db.session.commit()
+
+        response = self.post_with_key(payload, 'abc')
+        assert response.status_code == 200
+        assert response.data != b'old'
+        assert mock_send_cash.called
+
+    @mock.patch('wk_client.bank.send_cash')
+    def test_stale_in_flight_key_reclaimed(self, mock_send_cash):
+        self.mock_bank(mock_send_cash)
+        payload = {'amount': 3500, 'approval_reference': 9}
+        db.session.add(IdempotencyKey(
+            user_id=self.test_user.id, key='abc', request_hash=_hash(payload),
+            created=datetime.utcnow() - timedelta(hours=1)))
+        db.session.commit()
+
+        assert self.post_with_key(payload, 'abc').status_code == 200
+        assert mock_send_cash.call_count == 1
+
+    @mock.patch('wk_client.bank.send_cash')
+    def test_stale_key_with_side_effects_not_rerun(self, mock_send_cash):
+        self.mock_bank(mock_send_cash)
+        payload = {'amount': 3500, 'approval_reference': 9}
+        db.session.add(IdempotencyKey(
+            user_id=self.test_user.id, key='abc', request_hash=_hash(payload),
+            created=datetime.utcnow() - timedelta(hours=1), side_effects=True))
+        db.session.commit()
+
+        assert self.post_with_key(payload, 'abc').status_code == 409
+        assert not mock_send_cash.called
+
+    @mock.patch('wk_client.logic.UserAccount.create_loan')
+    @mock.patch('wk_client.bank.send_cash')
+    def test_failure_after_bank_keeps_key(self, mock_send_cash, mock_create_loan):
+        self.mock_bank(mock_send_cash)
+        mock_create_loan.side_effect = ValueError
+        payload = {'amount': 3500, 'approval_reference': 9}
+        with self.assertRaises(ValueError):
+            self.post_with_key(payload, 'abc')
+
+        record = IdempotencyKey.query.one()
+        assert record.side_effects and record.status_code is None
+        assert self.post_with_key(payload, 'abc').status_code == 409
+        assert mock_send_cash.call_count == 1
+
+    @mock.patch('wk_client.idempotency.save_response')
+    @mock.patch('wk_client.bank.send_cash')
+    def test_response_recorded_with_loan(self, mock_send_cash, mock_save_response):
+        self.mock_bank(mock_send_cash)
+        mock_save_response.side_effect = ValueError
+        with self.assertRaises(ValueError):
+            self.post_with_key({'amount': 3500, 'approval_reference': 9}, 'abc')
+        assert Loan.query.filter_by(user_id=self.test_user.id).count() == 0
+        # Only the bank's confirmation is kept.
+        funding = CashFlow.query.filter_by(user_id=self.test_user.id).one()
+        assert (funding.amount, funding.bank_ref) == (-3500, 'foo')
+
+    @mock.patch('wk_client.bank.send_cash')
+    def test_without_key(self, mock_send_cash):
+        self.mock_bank(mock_send_cash)
+        response = self.client.post(
+            '/request_funding', data=json.dumps({'amount': 3500, 'approval_reference': 9}),
+            content_type='application/json', headers={
+                'Authorization': encode_username_password(b'user4', b'pass4'),
+                'Timestamp': self.timestamp.isoformat()})
+        assert response.status_code == 200
+        assert IdempotencyKey.query.count() == 0
+
+
+def _hash(payload):
+    return sha256(json.dumps(payload).encode('utf-8')).hexdigest()
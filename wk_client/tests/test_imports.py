@@ -0,0 +1,23 @@
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CHECK = '''
+import sys
+import wk_client
+assert not hasattr(wk_client, 'app'), 'app built on import'
+import wk_client.asgi
+assert not hasattr(wk_client.asgi, 'app'), 'ASGI app built on import'
+wk_client.create_app()
+print(' '.join(m for m in ('wk_client.risk_model', 'pandas', 'xgboost', 'numpy', 'requests', 'flask_migrate', 'alembic') if m in sys.modules))
+'''
+
+
+class TestImports(unittest.TestCase):
+    def test_heavy_imports_deferred(self):
+        env = dict(os.environ, LOG_FILENAME=os.devnull)
+        output = subprocess.check_output([sys.executable, '-c', CHECK], cwd=ROOT, env=env)
+        self.assertEqual(output.decode().strip(), '')
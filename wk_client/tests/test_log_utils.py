@@ -0,0 +1,91 @@
+import io
+import json
+import logging
+import os
+import queue
+import tempfile
+import unittest
+from unittest import mock
+
+from wk_client.log_utils import JSONFormatter, PayloadQueueHandler, configure_logging, stop_logging
+
+
+class TestJSONFormatter(unittest.TestCase):
+    def test_format(self):
+        record = logging.LogRecord('wk_client', logging.INFO, __file__, 1, 'Hello %s', ('foo',), None)
+        record.payload = '{"a": 1}'
+        entry = json.loads(JSONFormatter().format(record))
+        self.assertEqual(entry['level'], 'INFO')
+        self.assertEqual(entry['logger'], 'wk_client')
+        self.assertEqual(entry['message'], 'Hello foo')
+        self.assertEqual(entry['payload'], '{"a": 1}')
+
+
+class TestPayloadQueueHandler(unittest.TestCase):
+    def make_record(self, payload):
+        record = logging.LogRecord('wk_client', logging.INFO, __file__, 1, 'Hello %s', ('foo',), None)
+        record.payload = payload
+        return record
+
+    def test_payload_truncated(self):
+        handler = PayloadQueueHandler(queue.Queue(), payload_max_length=10)
+        record = handler.prepare(self.make_record({'data': 'x' * 100}))
+        self.assertEqual(record.payload, '{"data": "...')
+        self.assertEqual(record.msg, 'Hello foo')
+
+    def test_payload_sampled(self):
+        handler = PayloadQueueHandler(queue.Queue(), payload_sample_rate=0.)
+        record = handler.prepare(self.make_record({'data': 1}))
+        self.assertIsNone(record.payload)
+
+    def test_full_queue_drops(self):
+        handler = PayloadQueueHandler(queue.Queue(1))
+        handler.handle(self.make_record(None))
+        handler.handle(self.make_record(None))
+        self.assertEqual(handler.dropped, 1)
+
+
+class TestConfigureLogging(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmp_dir.name, 'app.log')
+
+    def tearDown(self):
+        stop_logging()
+        self.tmp_dir.cleanup()
+
+    def test_writes_json_lines(self):
+        with open(self.filename, 'w') as f:
+            f.write('existing\n')
+        configure_logging({'LOG_FILENAME': self.filename, 'LOG_LEVELS': {'wk_client.test': 'WARNING'}}, 'wk_client')
+        logging.getLogger('wk_client.test').info('Not logged')
+        logging.getLogger('wk_client.test').warning('Logged', extra={'payload': {'a': 1}})
+        stop_logging()
+
+        with open(self.filename) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(lines[0], 'existing')
+        self.assertEqual(len(lines), 2)
+        entry = json.loads(lines[1])
+        self.assertEqual(entry['message'], 'Logged')
+        self.assertEqual(entry['payload'], '{"a": 1}')
+
+    def test_only_the_app_logger(self):
+        root_handlers = list(logging.getLogger().handlers)
+        configure_logging({'LOG_FILENAME': self.filename}, 'wk_client')
+        logging.getLogger('werkzeug').warning('Not ours')
+        logging.getLogger('wk_client').warning('Ours')
+        self.assertListEqual(logging.getLogger().handlers, root_handlers)
+        stop_logging()
+
+        with open(self.filename) as f:
+            self.assertListEqual([json.loads(line)['message'] for line in f], ['Ours'])
+        self.assertListEqual(logging.getLogger('wk_client').handlers, [])
+
+    def test_console(self):
+        with mock.patch('sys.stderr', io.StringIO()) as stderr:
+            configure_logging({'LOG_CONSOLE_LEVEL': 'WARNING'}, 'wk_client')
+            logging.getLogger('wk_client').info('Not shown')
+            logging.getLogger('wk_client').warning('Shown', extra={'payload': {'a': 1}})
+            stop_logging()
+        self.assertRegex(stderr.getvalue(), r'^\[.*\] WARNING in test_log_utils: Shown\n$')
@@ -1,7 +1,10 @@
+import copy
 from datetime import datetime, timedelta, date
+from unittest import mock
 
 from wk_client import db
-from wk_client.logic import UserAccount, Rate
+from wk_client.constants import SAMPLE_APPLICATION
+from wk_client.logic import UserAccount, Rate, evaluate_decision
 from wk_client.models import Loan, CashFlow
 from wk_client.tests.conftest import AppTestCase
 from wk_client.tests.factories import UserFactory, LoanFactory, RepaymentFactory, FundingFactory, \
@@ -275,3 +278,26 @@ class TestRepaymentSchedules(AppTestCase):
         cf = [CashFlow(amount=a, datetime=k, type=1) for k, a in expected.items()]
         remnant = ua.balance_from_cashflows(ua.cashflows + cf, ua.interest_rates_from_loans(ua.loans), final_date)
         self.assertEqual(final_amount, round(remnant, 2))
+
+
+class TestEvaluateDecision(AppTestCase):
+    def test_scores_sample_application(self):
+        data = copy.deepcopy(SAMPLE_APPLICATION)
+        data['basic_questions']['amount_requested'] = 5000
+        with mock.patch('wk_client.risk_model.get_classifier') as mock_get_classifier:
+            mock_get_classifier.return_value._predict.return_value = True
+            decision = evaluate_decision(data)
+        self.assertTrue(decision.approved)
+        self.assertEqual(decision.params['amount'], 5000)
+        model_data = mock_get_classifier.return_value._predict.call_args[0][0]
+        self.assertEqual(model_data['personal__credit_limit'], 5000)
+        self.assertEqual(model_data['company__turnover'], 170403)
+        self.assertEqual(model_data['company__year_of_incorporation'], 2012)
+
+    def test_model_columns(self):
+        from wk_client.risk_model import get_classifier
+        data = copy.deepcopy(SAMPLE_APPLICATION)
+        data['basic_questions']['amount_requested'] = 5000
+        with mock.patch.object(get_classifier(), '_predict', return_value=False) as mock_predict:
+            evaluate_decision(data)
+        self.assertEqual(set(mock_predict.call_args[0][0]), set(get_classifier().columns))
@@ -0,0 +1,67 @@
+import threading
+
+from wk_client.auth_utils import create_user
+from wk_client.metrics import MetricsRegistry, registry, timed, PHASE_DURATION
+from wk_client.tests.conftest import AppTestCase, open_with_auth
+
+
+class TestMetricsRegistry(AppTestCase):
+    def setUp(self):
+        super(TestMetricsRegistry, self).setUp()
+        self.registry = MetricsRegistry(buckets=(0.1, 1.))
+
+    def test_counter(self):
+        self.registry.inc('requests_total', (('endpoint', 'foo'),))
+        self.registry.inc('requests_total', (('endpoint', 'foo'),), 2)
+        self.assertIn('requests_total{endpoint="foo"} 3\n', self.registry.render())
+
+    def test_histogram(self):
+        for value in [0.05, 0.5, 0.7, 5]:
+            self.registry.observe(PHASE_DURATION, (('phase', 'auth'),), value)
+        output = self.registry.render()
+        self.assertIn('# TYPE wk_phase_duration_seconds histogram', output)
+        self.assertIn('wk_phase_duration_seconds_bucket{phase="auth",le="0.1"} 1\n', output)
+        self.assertIn('wk_phase_duration_seconds_bucket{phase="auth",le="1.0"} 3\n', output)
+        self.assertIn('wk_phase_duration_seconds_bucket{phase="auth",le="+Inf"} 4\n', output)
+        self.assertIn('wk_phase_duration_seconds_sum{phase="auth"} 6.25\n', output)
+        self.assertIn('wk_phase_duration_seconds_count{phase="auth"} 4\n', output)
+
+    def test_threads_are_aggregated(self):
+        def work():
+            for _ in range(100):
+                self.registry.inc('requests_total')
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.registry.inc('requests_total')
+        self.assertIn('requests_total 401\n', self.registry.render())
+        self.assertEqual(len(self.registry._stores), 1)
+
+
+class TestMetricsEndpoint(AppTestCase):
+    def setUp(self):
+        super(TestMetricsEndpoint, self).setUp()
+        registry.reset()
+
+    def test_request_metrics(self):
+        self.client.get('/get_info')
+        self.client.get('/get_info')
+        output = self.client.get('/metrics').data.decode()
+        self.assertIn('wk_http_responses_total{endpoint="routes.get_info",status="200"} 2\n', output)
+        self.assertIn('wk_http_request_duration_seconds_count{endpoint="routes.get_info"} 2\n', output)
+        self.assertIn('wk_http_requests_in_flight{endpoint="routes.get_info"} 0\n', output)
+        self.assertIn('wk_http_requests_in_flight{endpoint="routes.get_metrics"} 1\n', output)
+
+    def test_phase_metrics(self):
+        create_user('foo', 'bar', 'baz')
+        open_with_auth(self.client, '/test_login', 'get', b'foo', b'bar')
+        output = self.client.get('/metrics').data.decode()
+        self.assertIn('wk_phase_duration_seconds_count{phase="auth"} 1\n', output)
+        self.assertIn('wk_phase_duration_seconds_count{phase="db_commit"} 1\n', output)
+
+    def test_timed(self):
+        with timed('bank'):
+            pass
+        self.assertIn('wk_phase_duration_seconds_count{phase="bank"} 1\n', registry.render())
@@ -0,0 +1,67 @@
+import os
+import tempfile
+
+from wk_client import create_app, profiling
+from wk_client.auth_utils import create_user
+from wk_client.config import TestConfig
+from wk_client.tests.conftest import AppTestCase, encode_username_password
+
+
+class ProfileConfig(TestConfig):
+    PROFILE_TOKEN = 'secret'
+    PROFILE_KEEP = 2
+
+
+class TestProfiling(AppTestCase):
+    def setUp(self):
+        super(TestProfiling, self).setUp()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        ProfileConfig.PROFILE_DIR = self.tmp_dir.name
+        self.profiled_client = create_app(ProfileConfig).test_client()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+        super(TestProfiling, self).tearDown()
+
+    def profiles(self, ext='.txt'):
+        return sorted(f for f in os.listdir(self.tmp_dir.name) if f.endswith(ext))
+
+    def test_disabled_registers_no_hooks(self):
+        funcs = self.app.before_request_funcs.get(None, [])
+        self.assertNotIn(profiling.start_profile, funcs)
+
+    def test_without_header_not_profiled(self):
+        self.profiled_client.get('/get_info')
+        self.assertListEqual(self.profiles(), [])
+
+    def test_wrong_token_not_profiled(self):
+        self.profiled_client.get('/get_info', headers={'X-Profile': 'guess'})
+        self.assertListEqual(self.profiles(), [])
+
+    def test_profile_written(self):
+        create_user('foo', 'bar', 'baz')
+        headers = {'X-Profile': 'secret', 'Authorization': encode_username_password(b'foo', b'bar')}
+        response = self.profiled_client.get('/test_login', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        profiles = self.profiles()
+        self.assertEqual(len(profiles), 1)
+        self.assertEqual(len(self.profiles('.prof')), 1)
+        with open(os.path.join(self.tmp_dir.name, profiles[0])) as f:
+            content = f.read()
+        self.assertIn('route: GET /test_login (routes.test_login)', content)
+        self.assertIn('user: foo', content)
+        self.assertIn('status: 200', content)
+        self.assertIn('verify_password', content)
+
+    def test_rotation(self):
+        for _ in range(4):
+            self.profiled_client.get('/get_info', headers={'X-Profile': 'secret'})
+        self.assertEqual(len(self.profiles()), 2)
+        self.assertEqual(len(self.profiles('.prof')), 2)
+
+    def test_sampling(self):
+        class SampledConfig(TestConfig):
+            PROFILE_SAMPLE_RATE = 1.
+            PROFILE_DIR = self.tmp_dir.name
+        create_app(SampledConfig).test_client().get('/get_info')
+        self.assertEqual(len(self.profiles()), 1)
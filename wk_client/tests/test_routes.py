@@ -3,7 +3,9 @@ from datetime import datetime, timedelta
 from unittest import mock
 
 
+from wk_client import create_app, db
 from wk_client.auth_utils import create_user
+from wk_client.config import TestConfig
 from wk_client.constants import APPROVED_STATE_NAME, MIN_LOAN_AMOUNT, PRODUCT_NAME, DECLINED_STATE_NAME
 from wk_client.logic import DecisionParams
 from wk_client.models import User, Decision, Loan, CashFlow
@@ -69,13 +71,70 @@ class TestRegister(AppTestCase):
         assert rv.status == '400 BAD REQUEST'
         assert User.query.filter_by(username='incomplete_user').count() == 0
 
+    def test_register_invalid_types_fails(self):
+        payload = {'username': 'typed_user', 'password': 1234, 'bank_account': 'abcdef'}
+        rv = post_json(self.client, '/register', payload)
+        assert rv.status == '400 BAD REQUEST'
+        assert User.query.filter_by(username='typed_user').count() == 0
+
+
+class TestRegisterBatch(AppTestCase):
+    def test_register_batch(self):
+        create_user('existing_user', 'bar', 'abcdef')
+        payload = [
+            {'username': 'new_user', 'password': 'bar', 'bank_account': 'acc1'},
+            {'username': 'existing_user', 'password': 'bar', 'bank_account': 'acc2'},
+            {'username': 'incomplete_user', 'password': 'bar'},
+        ]
+        rv = post_json(self.client, '/register_batch', data=payload)
+        assert rv.status_code == 200
+        assert json.loads(rv.data) == [
+            {'username': 'new_user', 'status': 'created'},
+            {'username': 'existing_user', 'status': 'conflict'},
+            {'username': 'incomplete_user', 'status': 'invalid'},
+        ]
+        assert User.query.filter_by(username='new_user').scalar()
+        assert User.query.filter_by(username='existing_user').one().account == 'abcdef'
+
+    def test_invalid_types(self):
+        payload = [
+            {'username': 1, 'password': 'bar', 'bank_account': 'acc1'},
+            {'username': 'no_password', 'password': None, 'bank_account': 'acc2'},
+            {'username': 'list_account', 'password': 'bar', 'bank_account': ['acc3']},
+            {'username': 'long_account', 'password': 'bar', 'bank_account': 'a' * 81},
+            'not a row',
+            {'username': 'valid', 'password': 'bar', 'bank_account': 'acc4'},
+        ]
+        rv = post_json(self.client, '/register_batch', data=payload)
+        assert rv.status_code == 200
+        assert json.loads(rv.data) == [
+            {'username': None, 'status': 'invalid'},
+            {'username': 'no_password', 'status': 'invalid'},
+            {'username': 'list_account', 'status': 'invalid'},
+            {'username': 'long_account', 'status': 'invalid'},
+            {'username': None, 'status': 'invalid'},
+            {'username': 'valid', 'status': 'created'},
+        ]
+        assert User.query.count() == 1
+
+    def test_new_users_can_login(self):
+        post_json(self.client, '/register_batch', data=[{'username': 'foo', 'password': 'bar', 'bank_account': 'a'}])
+        rv = open_with_auth(self.client, '/test_login', 'get', b'foo', b'bar')
+        assert rv.status_code == 200
+
+    def test_not_a_list(self):
+        rv = post_json(self.client, '/register_batch', data={'username': 'foo'})
+        assert rv.status_code == 400
+
 
 class TestGetInfo(AppTestCase):
-    @mock.patch('wk_client.endpoints.get_product_data')
-    def test_return_product_data(self, mock_get_product_data):
+    def test_return_product_data(self):
         mock_product = {'foo': {'bar': 'baz'}}
-        mock_get_product_data.return_value = mock_product
-        rv = self.client.get('/get_info')
+
+        class ProductConfig(TestConfig):
+            PRODUCTS = mock_product
+        client = create_app(ProductConfig).test_client()
+        rv = client.get('/get_info')
         assert rv.data.decode() == json.dumps(mock_product)
 
     def test_get_info(self):
@@ -83,6 +142,23 @@ class TestGetInfo(AppTestCase):
         rv = self.client.get('/get_info')
         assert isinstance(json.loads(rv.data.decode()), dict)
 
+    def test_get_info_cache_headers(self):
+        rv = self.client.get('/get_info')
+        assert rv.headers['ETag']
+        assert 'public' in rv.headers['Cache-Control']
+        assert 'max-age=3600' in rv.headers['Cache-Control']
+
+    def test_get_info_not_modified(self):
+        etag = self.client.get('/get_info').headers['ETag']
+        rv = self.client.get('/get_info', headers={'If-None-Match': etag})
+        assert rv.status_code == 304
+        assert rv.data == b''
+
+    def test_get_info_modified(self):
+        rv = self.client.get('/get_info', headers={'If-None-Match': '"stale"'})
+        assert rv.status_code == 200
+        assert json.loads(rv.data.decode())
+
 
 class TestGetDecisionGet(AppTestCase):
     @mock.patch('wk_client.logic.get_requirements')
@@ -189,9 +265,14 @@ class TestGetDecisionPost(AppTestCase):
             params={'amount': 5000, 'interest_rate': 0.0005, 'fee_amount': 0, 'fee_rate': 0}
         )
         tstamp = datetime(2018, 5, 4, 14, 3, 12)
-        rv = post_json(self.client, '/get_decision', data={}, username=b'user2', password=b'pass2', timestamp=tstamp)
+        with self.assertLogs(self.app.logger, 'ERROR') as logs:
+            rv = post_json(self.client, '/get_decision', data={'secret': 'x'}, username=b'user2', password=b'pass2',
+                           timestamp=tstamp)
         assert rv.status == '200 OK'
         assert Decision.query.filter_by(user_id=self.test_user.id).count() == 1
+        # The application goes in the (sampled, truncated) payload, never in the message.
+        assert 'secret' not in logs.records[0].getMessage()
+        assert logs.records[0].payload['secret'] == 'x'
 
         decision = Decision.query.filter_by(user_id=self.test_user.id)[0]
         expected_object = {
@@ -213,13 +294,16 @@ class TestGetDecisionPost(AppTestCase):
 
 
 class TestGetDecision(AppTestCase):
-    def test_full_approve(self):
+    @mock.patch('wk_client.risk_model.get_classifier')
+    def test_full_approve(self, mock_get_classifier):
+        mock_get_classifier.return_value._predict.return_value = True
         test_user = create_user('user3', 'pass3', 'acc3')
         data = {
             'basic_questions': {
                 'first_name': 'Trusty',
                 'last_name': 'McTrustFace',
                 'date_of_birth': '1974-12-21',
+                'amount_requested': 5000,
             },
             'credit_report': {'score': 1},
             'company_report': {'opinion': 'passable'},
@@ -229,6 +313,11 @@ class TestGetDecision(AppTestCase):
         rv = post_json(self.client, '/get_decision', data=data, username=b'user3', password=b'pass3', timestamp=tstamp)
 
         assert rv.status == '200 OK'
+        model_data = mock_get_classifier.return_value._predict.call_args[0][0]
+        assert model_data['personal__score'] == 1
+        assert model_data['personal__credit_limit'] is None
+        assert model_data['personal__year_of_birth'] == 1974
+        assert model_data['loan_amount'] == 5000
 
         assert Decision.query.filter_by(user_id=test_user.id).count() == 1
         decision = Decision.query.filter_by(user_id=test_user.id)[0]
@@ -266,13 +355,16 @@ class TestGetDecision(AppTestCase):
         }
         assert json.loads(rv.data) == expected_response
 
-    def test_full_decline(self):
+    @mock.patch('wk_client.risk_model.get_classifier')
+    def test_full_decline(self, mock_get_classifier):
+        mock_get_classifier.return_value._predict.return_value = False
         test_user = create_user('user4', 'pass4', 'acc4')
         data = {
             'basic_questions': {
                 'first_name': 'Shady',
                 'last_name': 'McShadyFace',
                 'date_of_birth': '1994-12-21',
+                'amount_requested': 5000,
             },
             'credit_report': {'score': 1},
             'company_report': {'opinion': 'passable'},
@@ -391,6 +483,7 @@ class TestRequestFunding(AppTestCase):
         }
         for k, v in expected_loan_params.items():
             assert getattr(loan, k) == v
+        assert json.loads(loan.repayment_schedule) == exp_schedule
 
         mock_send_cash.assert_called_with(amount=3500, account_to='acc4')
 
@@ -484,6 +577,46 @@ class TestRequestFunding(AppTestCase):
         response = self.post_with_auth(payload)
         assert response.status_code == 400
 
+    @mock.patch('wk_client.logic.UserAccount.create_loan')
+    @mock.patch('wk_client.bank.send_cash')
+    def test_no_partial_funding(self, mock_send_cash, mock_create_loan):
+        mock_send_cash.return_value = {
+            'amount': 3500, 'timestamp': self.timestamp + timedelta(minutes=1), 'bank_ref': 'foo'}
+        mock_create_loan.side_effect = ValueError
+        ApprovalFactory(user=self.test_user, datetime=self.timestamp - timedelta(minutes=5), amount=5000, id=9,
+                        fee_amount=10)
+        payload = {'amount': 3500, 'approval_reference': 9}
+        with self.assertRaises(ValueError):
+            self.post_with_auth(payload)
+        # The cash was sent, so the funding stays on the ledger, only the fee and loan are rolled back.
+        cashflows = CashFlow.query.filter_by(user_id=self.test_user.id).all()
+        assert [(c.type, c.amount, c.bank_ref) for c in cashflows] == [(0, -3500, 'foo')]
+        assert Loan.query.filter_by(user_id=self.test_user.id).count() == 0
+
+    @mock.patch('wk_client.bank.send_cash')
+    def test_funding_commits_twice(self, mock_send_cash):
+        mock_send_cash.return_value = {
+            'amount': 3500, 'timestamp': self.timestamp + timedelta(minutes=1), 'bank_ref': 'foo'}
+        ApprovalFactory(user=self.test_user, datetime=self.timestamp - timedelta(minutes=5), amount=5000, id=9,
+                        fee_amount=10)
+        with mock.patch.object(db.session, 'commit', wraps=db.session.commit) as commit:
+            response = self.post_with_auth({'amount': 3500, 'approval_reference': 9})
+        assert response.status_code == 200
+        # The pending reservation, then the confirmation with the fee, loan and schedule.
+        assert commit.call_count == 2
+
+    @mock.patch('wk_client.bank.send_cash')
+    def test_sending_cash_failed_releases_amount(self, mock_send_cash):
+        mock_send_cash.side_effect = ValueError
+        ApprovalFactory(user=self.test_user, datetime=self.timestamp - timedelta(minutes=5), amount=5000, id=9)
+        assert self.post_with_auth({'amount': 3500, 'approval_reference': 9}).status_code == 400
+        assert CashFlow.query.filter_by(user_id=self.test_user.id).count() == 0
+
+        mock_send_cash.side_effect = None
+        mock_send_cash.return_value = {
+            'amount': 3500, 'timestamp': self.timestamp + timedelta(minutes=1), 'bank_ref': 'foo'}
+        assert self.post_with_auth({'amount': 3500, 'approval_reference': 9}).status_code == 200
+
     @mock.patch('wk_client.bank.send_cash')
     def test_request_funding_with_fee(self, mock_send_cash):
         mock_send_cash.return_value = {
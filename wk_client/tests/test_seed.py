@@ -0,0 +1,48 @@
+from datetime import datetime
+
+from wk_client.auth_utils import hash_pw
+from wk_client.db_utils import nuke_database
+from wk_client.logic import UserAccount
+from wk_client.models import User, Decision, Loan, CashFlow
+from wk_client.seed import seed_portfolio, SEED_PASSWORD
+from wk_client.tests.conftest import AppTestCase
+from wk_client.utils import get_repayment_amount
+
+
+class TestSeedPortfolio(AppTestCase):
+    def test_seed_portfolio(self):
+        counts = seed_portfolio(50, seed=1)
+        self.assertEqual(counts['user'], 50)
+        self.assertEqual(User.query.count(), 50)
+        self.assertEqual(Decision.query.count(), counts['decision'])
+        self.assertEqual(Loan.query.count(), counts['loan'])
+        self.assertEqual(CashFlow.query.count(), counts['cash_flow'])
+        self.assertGreater(counts['loan'], 0)
+        self.assertGreater(counts['cash_flow'], counts['loan'])
+        self.assertEqual(User.query.filter(User.updated.is_(None)).count(), 0)
+
+    def test_seed_portfolio_is_deterministic(self):
+        def snapshot():
+            return [(c.user_id, c.datetime, c.amount, c.bank_ref) for c in CashFlow.query.order_by(CashFlow.id)]
+        seed_portfolio(20, seed=3)
+        first = snapshot()
+        nuke_database()
+        seed_portfolio(20, seed=3)
+        self.assertListEqual(snapshot(), first)
+
+    def test_seed_portfolio_appends(self):
+        seed_portfolio(5, seed=1)
+        seed_portfolio(5, seed=2)
+        self.assertEqual(User.query.count(), 10)
+
+    def test_seeded_loans(self):
+        seed_portfolio(20, seed=1)
+        loan = Loan.query.first()
+        repayment, _ = get_repayment_amount(
+            loan.opening_balance, loan.duration_days, loan.repayment_frequency_days, loan.interest_daily)
+        self.assertAlmostEqual(loan.repayment_amount, round(repayment + 0.005, 2))
+
+        user = loan.user
+        self.assertEqual(user.hashed_password, hash_pw(SEED_PASSWORD, user.username))
+        account = UserAccount(user.id)
+        self.assertLess(account.balance(datetime(2019, 2, 23).date()), loan.opening_balance * 1.2)
@@ -0,0 +1,108 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+import sqlalchemy
+from flask import g
+
+from wk_client import create_app, db
+from wk_client.auth_utils import create_user
+from wk_client.config import TestConfig
+from wk_client.models import Decision, Loan, User
+from wk_client.sessions import recent_writers
+from wk_client.tests.conftest import encode_username_password
+from wk_client.tests.factories import create_loan_with_funding
+
+
+class TestReadRouting(unittest.TestCase):
+    """The replica is a separate database file that is never synced, so reads show where they went."""
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        replica_uri = 'sqlite:///' + os.path.join(self.tmp_dir, 'replica.db')
+        self.config = type('ReplicaConfig', (TestConfig,), {
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(self.tmp_dir, 'primary.db'),
+            'SQLALCHEMY_READ_DATABASE_URI': replica_uri,
+        })
+        self.app = create_app(self.config)
+        with self.app.app_context():
+            db.create_all()
+            user = create_user('foo', 'bar', 'acc')
+            create_loan_with_funding(user=user, start_datetime=datetime(2018, 4, 5), opening_balance=1000)
+            user.last_write = datetime(2018, 4, 5)  # Registered long ago.
+            db.session.commit()
+            self.user_id = user.id
+            db.session.remove()
+
+        replica = sqlalchemy.create_engine(replica_uri)
+        db.metadata.create_all(bind=replica)
+        replica.execute(User.__table__.insert(), id=self.user_id, username='foo', account='acc')
+        replica.dispose()
+        recent_writers.clear()
+
+    def tearDown(self):
+        recent_writers.clear()
+        shutil.rmtree(self.tmp_dir)
+
+    def get_balance(self, app=None):
+        response = (app or self.app).test_client().get('/get_schedule', headers={
+            'Authorization': encode_username_password(b'foo', b'bar'),
+            'Timestamp': datetime(2018, 5, 5).isoformat(),
+        })
+        assert response.status_code == 200
+        return json.loads(response.data)['balance']
+
+    def test_read_endpoint_uses_replica(self):
+        self.assertEqual(self.get_balance(), 0)
+
+    def test_read_your_writes(self):
+        recent_writers.set(self.user_id, True)
+        self.assertGreater(self.get_balance(), 0)
+
+    def test_other_endpoints_use_primary(self):
+        app = create_app(type('PrimaryConfig', (self.config,), {'DB_READ_ENDPOINTS': ()}))
+        self.assertGreater(self.get_balance(app), 0)
+
+    def test_write_switches_to_primary(self):
+        with self.app.test_request_context():
+            g.db_read_only = True
+            g.user_id = self.user_id
+            self.assertEqual(Loan.query.count(), 0)
+            db.session.add(Decision(user_id=self.user_id, decision='Declined', datetime=datetime(2018, 5, 5)))
+            db.session.flush()
+            self.assertEqual(Loan.query.count(), 1)
+            db.session.rollback()
+        self.assertTrue(recent_writers.get(self.user_id))
+
+    def test_write_seen_by_other_workers(self):
+        with self.app.test_request_context():
+            g.user_id = self.user_id
+            db.session.add(Decision(user_id=self.user_id, decision='Declined', datetime=datetime(2018, 5, 5)))
+            db.session.commit()
+            self.assertIsNotNone(User.query.get(self.user_id).last_write)
+        recent_writers.clear()  # Polling a worker that didn't see the write.
+        self.assertGreater(self.get_balance(), 0)
+        self.assertTrue(recent_writers.get(self.user_id))
+
+    def test_last_write_window_ends(self):
+        with self.app.app_context():
+            window = timedelta(seconds=self.app.config['READ_YOUR_WRITES_SECONDS'])
+            User.query.get(self.user_id).last_write = datetime.utcnow() - window - timedelta(seconds=1)
+            db.session.commit()
+        self.assertEqual(self.get_balance(), 0)
+
+    def test_no_last_write_without_replica(self):
+        app = create_app(type('PrimaryConfig', (self.config,), {'SQLALCHEMY_READ_DATABASE_URI': None}))
+        with app.test_request_context():
+            g.user_id = self.user_id
+            db.session.add(Decision(user_id=self.user_id, decision='Declined', datetime=datetime(2018, 5, 5)))
+            db.session.commit()
+            self.assertEqual(User.query.get(self.user_id).last_write, datetime(2018, 4, 5))
+
+    def test_replica_is_read_only(self):
+        with self.app.app_context():
+            with self.app.extensions['db_read_engine'].connect() as connection:
+                with self.assertRaises(sqlalchemy.exc.OperationalError):
+                    connection.execute(User.__table__.delete())
@@ -0,0 +1,151 @@
+import os
+import tempfile
+import uuid
+from datetime import date, datetime, timedelta
+from unittest import mock
+
+from generate_transactions import OUR_ACCOUNT
+from sqlalchemy import event
+
+from wk_client import bank, db, summary
+from wk_client.auth_utils import create_user
+from wk_client.commands import rebuild_borrower_summary_command, refresh_borrower_summary_command
+from wk_client.constants import FUNDING_TYPE, REPAYMENT_TYPE
+from wk_client.db_utils import unit_of_work
+from wk_client.logic import UserAccount
+from wk_client.models import BorrowerSummary, CashFlow, User
+from wk_client.seed import seed_portfolio
+from wk_client.tests.conftest import AppTestCase
+
+START = datetime(2018, 4, 5, 15, 5, 5)
+
+
+class TestBorrowerSummary(AppTestCase):
+    def setUp(self):
+        super(TestBorrowerSummary, self).setUp()
+        self.user = create_user('foo', 'bar', 'acc1')
+
+    def fund(self, amount=3500):
+        account = UserAccount(self.user.id)
+        with unit_of_work():
+            account.add_cashflow(-amount, START, FUNDING_TYPE, ref='funding')
+            loan = account.create_loan(START, amount)
+        return loan
+
+    def test_updated_on_funding(self):
+        loan = self.fund()
+        summary = BorrowerSummary.query.get(self.user.id)
+        self.assertEqual(summary.as_of, START.date())
+        self.assertAlmostEqual(summary.balance, 3500)
+        self.assertEqual(summary.active_loan_id, loan.id)
+        self.assertEqual(summary.next_due_date, START.date() + timedelta(30))
+        self.assertEqual(summary.next_due_amount, 321.1)
+        self.assertEqual(summary.arrears, 0)
+
+    def test_computed_once_per_commit(self):
+        with mock.patch.object(UserAccount, 'summary', autospec=True, side_effect=UserAccount.summary) as summary:
+            self.fund()
+        self.assertEqual(summary.call_count, 1)
+
+    def test_updated_on_single_write(self):
+        UserAccount(self.user.id).add_cashflow(-100, START, FUNDING_TYPE, ref='funding')
+        self.assertAlmostEqual(BorrowerSummary.query.get(self.user.id).balance, 100)
+
+    def test_rollback_discards(self):
+        account = UserAccount(self.user.id)
+        with self.assertRaises(ValueError):
+            with unit_of_work():
+                account.add_cashflow(-3500, START, FUNDING_TYPE, ref='funding')
+                raise ValueError
+        db.session.commit()
+        self.assertIsNone(BorrowerSummary.query.get(self.user.id))
+
+    def test_updated_on_fetched_repayment(self):
+        self.fund()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = os.path.join(tmp_dir, 'transactions.csv')
+            with open(filename, 'w') as f:
+                f.write('reference,datetime,account_from,account_to,amount\n')
+                f.write('ref1,2018-05-05T10:00:00,acc1,{},321.1\n'.format(OUR_ACCOUNT))
+            with mock.patch('generate_transactions.TRANSACTION_FILENAME', filename):
+                bank.fetch_cashflows()
+
+        summary = BorrowerSummary.query.get(self.user.id)
+        self.assertEqual(summary.as_of, date(2018, 5, 5))
+        self.assertLess(summary.balance, 3500)
+        self.assertEqual(summary.next_due_date, date(2018, 6, 4))
+        self.assertEqual(summary.arrears, 0)
+
+    def test_commit_loads_in_batches(self):
+        user_ids = [self.user.id] + [create_user('foo{}'.format(i), 'bar', 'acc{}'.format(i + 2)).id for i in range(2)]
+        for user_id in user_ids:
+            UserAccount(user_id).add_cashflow(-100, START, FUNDING_TYPE, ref='funding{}'.format(user_id))
+
+        def commit_queries(user_ids):
+            db.session.expunge_all()
+            for user_id in user_ids:
+                db.session.add(CashFlow(user_id=user_id, amount=10, datetime=START, type=REPAYMENT_TYPE,
+                                        bank_ref=uuid.uuid4().hex))
+                summary.mark_dirty(user_id, START)
+            statements = []
+            listener = lambda *args: statements.append(args[2])
+            event.listen(db.engine, 'before_cursor_execute', listener)
+            try:
+                db.session.commit()
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', listener)
+            return len([s for s in statements if s.startswith('SELECT')])
+
+        self.assertEqual(commit_queries(user_ids[:1]), commit_queries(user_ids))
+
+    def test_arrears(self):
+        self.fund()
+        summary = UserAccount(self.user.id).summary(date(2018, 6, 10))
+        self.assertAlmostEqual(summary['arrears'], 2 * 321.1)
+        self.assertEqual(summary['next_due_date'], date(2018, 7, 4))
+
+
+class TestRefresh(AppTestCase):
+    def setUp(self):
+        super(TestRefresh, self).setUp()
+        self.user_id = create_user('foo', 'bar', 'acc1').id
+        account = UserAccount(self.user_id)
+        with unit_of_work():
+            account.add_cashflow(-3500, START, FUNDING_TYPE, ref='funding')
+            account.create_loan(START, 3500)
+        self.repaid_id = create_user('repaid', 'bar', 'acc2').id
+        UserAccount(self.repaid_id).add_cashflow(-100, START, FUNDING_TYPE, ref='repaid funding')
+        UserAccount(self.repaid_id).add_cashflow(100, START, REPAYMENT_TYPE, ref='repaid repayment')
+
+    def test_refresh_command(self):
+        result = self.app.test_cli_runner().invoke(refresh_borrower_summary_command, ['--as-of', '2018-06-10'])
+        self.assertIn('1 summaries refreshed', result.output)
+
+        db.session.expire_all()
+        summary = BorrowerSummary.query.get(self.user_id)
+        self.assertEqual(summary.as_of, date(2018, 6, 10))
+        self.assertAlmostEqual(summary.arrears, 2 * 321.1)
+        self.assertEqual(summary.next_due_date, date(2018, 7, 4))
+        self.assertEqual(BorrowerSummary.query.get(self.repaid_id).as_of, START.date())
+
+    def test_newer_summary_left_alone(self):
+        BorrowerSummary.query.get(self.user_id).as_of = date(2018, 7, 1)
+        db.session.commit()
+        self.assertEqual(summary.refresh(date(2018, 6, 10)), 0)
+        db.session.expire_all()
+        self.assertEqual(BorrowerSummary.query.get(self.user_id).as_of, date(2018, 7, 1))
+
+
+class TestRebuild(AppTestCase):
+    def test_rebuild_command(self):
+        seed_portfolio(30, seed=1)
+        as_of = date(2019, 2, 23)
+        result = self.app.test_cli_runner().invoke(rebuild_borrower_summary_command, ['--as-of', as_of.isoformat()])
+        self.assertIn('30 summaries', result.output)
+
+        self.assertEqual(BorrowerSummary.query.count(), User.query.count())
+        for user in User.query:
+            expected = UserAccount(user.id).summary(as_of)
+            summary = BorrowerSummary.query.get(user.id)
+            for k, v in expected.items():
+                self.assertEqual(getattr(summary, k), v, k)
@@ -1,4 +1,9 @@
 import datetime
+import threading
+import time
+from collections import OrderedDict
+
+import dateutil.parser
 
 
 def get_repayment_amount(amount, duration_days, repayment_frequency_days, interest_daily, x_guess=None):
@@ -40,3 +45,50 @@ def get_date(x):
         return x
     else:
         raise TypeError
+
+
+def parse_datetime(value):
+    """Parses a timestamp string. ISO 8601 takes the fast path, anything else falls back to dateutil."""
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return dateutil.parser.parse(value)
+
+
+class TTLCache(object):
+    """Thread-safe LRU cache whose entries expire after a time to live (seconds)."""
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires = self._entries[key]
+            except KeyError:
+                return default
+            if expires < time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)